@@ -1,5 +1,5 @@
 # Import packages
-from dash import Dash, html, dcc, callback_context
+from dash import Dash, html, dcc, callback_context, no_update
 import pandas as pd
 import numpy as np
 import logging
@@ -8,21 +8,36 @@ import time
 from dash.dependencies import Input, Output
 
 # Import auxiliary functions from utils.py
-from utils import continent_options
+from utils import continent_options, citedby_ranges
 from figures import load_figures, load_topic_map, load_updated_figures
 from ewb_restapi_client import EWBRestapiClient
+import metrics
+import tracing
 
 logging.basicConfig(level='DEBUG')
 logger = logging.getLogger('Restapi')
 restapi = EWBRestapiClient(logger)
+# Collections of the corpus and the topic model shown in the dashboard
+corpus_collection = 'scopus'
+model_collection = 'mallet-50'
 
 #Give enough time to initialize Solr
 time = time.sleep(20)
 
 df = pd.read_parquet('/data/source/SCOPUS.parquet/SCOPUS_BIGDATA_5.parquet')
 
+# Number of publications per year, as counted by Solr
+year_counts = None
+api_resp = restapi.years_histogram(corpus_collection=corpus_collection)
+if api_resp.status_code != 200:
+    logger.error(
+        f"-- -- Error extracting SCOPUS from Solr")
+elif api_resp.results:
+    year_counts = pd.DataFrame(api_resp.results).rename(
+        columns={'year': 'Year', 'ndocs': 'Number of Publications'})
+
 # Load Figures
-fig_cities, fig_institutions, fig_fund_sponsor, fig_openaccess, fig_citedby, fig_years, fig_map = load_figures(df=df, continent='world')
+fig_cities, fig_institutions, fig_fund_sponsor, fig_openaccess, fig_citedby, fig_years, fig_map = load_figures(df=df, continent='world', year_counts=year_counts)
 
 # ---------------------- TOPIC MAP ----------------------- #
 # Retrieve model information
@@ -38,10 +53,18 @@ fig_topic_map = load_topic_map(df_topic)
 
 # Initialize the app
 app = Dash(__name__)
+# Serve the runtime metrics on /metrics
+metrics.install(app.server)
+# Trace the requests, propagating the trace to the Rest API
+tracing.install(app.server)
+# Bound the requests to the Rest API of each callback by a common deadline
+restapi.install(app.server)
 
 # App layout
 app.layout = html.Div([
     html.H1('Bussiness Intelligence Dashboard for Scientific Publications', style={'text-align': 'center'}),
+    # Number of publications of the current selection
+    html.Div(id='selection-info', style={'text-align': 'center'}),
 
     # First row (topic map and bar chart)
         html.Div([
@@ -84,7 +107,8 @@ app.layout = html.Div([
         Output('fund', 'figure'),
         Output('years', 'figure'), 
         Output('openaccess', 'figure'),
-        Output('citedby', 'figure') 
+        Output('citedby', 'figure'),
+        Output('selection-info', 'children')
     ],
     [
         Input('cities', 'clickData'),
@@ -100,7 +124,8 @@ app.layout = html.Div([
 def update_data(click_data_cities, click_data_topicmap, click_data_institutions,
                 click_data_fund, click_data_years, click_data_openaccess, 
                 click_data_citedby, selected_continent):
-    updated_df = df.copy()
+    # Filters of the selection; the figures are built from the counts of the matching documents computed by Solr, without retrieving the documents
+    filters = {}
     trigger_id='all'
     ctx = callback_context
 
@@ -108,82 +133,52 @@ def update_data(click_data_cities, click_data_topicmap, click_data_institutions,
         trigger_id = ctx.triggered[0]['prop_id'].split('.')[0]
 
         if trigger_id == 'cities' and click_data_cities:
-            city = click_data_cities['points'][0]['label']
-            api_resp = restapi.city(city=city)
-            if api_resp.status_code != 200:
-                logger.error(
-                    f"-- -- Error extracting SCOPUS from Solr")
-            else:
-                updated_df = pd.DataFrame(api_resp.results)
+            filters['city'] = click_data_cities['points'][0]['label']
 
         elif trigger_id == 'topic-map' and click_data_topicmap:
-            topic_label = click_data_topicmap['points'][0]['customdata']
-            api_resp = restapi.topic_label(topic_label=topic_label)
-            if api_resp.status_code != 200:
-                logger.error(
-                    f"-- -- Error extracting SCOPUS from Solr")
-            else:
-                updated_df = pd.DataFrame(api_resp.results)
+            filters['topic_label'] = click_data_topicmap['points'][0]['customdata']
 
         elif trigger_id == 'institutions' and click_data_institutions:
-            institution = click_data_institutions['points'][0]['label']
-            api_resp = restapi.institution(institution=institution)
-            if api_resp.status_code != 200:
-                logger.error(
-                    f"-- -- Error extracting SCOPUS from Solr")
-            else:
-                updated_df = pd.DataFrame(api_resp.results)
+            filters['institution'] = click_data_institutions['points'][0]['label']
 
         elif trigger_id == 'fund' and click_data_fund:
-            fund = click_data_fund['points'][0]['label']
-            api_resp = restapi.fund(fund=fund)
-            if api_resp.status_code != 200:
-                logger.error(
-                    f"-- -- Error extracting SCOPUS from Solr")
-            else:
-                updated_df = pd.DataFrame(api_resp.results)
+            filters['fund_sponsor'] = click_data_fund['points'][0]['label']
 
         elif trigger_id == 'years' and click_data_years:
-            year = click_data_years['points'][0]['x']
-            api_resp = restapi.year(year=year)
-            if api_resp.status_code != 200:
-                logger.error(
-                    f"-- -- Error extracting SCOPUS from Solr")
-            else:
-                updated_df = pd.DataFrame(api_resp.results)
+            filters['year'] = click_data_years['points'][0]['x']
 
         elif trigger_id == 'openaccess' and click_data_openaccess:
             selected_category = click_data_openaccess['points'][0]['label']
-            api_resp = restapi.open_access(selected_category=selected_category)
-            if api_resp.status_code != 200:
-                logger.error(
-                    f"-- -- Error extracting SCOPUS from Solr")
-            else:
-                updated_df = pd.DataFrame(api_resp.results)
+            filters['open_access'] = '1' if selected_category == 'Open Access' else '0'
 
         elif trigger_id == 'citedby' and click_data_citedby:
             label = click_data_citedby['points'][0]['label']
-            api_resp = restapi.cited_count(label=label)
-            if api_resp.status_code != 200:
-                logger.error(
-                    f"-- -- Error extracting SCOPUS from Solr")
-            else:
-                updated_df = pd.DataFrame(api_resp.results)
+            for range_label, _, lower_limit, upper_limit in citedby_ranges:
+                if range_label == label:
+                    filters['lower_limit'] = lower_limit
+                    filters['upper_limit'] = upper_limit
 
         elif trigger_id == 'continent-dropdown' and selected_continent:
-            api_resp = restapi.continent(continent=selected_continent)
-            if api_resp.status_code != 200:
-                logger.error(
-                    f"-- -- Error extracting SCOPUS from Solr")
-            else:
-                updated_df = pd.DataFrame(api_resp.results)
+            filters['continent'] = selected_continent
+
+    api_resp = restapi.doc_counts(corpus_collection=corpus_collection,
+                                  model_collection=model_collection, **filters)
+    if api_resp.status_code != 200:
+        logger.error(
+            f"-- -- Error extracting SCOPUS from Solr")
+        return [no_update] * 8
     
-    updated_fig_cities, updated_fig_institutions, updated_fig_fund_sponsor, updated_fig_openaccess , updated_fig_citedby, updated_fig_years, updated_fig_map = load_updated_figures(df=updated_df, continent = selected_continent, trigger_id=trigger_id,
+    updated_fig_cities, updated_fig_institutions, updated_fig_fund_sponsor, updated_fig_openaccess , updated_fig_citedby, updated_fig_years, updated_fig_map = load_updated_figures(counts=api_resp.results, continent = selected_continent, trigger_id=trigger_id,
                                                                                                                                                                                        fig_fund_sponsor=fig_fund_sponsor, fig_openaccess=fig_openaccess, 
                                                                                                                                                                                        fig_citedby=fig_citedby, fig_years=fig_years)
 
+    # Number of publications of the selection (the documents themselves are requested page by page)
+    selection_info = f"{api_resp.results['numFound']} publications"
+    if api_resp.results.get('partial') or api_resp.partial:
+        selection_info += " (partial counts)"
+
     # Devolver las figuras actualizadas
-    return updated_fig_cities, updated_fig_map, updated_fig_institutions, updated_fig_fund_sponsor, updated_fig_years, updated_fig_openaccess, updated_fig_citedby
+    return updated_fig_cities, updated_fig_map, updated_fig_institutions, updated_fig_fund_sponsor, updated_fig_years, updated_fig_openaccess, updated_fig_citedby, selection_info
 
 
 # Run the app
@@ -1,7 +1,16 @@
 import logging
 import os
+import time
+from contextvars import ContextVar
+from urllib import parse
 
+import metrics
 import requests
+from flask import Flask, g
+from tracing import CLIENT, tracer
+
+# Time (time.monotonic) by which the dashboard request being served must be answered
+_deadline = ContextVar("restapi_deadline", default=None)
 
 
 class RestAPIResponse(object):
@@ -19,13 +28,31 @@ class RestAPIResponse(object):
         # Get JSON object of the result
         self.results = resp.json()
 
+        # Whether the results are those found before the deadline of the request
+        self.partial = resp.headers.get('X-Partial-Results') == 'true'
+
         if self.status_code == 200:
-            logger.info(f"-- -- RestAPI request acknowledged")
+            logger.info(f"-- -- RestAPI request acknowledged"
+                        f"{' (partial results)' if self.partial else ''}")
         else:
             logger.info(
-                f"-- -- RestAPI request generated an error: {self.results['error']}")
+                f"-- -- RestAPI request generated an error: "
+                f"{self.results.get('error') or self.results.get('message')}")
         return
 
+    @classmethod
+    def from_error(cls,
+                   status_code: int,
+                   message: str,
+                   logger: logging.Logger) -> 'RestAPIResponse':
+        """Creates a response for a request that could not be sent or answered."""
+        api_resp = cls.__new__(cls)
+        api_resp.status_code = status_code
+        api_resp.results = {'message': message}
+        api_resp.partial = False
+        logger.info(f"-- -- RestAPI request generated an error: {message}")
+        return api_resp
+
 
 class EWBRestapiClient(object):
     """
@@ -42,6 +69,12 @@ class EWBRestapiClient(object):
 
         # Get the RestAPI URL from the environment variables
         self.restapi_url = os.environ.get('RESTAPI_URL')
+        # Number of documents requested per page in the document queries (the charts are built from the counts of getDocCounts, so only the page that is shown is requested)
+        self.page_size = int(os.environ.get('RESTAPI_PAGE_SIZE', 100))
+        # Time in seconds within which each request to the dashboard must be answered, and whether the Rest API may answer with the results found by then
+        self.deadline = float(os.environ.get('RESTAPI_DEADLINE', 60))
+        self.allow_partial = os.environ.get(
+            'RESTAPI_PARTIAL_RESULTS', 'false').lower() in ('1', 'true')
 
         # Initialize requests session and logger
         self.restapi = requests.Session()
@@ -55,6 +88,21 @@ class EWBRestapiClient(object):
         
         return
 
+    def install(self, server: Flask) -> None:
+        """Bounds the requests to the Rest API sent while serving each request to the dashboard (e.g., a Dash callback) by a common deadline, which is passed on to the Rest API."""
+
+        @server.before_request
+        def _start_deadline():
+            g._restapi_deadline = _deadline.set(time.monotonic() + self.deadline)
+
+        @server.teardown_request
+        def _end_deadline(exc):
+            token = g.pop("_restapi_deadline", None)
+            if token is not None:
+                _deadline.reset(token)
+
+        return
+
     def _do_request(self,
                     type: str,
                     url: str,
@@ -79,35 +127,106 @@ class EWBRestapiClient(object):
             An object of the RestAPIResponse class.
         """
 
-        # Send request
-        if type == "get":
-            resp = requests.get(
-                url=url,
-                timeout=timeout,
-                **params
-            )
-        elif type == "post":
-            resp = requests.post(
+        if type not in ("get", "post"):
+            self.logger.error(f"-- -- Invalid type {type}")
+            return
+
+        endpoint = parse.urlsplit(url).path
+
+        # Bound the request by the deadline of the dashboard request being served, if any
+        deadline = _deadline.get()
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return RestAPIResponse.from_error(
+                    504, f"Deadline exceeded before requesting {endpoint}", self.logger)
+            timeout = min(timeout, remaining)
+            params["headers"] = dict(params.get("headers") or {})
+            params["headers"]["X-Deadline-Ms"] = str(int(remaining * 1000))
+            if self.allow_partial:
+                params["headers"]["X-Allow-Partial-Results"] = "true"
+
+        # Send request, within a span whose context is propagated to the Rest API
+        span, token = tracer.start("restapi {} {}".format(type.upper(), endpoint),
+                                   kind=CLIENT, **{"http.method": type.upper(),
+                                                   "http.route": endpoint})
+        params["headers"] = tracer.inject(params.get("headers"))
+        time_start = time.perf_counter()
+        try:
+            resp = getattr(requests, type)(
                 url=url,
                 timeout=timeout,
                 **params
             )
-        else:
-            self.logger.error(f"-- -- Invalid type {type}")
-            return
+        except requests.exceptions.Timeout as e:
+            tracer.finish(span, token, e)
+            if deadline is None:
+                raise
+            return RestAPIResponse.from_error(
+                504, f"Deadline exceeded while requesting {endpoint}", self.logger)
+        except Exception as e:
+            tracer.finish(span, token, e)
+            raise
+        if span is not None:
+            span.set("http.status_code", resp.status_code)
+            span.set("http.response_size", len(resp.content))
+        tracer.finish(span, token)
+        metrics.observe_restapi(endpoint,
+                                time.perf_counter() - time_start,
+                                resp.status_code, len(resp.content))
 
         # Parse Restapi response
         api_resp = RestAPIResponse(resp, self.logger)
 
         return api_resp
 
+    def _do_page_request(self,
+                         url: str,
+                         rows: int = None,
+                         cursor: str = '*',
+                         timeout: int = 10,
+                         **params) -> RestAPIResponse:
+        """Sends a document query to the Rest API and returns one page of its results.
+
+        Parameters
+        ----------
+        url : str
+            The URL of the Rest API.
+        rows : int, optional
+            Number of documents of the page, by default self.page_size.
+        cursor : str, optional
+            Cursor mark of the page, as returned in 'nextCursorMark' by the previous page, by default '*' (first page).
+        timeout : int, optional
+            The timeout of the request in seconds, by default 10.
+        **params: dict
+            The parameters of the request.
+
+        Returns
+        -------
+        RestAPIResponse: RestAPIResponse
+            An object of the RestAPIResponse class whose results are the page: the number of documents matching the query ('numFound'), the cursor of the next page ('nextCursorMark', None if this is the last one) and the documents ('docs').
+        """
+
+        query_params = dict(params.pop('params', {}))
+        query_params['rows'] = rows or self.page_size
+        query_params['cursor'] = cursor
+
+        return self._do_request(
+            type="get", url=url, timeout=timeout, params=query_params, **params)
+
     def open_access(self,
-                    selected_category: str) -> RestAPIResponse:
+                    selected_category: str,
+                    rows: int = None,
+                    cursor: str = '*') -> RestAPIResponse:
         """Execute query to filter by open access.
 
         Parameters
         ----------
         selected_category : str
+        rows : int, optional
+            Number of documents of the page, by default self.page_size.
+        cursor : str, optional
+            Cursor mark of the page ('*' for the first one).
 
         Returns
         -------
@@ -129,18 +248,25 @@ class EWBRestapiClient(object):
         self.logger.info(f"-- -- The restapi url is: {url_}")
 
         # Send request to RestAPI
-        api_resp = self._do_request(
-            type="get", url=url_, timeout=120, headers=headers_, params=params_)
+        api_resp = self._do_page_request(
+            url=url_, rows=rows, cursor=cursor, timeout=120,
+            headers=headers_, params=params_)
 
         return api_resp
     
-    def continent(self, 
-                  continent: str) -> RestAPIResponse:
+    def continent(self,
+                  continent: str,
+                  rows: int = None,
+                  cursor: str = '*') -> RestAPIResponse:
         """Execute query to filter by open access.
 
         Parameters
         ----------
         continent : str
+        rows : int, optional
+            Number of documents of the page, by default self.page_size.
+        cursor : str, optional
+            Cursor mark of the page ('*' for the first one).
 
         Returns
         -------
@@ -159,18 +285,25 @@ class EWBRestapiClient(object):
         self.logger.info(f"-- -- The restapi url is: {url_}")
 
         # Send request to RestAPI
-        api_resp = self._do_request(
-            type="get", url=url_, timeout=120, headers=headers_, params=params_)
+        api_resp = self._do_page_request(
+            url=url_, rows=rows, cursor=cursor, timeout=120,
+            headers=headers_, params=params_)
 
         return api_resp
     
-    def city(self, 
-                  city: str) -> RestAPIResponse:
+    def city(self,
+             city: str,
+             rows: int = None,
+             cursor: str = '*') -> RestAPIResponse:
         """Execute query to filter by open access.
 
         Parameters
         ----------
         city : str
+        rows : int, optional
+            Number of documents of the page, by default self.page_size.
+        cursor : str, optional
+            Cursor mark of the page ('*' for the first one).
 
         Returns
         -------
@@ -189,18 +322,25 @@ class EWBRestapiClient(object):
         self.logger.info(f"-- -- The restapi url is: {url_}")
 
         # Send request to RestAPI
-        api_resp = self._do_request(
-            type="get", url=url_, timeout=120, headers=headers_, params=params_)
+        api_resp = self._do_page_request(
+            url=url_, rows=rows, cursor=cursor, timeout=120,
+            headers=headers_, params=params_)
 
         return api_resp
 
-    def cited_count(self, 
-                  label: str) -> RestAPIResponse:
+    def cited_count(self,
+                    label: str,
+                    rows: int = None,
+                    cursor: str = '*') -> RestAPIResponse:
         """Execute query to filter by open access.
 
         Parameters
         ----------
         label : str
+        rows : int, optional
+            Number of documents of the page, by default self.page_size.
+        cursor : str, optional
+            Cursor mark of the page ('*' for the first one).
 
         Returns
         -------
@@ -233,18 +373,25 @@ class EWBRestapiClient(object):
         self.logger.info(f"-- -- The restapi url is: {url_}")
 
         # Send request to RestAPI
-        api_resp = self._do_request(
-            type="get", url=url_, timeout=120, headers=headers_, params=params_)
+        api_resp = self._do_page_request(
+            url=url_, rows=rows, cursor=cursor, timeout=120,
+            headers=headers_, params=params_)
 
         return api_resp
 
-    def fund(self, 
-                  fund: str) -> RestAPIResponse:
+    def fund(self,
+             fund: str,
+             rows: int = None,
+             cursor: str = '*') -> RestAPIResponse:
         """Execute query to filter by open access.
 
         Parameters
         ----------
         fund : str
+        rows : int, optional
+            Number of documents of the page, by default self.page_size.
+        cursor : str, optional
+            Cursor mark of the page ('*' for the first one).
 
         Returns
         -------
@@ -263,18 +410,25 @@ class EWBRestapiClient(object):
         self.logger.info(f"-- -- The restapi url is: {url_}")
 
         # Send request to RestAPI
-        api_resp = self._do_request(
-            type="get", url=url_, timeout=120, headers=headers_, params=params_)
+        api_resp = self._do_page_request(
+            url=url_, rows=rows, cursor=cursor, timeout=120,
+            headers=headers_, params=params_)
 
         return api_resp
     
-    def institution(self, 
-                  institution: str) -> RestAPIResponse:
+    def institution(self,
+                    institution: str,
+                    rows: int = None,
+                    cursor: str = '*') -> RestAPIResponse:
         """Execute query to filter by open access.
 
         Parameters
         ----------
         institution : str
+        rows : int, optional
+            Number of documents of the page, by default self.page_size.
+        cursor : str, optional
+            Cursor mark of the page ('*' for the first one).
 
         Returns
         -------
@@ -293,18 +447,25 @@ class EWBRestapiClient(object):
         self.logger.info(f"-- -- The restapi url is: {url_}")
 
         # Send request to RestAPI
-        api_resp = self._do_request(
-            type="get", url=url_, timeout=120, headers=headers_, params=params_)
+        api_resp = self._do_page_request(
+            url=url_, rows=rows, cursor=cursor, timeout=120,
+            headers=headers_, params=params_)
 
         return api_resp
     
-    def topic_label(self, 
-                  topic_label: str) -> RestAPIResponse:
+    def topic_label(self,
+                    topic_label: str,
+                    rows: int = None,
+                    cursor: str = '*') -> RestAPIResponse:
         """Execute query to filter by open access.
 
         Parameters
         ----------
         topic_label : str
+        rows : int, optional
+            Number of documents of the page, by default self.page_size.
+        cursor : str, optional
+            Cursor mark of the page ('*' for the first one).
 
         Returns
         -------
@@ -324,18 +485,25 @@ class EWBRestapiClient(object):
         self.logger.info(f"-- -- The restapi url is: {url_}")
 
         # Send request to RestAPI
-        api_resp = self._do_request(
-            type="get", url=url_, timeout=120, headers=headers_, params=params_)
+        api_resp = self._do_page_request(
+            url=url_, rows=rows, cursor=cursor, timeout=120,
+            headers=headers_, params=params_)
 
         return api_resp
     
-    def year(self, 
-                  year: str) -> RestAPIResponse:
+    def year(self,
+             year: str,
+             rows: int = None,
+             cursor: str = '*') -> RestAPIResponse:
         """Execute query to filter by open access.
 
         Parameters
         ----------
         year : str
+        rows : int, optional
+            Number of documents of the page, by default self.page_size.
+        cursor : str, optional
+            Cursor mark of the page ('*' for the first one).
 
         Returns
         -------
@@ -353,6 +521,47 @@ class EWBRestapiClient(object):
         url_ = '{}/queries/getDocsByYear'.format(self.restapi_url)
         self.logger.info(f"-- -- The restapi url is: {url_}")
 
+        # Send request to RestAPI
+        api_resp = self._do_page_request(
+            url=url_, rows=rows, cursor=cursor, timeout=120,
+            headers=headers_, params=params_)
+
+        return api_resp
+
+    def doc_counts(self,
+                   corpus_collection: str,
+                   model_collection: str = None,
+                   **filters) -> RestAPIResponse:
+        """Execute query to get the number of documents that match the given filters per city, institution, funding sponsor, country, year, open access and number of citations, without retrieving the documents.
+
+        Parameters
+        ----------
+        corpus_collection : str
+            Name of the corpus collection.
+        model_collection : str, optional
+            Name of the model collection, required to filter by topic_label.
+        **filters: dict
+            The filters of the query (open_access, year, continent, city, institution, topic_label, lower_limit, upper_limit, fund_sponsor). Those that are None are not applied.
+
+        Returns
+        -------
+        RestAPIResponse: RestAPIResponse
+            An object of the RestAPIResponse class whose results are the number of documents matching the filters ('numFound'), the facet counts of each field, including open access ('facets'), and the counts of the ranges of the number of citations ('queries').
+        """
+
+        headers_ = {'Accept': 'application/json'}
+
+        params_ = {
+            'corpus_collection': corpus_collection,
+            'model_collection': model_collection,
+            **filters
+        }
+        params_ = {key: value for key, value in params_.items()
+                   if value is not None}
+
+        url_ = '{}/queries/getDocCounts'.format(self.restapi_url)
+        self.logger.info(f"-- -- The restapi url is: {url_}")
+
         # Send request to RestAPI
         api_resp = self._do_request(
             type="get", url=url_, timeout=120, headers=headers_, params=params_)
@@ -385,4 +594,33 @@ class EWBRestapiClient(object):
         api_resp = self._do_request(
             type="get", url=url_, timeout=120, headers=headers_, params=params_)
 
-        return api_resp
\ No newline at end of file
+        return api_resp
+
+    def years_histogram(self, corpus_collection: str) -> RestAPIResponse:
+        """Execute query to get the number of publications per year.
+
+        Parameters
+        ----------
+        corpus_collection : str
+            Name of the corpus collection.
+
+        Returns
+        -------
+        RestAPIResponse: RestAPIResponse
+            An object of the RestAPIResponse class.
+        """
+
+        headers_ = {'Accept': 'application/json'}
+
+        params_ = {
+            'corpus_collection': corpus_collection,
+        }
+
+        url_ = '{}/queries/getNrDocsByYear'.format(self.restapi_url)
+        self.logger.info(f"-- -- The restapi url is: {url_}")
+
+        # Send request to RestAPI
+        api_resp = self._do_request(
+            type="get", url=url_, timeout=120, headers=headers_, params=params_)
+
+        return api_resp
@@ -0,0 +1,186 @@
+"""
+Runtime metrics of the dashboard, exposed in the Prometheus text format on /metrics:
+
+    * Latency and status of the requests served by the dashboard, per route (and per callback output for Dash callbacks).
+    * Latency, status and response size of the requests sent to the Rest API, per endpoint.
+    * Time spent building the figures (pandas and plotly work), per function.
+    * Requests being served.
+
+All of them are recorded with fixed-bucket histograms and counters.
+"""
+
+import bisect
+import functools
+import threading
+import time
+
+from flask import Flask, Response, g, request
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS_S = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                     0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(11))
+
+
+class Histogram(object):
+    """
+    A fixed-bucket histogram.
+    """
+
+    def __init__(self, buckets: tuple) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[idx] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Family(object):
+    """
+    A metric (histogram or counter) with one series per combination of label values.
+    """
+
+    def __init__(self, name: str, kind: str, help: str, labels: tuple, buckets: tuple = None) -> None:
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values) -> None:
+        hist = self.series.get(label_values)
+        if hist is None:
+            with self._lock:
+                hist = self.series.setdefault(label_values, Histogram(self.buckets))
+        hist.observe(value)
+
+    def inc(self, *label_values) -> None:
+        with self._lock:
+            self.series[label_values] = self.series.get(label_values, 0) + 1
+
+    def render(self, lines: list) -> None:
+        lines.append("# HELP {} {}".format(self.name, self.help))
+        lines.append("# TYPE {} {}".format(self.name, self.kind))
+        for label_values, series in list(self.series.items()):
+            labels = dict(zip(self.labels, label_values))
+            if self.kind == "counter":
+                lines.append("{}{} {}".format(self.name, _labels(labels), series))
+                continue
+            with series._lock:
+                counts = list(series.counts)
+                sum_, count = series.sum, series.count
+            acc = 0
+            for bound, n in zip(list(self.buckets) + ["+Inf"], counts):
+                acc += n
+                lines.append("{}_bucket{} {}".format(
+                    self.name, _labels(dict(labels, le="{:g}".format(bound)
+                                            if bound != "+Inf" else bound)), acc))
+            lines.append("{}_sum{} {}".format(self.name, _labels(labels), sum_))
+            lines.append("{}_count{} {}".format(self.name, _labels(labels), count))
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(
+        key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels.items()) + "}"
+
+
+request_duration = Family("ewb_dash_request_duration_seconds", "histogram",
+                          "Latency of the requests served by the dashboard, per route and callback output.",
+                          ("route", "output"), LATENCY_BUCKETS_S)
+requests_total = Family("ewb_dash_requests_total", "counter",
+                        "Requests served by the dashboard, per route and status code.",
+                        ("route", "status"))
+restapi_duration = Family("ewb_dash_restapi_duration_seconds", "histogram",
+                          "Latency of the requests sent to the Rest API, per endpoint.",
+                          ("endpoint",), LATENCY_BUCKETS_S)
+restapi_bytes = Family("ewb_dash_restapi_response_bytes", "histogram",
+                       "Size of the responses of the Rest API, per endpoint.",
+                       ("endpoint",), BYTES_BUCKETS)
+restapi_total = Family("ewb_dash_restapi_requests_total", "counter",
+                       "Requests sent to the Rest API, per endpoint and status code.",
+                       ("endpoint", "status"))
+figure_duration = Family("ewb_dash_figure_duration_seconds", "histogram",
+                         "Time spent building the figures, per function.",
+                         ("function",), LATENCY_BUCKETS_S)
+
+FAMILIES = (request_duration, requests_total, restapi_duration,
+            restapi_bytes, restapi_total, figure_duration)
+
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+
+def observe_restapi(endpoint: str, seconds: float, status: int, nbytes: int) -> None:
+    """Records a request sent to the Rest API."""
+    restapi_duration.observe(seconds, endpoint)
+    restapi_bytes.observe(nbytes, endpoint)
+    restapi_total.inc(endpoint, status)
+
+
+def timed(func):
+    """Decorator that records the time spent in the decorated function."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            figure_duration.observe(time.perf_counter() - start, func.__name__)
+    return wrapper
+
+
+def render() -> str:
+    lines = []
+    for family in FAMILIES:
+        family.render(lines)
+    lines.append("# HELP ewb_dash_requests_in_flight Requests being served by the dashboard.")
+    lines.append("# TYPE ewb_dash_requests_in_flight gauge")
+    lines.append("ewb_dash_requests_in_flight {}".format(_in_flight))
+    return "\n".join(lines) + "\n"
+
+
+def install(server: Flask) -> None:
+    """Records the metrics of the requests served by the Flask server of the dashboard and serves them on /metrics."""
+
+    @server.before_request
+    def _start():
+        global _in_flight
+        g._metrics_start = time.perf_counter()
+        with _in_flight_lock:
+            _in_flight += 1
+
+    @server.after_request
+    def _record(response):
+        start = g.get("_metrics_start")
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            # Callbacks are told apart by the components they update
+            output = ""
+            if route.endswith("_dash-update-component"):
+                output = (request.get_json(silent=True) or {}).get("output", "")
+            request_duration.observe(time.perf_counter() - start, route, output)
+            requests_total.inc(route, response.status_code)
+        return response
+
+    @server.teardown_request
+    def _end(exc):
+        global _in_flight
+        if g.get("_metrics_start") is not None:
+            with _in_flight_lock:
+                _in_flight -= 1
+
+    server.add_url_rule("/metrics", "metrics",
+                        lambda: Response(render(), content_type=CONTENT_TYPE))
@@ -0,0 +1,196 @@
+"""
+Tracing of the requests served by the dashboard, so that a slow click can be followed into the Rest API and Solr:
+
+    * Each request served by the dashboard (e.g., a Dash callback) is the root span of a trace.
+    * Each request sent to the Rest API is a child span, whose context is sent in the W3C 'traceparent' header, so that the spans recorded by the Rest API belong to the same trace.
+    * The functions that build the figures are child spans too (see traced).
+
+Spans are written in the OTLP/JSON format (one ExportTraceServiceRequest per line) to the file given in the TRACES_FILE environment variable; tracing is disabled if it is not set. The traces of the dashboard and of the Rest API are read together by restapi/scripts/trace_view.py.
+"""
+
+import functools
+import json
+import os
+import pathlib
+import re
+import threading
+import time
+from contextvars import ContextVar
+
+from flask import Flask, g, request
+
+# Kinds of spans (as in OTLP)
+INTERNAL = 1
+SERVER = 2
+CLIENT = 3
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+class Span(object):
+    """
+    A timed operation of a trace.
+    """
+
+    def __init__(self, name: str, trace_id: str, parent_id: str, kind: int, attributes: dict) -> None:
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes)
+        self.error = None
+
+    def set(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    @property
+    def traceparent(self) -> str:
+        return "00-{}-{}-01".format(self.trace_id, self.span_id)
+
+    def to_otlp(self) -> dict:
+        span = {"traceId": self.trace_id,
+                "spanId": self.span_id,
+                "name": self.name,
+                "kind": self.kind,
+                "startTimeUnixNano": str(self.start_ns),
+                "endTimeUnixNano": str(self.end_ns),
+                "attributes": [_attribute(key, value) for key, value in self.attributes.items()
+                               if value is not None]}
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.error is not None:
+            span["status"] = {"code": 2, "message": self.error}
+        return span
+
+
+def _attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class Tracer(object):
+    """
+    Creates the spans of the dashboard and writes them, one line per trace, when the root span ends.
+    """
+
+    def __init__(self, path: str = None, service: str = "dash-app",
+                 max_bytes: int = 100 * 1024 ** 2) -> None:
+        self.path = pathlib.Path(path) if path else None
+        self.enabled = self.path is not None
+        if self.enabled:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.service = service
+        self.max_bytes = max_bytes
+        self._current = ContextVar("current_span", default=None)
+        self._spans = []
+        self._lock = threading.Lock()
+
+    @property
+    def current(self) -> Span:
+        return self._current.get()
+
+    def start(self, name: str, kind: int = INTERNAL, traceparent: str = None, **attributes):
+        """Starts a span as a child of the current span (or of the span given by the traceparent header, or as the root of a new trace) and makes it the current span."""
+        if not self.enabled:
+            return None, None
+        parent = self._current.get()
+        if parent is not None:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            match = _TRACEPARENT.match(traceparent or "")
+            trace_id, parent_id = match.groups() if match else (os.urandom(16).hex(), None)
+        span = Span(name, trace_id, parent_id, kind, attributes)
+        return span, self._current.set(span)
+
+    def finish(self, span: Span, token, error: BaseException = None) -> None:
+        """Ends a span started with start."""
+        if span is None:
+            return
+        span.end_ns = time.time_ns()
+        if error is not None:
+            span.error = "{}: {}".format(type(error).__name__, error)
+        try:
+            self._current.reset(token)
+        except ValueError:
+            pass
+        with self._lock:
+            self._spans.append(span)
+            if span.parent_id is None or span.kind == SERVER or len(self._spans) >= 64:
+                self._write()
+
+    def inject(self, headers: dict = None) -> dict:
+        """Returns the given headers (or new ones) with the traceparent of the current span, if any."""
+        headers = dict(headers or {})
+        span = self._current.get()
+        if span is not None:
+            headers["traceparent"] = span.traceparent
+        return headers
+
+    def _write(self) -> None:
+        spans, self._spans = self._spans, []
+        line = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": [_attribute("service.name", self.service)]},
+            "scopeSpans": [{"scope": {"name": "ewb"},
+                            "spans": [span.to_otlp() for span in spans]}]}]},
+            separators=(",", ":"))
+        try:
+            if self.path.exists() and self.path.stat().st_size > self.max_bytes:
+                self.path.replace(self.path.with_name(self.path.name + ".1"))
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+        except OSError:
+            pass
+
+
+tracer = Tracer(os.environ.get("TRACES_FILE"))
+
+
+def traced(func):
+    """Decorator that records the decorated function as a span of the current trace."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        span, token = tracer.start(func.__name__)
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            tracer.finish(span, token, e)
+            raise
+        tracer.finish(span, token)
+        return result
+    return wrapper
+
+
+def install(server: Flask) -> None:
+    """Records a root span for each request served by the Flask server of the dashboard."""
+
+    @server.before_request
+    def _start():
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        # Callbacks are told apart by the components they update
+        output = None
+        if route.endswith("_dash-update-component"):
+            output = (request.get_json(silent=True) or {}).get("output")
+        g._trace = tracer.start(
+            "{} {}".format(request.method, route), kind=SERVER,
+            traceparent=request.headers.get("traceparent"),
+            **{"http.method": request.method, "http.route": route, "dash.output": output})
+
+    @server.after_request
+    def _record(response):
+        span, _ = g.get("_trace", (None, None))
+        if span is not None:
+            span.set("http.status_code", response.status_code)
+        return response
+
+    @server.teardown_request
+    def _end(exc):
+        span, token = g.pop("_trace", (None, None))
+        tracer.finish(span, token, exc)
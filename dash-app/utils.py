@@ -40,6 +40,21 @@ def get_color_gradient(c1, c2, n):
     rgb_colors = [((1-mix)*c1_rgb + (mix*c2_rgb)) for mix in mix_pcts]
     return ["#" + "".join([format(int(round(val*255)), "02x") for val in item]) for item in rgb_colors]
 
+# Years shown in the number of publications per year
+years_valid = range(2018, 2024)
+
+# Function to get the number of publications per year.
+# Documents retrieved from the API carry the integer 'year' field; otherwise, the year is taken from the (vectorized) parsing of 'coverDate'
+def publications_per_year(df):
+    if 'year' in df.columns:
+        years = pd.to_numeric(df['year'], errors='coerce')
+    else:
+        years = pd.to_datetime(df['coverDate'], errors='coerce').dt.year
+    years = years[years.isin(years_valid)].astype(int)
+    publication_counts = years.value_counts().sort_index().reset_index()
+    publication_counts.columns = ['Year', 'Number of Publications']
+    return publication_counts
+
 # Function to get the label of the range
 def range_label(range):
     if range.left == 0 and range.right == 5:
@@ -83,3 +98,33 @@ def split_and_remove_duplicates_country(row):
         # Returns an empty series if affiliation_country is None
         return pd.Series(dtype=str)  
 
+
+# Ranges of the number of citations: label, key of its count in the response of getDocCounts and limits of the range
+citedby_ranges = [
+    ('< 5', 'citedby_0_4', '0', '4'),
+    ('5 - 9', 'citedby_5_9', '5', '9'),
+    ('10 - 24', 'citedby_10_24', '10', '24'),
+    ('25 >', 'citedby_25', '25', '*')
+]
+
+# Function to convert the counts returned by getDocCounts into the data of each figure
+def counts_to_frames(counts):
+    def facet(field, column, count_column='count'):
+        values = pd.DataFrame(counts['facets'].get(field, []), columns=['value', 'count'])
+        values = values[values['value'] != ''].rename(columns={'value': column, 'count': count_column})
+        return values.reset_index(drop=True)
+
+    queries = counts['queries']
+    frames = {
+        'cities': facet('affiliation_city', 'city').head(25).sort_values(by='count', ascending=True),
+        'institutions': facet('affilname', 'institution', 'num_publications').head(25).sort_values(by='num_publications', ascending=True),
+        'fund_sponsor': facet('fund_sponsor', 'fund_sponsor', 'num_projects').head(25).sort_values(by='num_projects', ascending=True),
+        'openaccess': facet('openaccess', 'openaccess').replace({'openaccess': {1: 'Open Access', 0: 'Subscription'}}),
+        'citedby': pd.DataFrame({'citedby_range': [label for label, _, _, _ in citedby_ranges],
+                                 'count': [queries.get(key, 0) for _, key, _, _ in citedby_ranges]}),
+        'years': facet('year', 'Year', 'Number of Publications'),
+        'countries': facet('affiliation_country', 'country')
+    }
+    frames['years'] = frames['years'][frames['years']['Year'].isin(years_valid)]
+    frames['countries'] = frames['countries'][frames['countries']['country'] != 'Spain']
+    return frames
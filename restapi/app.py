@@ -1,6 +1,8 @@
 """Main application entry point
+
+Running this script starts Flask's development server. In production, the app is served by gunicorn (see gunicorn.conf.py).
 """
-from src.apis import api
+from src.apis import api, metrics, tracing
 from flask import Flask
 from pyfiglet import figlet_format
 from termcolor import cprint
@@ -10,6 +12,10 @@ app = Flask(__name__)
 # Deactivate the default mask parameter.
 app.config["RESTX_MASK_SWAGGER"] = False
 api.init_app(app)
+# Serve the runtime metrics on /metrics
+metrics.install(app)
+# Trace the requests (see scripts/trace_view.py)
+tracing.install(app)
 
 if __name__ == '__main__':
     cprint(figlet_format("EWB API",
@@ -0,0 +1,15 @@
+"""ASGI application entry point.
+
+The document queries (/queries) are served natively by an async application, awaiting Solr through a shared connection pool, while the rest of the routes (/collections, /corpora, /models, /admin and the Swagger UI) are served by the Flask application, run in a thread pool. Run it with:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 82
+"""
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.routing import Mount
+
+from app import app as flask_app
+from src.apis.asgi_queries import lifespan, routes
+
+app = Starlette(routes=routes + [Mount("/", WSGIMiddleware(flask_app))],
+                lifespan=lifespan)
@@ -0,0 +1,65 @@
+"""
+Gunicorn configuration of the production entry point of the EWB API:
+
+    gunicorn -c gunicorn.conf.py
+
+The app is imported once in the master process (preload_app), so that the configuration is read and the shared Solr client, its registries and the topic tables are loaded once; each worker is then forked with a copy of them. Workers serve the requests with a pool of threads (gthread), since most of their time is spent waiting on Solr. The number of workers and threads is read from the [wsgi] section of the configuration file.
+
+On shutdown, each worker stops accepting requests, finishes those being served and waits for the requests to Solr still in flight (e.g., hedged reads) before it exits.
+
+Author: Lorena Calvo-Bartolomé
+Date: 29/06/2023
+"""
+
+import configparser
+import multiprocessing
+import os
+
+cf = configparser.ConfigParser()
+cf.read(os.environ.get('EWB_CONFIG', '/config/config.cf'))
+
+wsgi_app = 'app:app'
+bind = cf.get('wsgi', 'bind', fallback='0.0.0.0:82')
+
+# Number of workers (0 = 2 x cores + 1) and of threads per worker
+workers = cf.getint('wsgi', 'workers', fallback=0) or \
+    2 * multiprocessing.cpu_count() + 1
+worker_class = 'gthread'
+threads = cf.getint('wsgi', 'threads', fallback=8)
+
+# Import the app (and build the shared state) before forking the workers
+preload_app = True
+
+timeout = cf.getint('wsgi', 'timeout', fallback=120)
+graceful_timeout = cf.getint('wsgi', 'graceful_timeout', fallback=30)
+keepalive = cf.getint('wsgi', 'keepalive', fallback=5)
+# Seconds that a worker waits for the requests to Solr in flight on shutdown
+drain_timeout = cf.getfloat('wsgi', 'drain_timeout', fallback=10)
+
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    from src.core.clients.ewb_solr_client import EWBSolrClient
+    EWBSolrClient.after_fork()
+
+
+def worker_exit(server, worker):
+    from src.core.clients.base.inflight import inflight
+    from src.core.clients.base.tracing import tracer
+    from src.core.clients.ewb_solr_client import EWBSolrClient
+    from src.core.clients.job_engine import JobEngine
+
+    # Queued jobs are cancelled; running ones finish in their own processes
+    JobEngine.close_shared()
+
+    if inflight.count:
+        server.log.info("-- -- Worker %s: waiting for %d requests to Solr",
+                        worker.pid, inflight.count)
+    if not inflight.drain(timeout=drain_timeout):
+        server.log.warning("-- -- Worker %s: %d requests to Solr did not finish",
+                           worker.pid, inflight.count)
+    EWBSolrClient.close_shared()
+    # Write the spans still buffered
+    if tracer.exporter is not None:
+        tracer.exporter.flush()
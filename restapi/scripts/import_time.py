@@ -0,0 +1,104 @@
+"""
+Measures the cold-start time of the EWB API: it imports the given module (by default, the app) in a fresh interpreter with '-X importtime' and reports the time spent importing each package, as well as which of the heavy ingestion dependencies were loaded.
+
+Usage (from the restapi folder):
+
+    python scripts/import_time.py [--module app] [--top 20] [--runs 3]
+
+Author: Lorena Calvo-Bartolomé
+Date: 30/06/2023
+"""
+
+import argparse
+import pathlib
+import re
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# Dependencies that only the indexing routes and the similarity computations need
+HEAVY_MODULES = ("numpy", "pandas", "scipy", "dask",
+                 "sparse_dot_topn", "pycountry", "pyarrow")
+
+_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s*(\S+)")
+
+RESTAPI_DIR = pathlib.Path(__file__).resolve().parents[1]
+
+
+def measure(module: str) -> Tuple[Dict[str, float], float]:
+    """Imports the module in a new interpreter and returns the import time (in ms) of each module it loads, and the total time.
+
+    Parameters
+    ----------
+    module : str
+        Name of the module to import.
+
+    Returns
+    -------
+    self_ms : Dict[str, float]
+        Time spent importing each module, excluding its own imports.
+    total_ms : float
+        Time spent importing the module, including all its imports.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import {}".format(module)],
+        cwd=RESTAPI_DIR, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+
+    self_ms, total_ms = {}, 0.0
+    for line in proc.stderr.splitlines():
+        match = _LINE.match(line)
+        if match is None:
+            continue
+        self_us, cumulative_us, name = match.groups()
+        self_ms[name] = int(self_us) / 1000
+        if name == module:
+            total_ms = int(cumulative_us) / 1000
+
+    return self_ms, total_ms
+
+
+def report(runs: List[Tuple[Dict[str, float], float]], top: int) -> None:
+    """Prints the median import times of several runs, per package and per module."""
+
+    names = set().union(*(run[0] for run in runs))
+    self_ms = {name: statistics.median(run[0].get(name, 0) for run in runs)
+               for name in names}
+    total_ms = statistics.median(run[1] for run in runs)
+
+    package_ms = {}
+    for name, ms in self_ms.items():
+        package = name.split(".")[0]
+        package_ms[package] = package_ms.get(package, 0) + ms
+
+    print("Total import time: {:.1f} ms (median of {} runs)\n".format(
+        total_ms, len(runs)))
+
+    print("{:<40} {:>10}".format("Package", "ms"))
+    for name, ms in sorted(package_ms.items(), key=lambda x: -x[1])[:top]:
+        print("{:<40} {:>10.1f}".format(name, ms))
+
+    print("\n{:<40} {:>10}".format("Module", "ms"))
+    for name, ms in sorted(self_ms.items(), key=lambda x: -x[1])[:top]:
+        print("{:<40} {:>10.1f}".format(name, ms))
+
+    loaded = [name for name in HEAVY_MODULES if name in package_ms]
+    print("\nHeavy dependencies loaded: {}".format(", ".join(loaded) or "none"))
+
+    return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measures the import time of the EWB API")
+    parser.add_argument("--module", default="app",
+                        help="Module to import (default: app)")
+    parser.add_argument("--top", type=int, default=20,
+                        help="Number of packages and modules to report")
+    parser.add_argument("--runs", type=int, default=3,
+                        help="Number of runs whose median is reported")
+    args = parser.parse_args()
+
+    report([measure(args.module) for _ in range(args.runs)], args.top)
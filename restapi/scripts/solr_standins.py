@@ -0,0 +1,248 @@
+"""
+Runs several local Solr stand-ins (small HTTP servers that answer CLUSTERSTATUS, queries and updates as the nodes of a SolrCloud cluster would) and checks the cloud routing of the EWB Solr client against them (see src/core/clients/base/solr_cluster.py):
+
+- reads are balanced among the replicas (round-robin and least-outstanding-requests),
+- updates are sent to the shard leaders,
+- a node that stops is taken out of rotation and its reads are retried on another one,
+- the cluster state is read once for concurrent refreshes and once per ttl for a missing collection.
+
+With --serve, the stand-ins are kept running, so that the API can be pointed at them (SOLR_URL and [solrcloud] nodes).
+
+Usage (from the restapi folder):
+
+    python scripts/solr_standins.py [--nodes 3] [--port 18983] [--serve]
+
+Author: Lorena Calvo-Bartolomé
+Date: 14/06/2023
+"""
+
+import argparse
+import json
+import logging
+import pathlib
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+from urllib import parse
+
+RESTAPI_DIR = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(RESTAPI_DIR))
+
+from src.core.clients.base.solr_client import SolrClient  # noqa: E402
+from src.core.clients.base.solr_cluster import (LEAST_OUTSTANDING,  # noqa: E402
+                                                ROUND_ROBIN, SolrClusterState)
+
+# Collection hosted by the stand-ins: one shard per node, with a replica of each shard in every node
+COLLECTION = "corpus"
+
+
+class StandinCluster(object):
+    """
+    A class to run the stand-ins of the nodes of a SolrCloud cluster and to count the requests each of them receives.
+    """
+
+    def __init__(self, nodes: int, port: int) -> None:
+        self.urls = ["http://127.0.0.1:{}".format(port + i) for i in range(nodes)]
+        self.live = set(self.urls)
+        # Delay (s) of the CLUSTERSTATUS responses
+        self.status_delay = 0
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self._servers = {}
+        for url in self.urls:
+            self.start(url)
+
+        return
+
+    def cluster_status(self) -> dict:
+        """Returns the 'cluster' object of a CLUSTERSTATUS response: shard i is led by node i."""
+        shards = {}
+        for i in range(len(self.urls)):
+            shards["shard{}".format(i + 1)] = {
+                "state": "active",
+                "replicas": {
+                    "core_node{}_{}".format(i, j): {
+                        "base_url": url + "/solr",
+                        "node_name": url[len("http://"):] + "_solr",
+                        "state": "active",
+                        "leader": "true" if i == j else "false"}
+                    for j, url in enumerate(self.urls)}}
+        return {"live_nodes": [url[len("http://"):] + "_solr" for url in self.urls
+                               if url in self.live],
+                "collections": {COLLECTION: {"shards": shards}}}
+
+    def count(self, url: str, kind: str) -> None:
+        with self._lock:
+            self.requests[(url, kind)] += 1
+        return
+
+    def counts(self, kind: str) -> Counter:
+        """Returns the number of requests of the given kind ('status', 'select' or 'update') received by each node."""
+        with self._lock:
+            return Counter({url: n for (url, k), n in self.requests.items() if k == kind})
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests.clear()
+        return
+
+    def start(self, url: str) -> None:
+        cluster = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, body: dict) -> None:
+                content = json.dumps(body).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self):
+                path = parse.urlsplit(self.path).path
+                if path == "/solr/admin/collections":
+                    cluster.count(url, "status")
+                    time.sleep(cluster.status_delay)
+                    self._reply({"responseHeader": {"status": 0},
+                                 "cluster": cluster.cluster_status()})
+                elif path.endswith("/select"):
+                    cluster.count(url, "select")
+                    self._reply({"responseHeader": {"status": 0, "QTime": 0},
+                                 "response": {"numFound": 0, "start": 0, "docs": []}})
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                cluster.count(url, "update")
+                self._reply({"responseHeader": {"status": 0, "QTime": 0}})
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", int(url.rsplit(":", 1)[1])), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self._servers[url] = server
+        self.live.add(url)
+        return
+
+    def stop(self, url: str) -> None:
+        server = self._servers.pop(url)
+        server.shutdown()
+        server.server_close()
+        self.live.discard(url)
+        return
+
+    def close(self) -> None:
+        for url in list(self._servers):
+            self.stop(url)
+        return
+
+
+def check(name: str, ok: bool, detail: str) -> bool:
+    print("{} {}: {}".format("OK  " if ok else "FAIL", name, detail))
+    return ok
+
+
+def run_checks(cluster: StandinCluster) -> List[bool]:
+    """Checks the routing of the Solr client against the stand-ins."""
+    urls = cluster.urls
+    results = []
+
+    # Reads are spread evenly among the replicas
+    client = SolrClient(logging.getLogger('Solr'))
+    client.solr_url = urls[0]
+    client.enable_cloud_routing(balancing=ROUND_ROBIN, ttl=30, extra_nodes=urls[1:])
+    nreads = 30 * len(urls)
+    for _ in range(nreads):
+        client.execute_query(q="*:*", col_name=COLLECTION)
+    selects = cluster.counts("select")
+    results.append(check("round_robin", all(selects[url] == nreads // len(urls) for url in urls),
+                         dict(selects)))
+
+    # Reads avoid the node with the most outstanding requests
+    state = SolrClusterState(urls, balancing=LEAST_OUTSTANDING)
+    for _ in range(3):
+        state.begin(urls[0])
+    picked = {state.pick_replica(COLLECTION) for _ in range(10)}
+    results.append(check("least_outstanding", urls[0] not in picked, sorted(picked)))
+
+    # Updates go to the shard leaders only
+    cluster.reset()
+    for _ in range(10):
+        client._route_request(type="post", col_name=COLLECTION, path="update",
+                              read=False, json=[])
+    updates = cluster.counts("update")
+    results.append(check("updates_to_leaders", sum(updates.values()) == 10 and
+                         set(updates) <= set(urls), dict(updates)))
+
+    # A node that stops is taken out of rotation and its reads are retried on another node
+    cluster.reset()
+    stopped = urls[-1]
+    cluster.stop(stopped)
+    for _ in range(10):
+        sc, _ = client.execute_query(q="*:*", col_name=COLLECTION)
+        if sc != 200:
+            break
+    picked = {client.cluster.pick_replica(COLLECTION) for _ in range(10)}
+    results.append(check("node_failure", sc == 200 and stopped not in picked,
+                         "status {}, picked {}".format(sc, sorted(picked))))
+    cluster.start(stopped)
+
+    # Concurrent refreshes read the cluster state once
+    cluster.reset()
+    cluster.status_delay = 0.2
+    state = SolrClusterState(urls)
+    threads = [threading.Thread(target=state.refresh) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    cluster.status_delay = 0
+    nstatus = sum(cluster.counts("status").values())
+    results.append(check("single_flight_refresh", nstatus <= 2,
+                         "{} CLUSTERSTATUS for 20 refreshes".format(nstatus)))
+
+    # Queries on a missing collection read the cluster state once per ttl
+    cluster.reset()
+    state = SolrClusterState(urls, ttl=30)
+    picked = [state.pick_replica("missing") for _ in range(50)]
+    nstatus = sum(cluster.counts("status").values())
+    results.append(check("missing_collection", nstatus == 1 and set(picked) == {None},
+                         "{} CLUSTERSTATUS for 50 reads".format(nstatus)))
+
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Checks the SolrCloud routing of the EWB against local Solr stand-ins")
+    parser.add_argument("--nodes", type=int, default=3,
+                        help="Number of stand-in nodes")
+    parser.add_argument("--port", type=int, default=18983,
+                        help="Port of the first node (the others use the next ones)")
+    parser.add_argument("--serve", action="store_true",
+                        help="Keep the stand-ins running instead of checking the routing")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    cluster = StandinCluster(args.nodes, args.port)
+    try:
+        if args.serve:
+            print("Solr stand-ins: {}".format(", ".join(cluster.urls)))
+            while True:
+                time.sleep(3600)
+        results = run_checks(cluster)
+    except KeyboardInterrupt:
+        results = []
+    finally:
+        cluster.close()
+
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Prints the critical path of the slow requests recorded by the tracing of the dashboard and the API (see src/core/clients/base/tracing.py): the chain of spans (Dash callback, requests to the API, queries, requests to Solr) that determined the duration of the request, with the time spent in each of them and in each service.
+
+Spans are read from the OTLP/JSON files written by the tracers (files or folders with '*.jsonl' files).
+
+Usage:
+
+    python scripts/trace_view.py [/data/traces ...] [--min-ms 1000] [--top 5] [--trace TRACE_ID] [--tree]
+
+Author: Lorena Calvo-Bartolomé
+Date: 10/07/2023
+"""
+
+import argparse
+import json
+import pathlib
+from collections import defaultdict
+from typing import Dict, List
+
+# Children that end this long after their parent (e.g., due to clock skew between containers) are still considered within it
+SKEW_NS = 5 * 10 ** 6
+
+
+class Span(object):
+    def __init__(self, span: dict, service: str) -> None:
+        self.trace_id = span["traceId"]
+        self.span_id = span["spanId"]
+        self.parent_id = span.get("parentSpanId")
+        self.name = span["name"]
+        self.service = service
+        self.start = int(span["startTimeUnixNano"])
+        self.end = int(span["endTimeUnixNano"])
+        self.error = span.get("status", {}).get("message")
+        self.attributes = {attr["key"]: next(iter(attr["value"].values()))
+                           for attr in span.get("attributes", [])}
+
+    @property
+    def ms(self) -> float:
+        return (self.end - self.start) / 10 ** 6
+
+
+def _files(paths: List[str]) -> List[pathlib.Path]:
+    files = []
+    for path in map(pathlib.Path, paths):
+        if path.is_dir():
+            files += sorted(path.glob("*.jsonl*"))
+        else:
+            files.append(path)
+    return files
+
+
+def load(paths: List[str]) -> Dict[str, List[Span]]:
+    """Reads the spans of the given files or folders, grouped by trace."""
+    traces = defaultdict(list)
+    for file in _files(paths):
+        with open(file) as f:
+            for line in f:
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    # Line being written
+                    continue
+                for resource in request.get("resourceSpans", []):
+                    service = {attr["key"]: next(iter(attr["value"].values()))
+                               for attr in resource["resource"]["attributes"]
+                               }.get("service.name", "?")
+                    for scope in resource.get("scopeSpans", []):
+                        for span in scope.get("spans", []):
+                            span = Span(span, service)
+                            traces[span.trace_id].append(span)
+    return traces
+
+
+def critical_path(span: Span, children: Dict[str, List[Span]], depth: int = 0) -> list:
+    """Returns the critical path under the span, as (span, depth, self_ms) tuples: walking back from the end of the span, the child that ended last is on the critical path, then the child that ended last before it started, and so on. Children that overlap with them ran in parallel and did not delay the span."""
+    path = []
+    t = span.end + SKEW_NS
+    critical_ns = 0
+    for child in sorted(children.get(span.span_id, []), key=lambda s: s.end, reverse=True):
+        if child.end <= t:
+            path.append(critical_path(child, children, depth + 1))
+            critical_ns += min(child.end, span.end) - max(child.start, span.start)
+            t = child.start
+    self_ms = max(0, span.end - span.start - critical_ns) / 10 ** 6
+    return [(span, depth, self_ms)] + [item for sub in reversed(path) for item in sub]
+
+
+def _describe(span: Span) -> str:
+    details = [span.attributes[key] for key in ("http.target", "solr.collection",
+                                                "dash.output", "http.status_code")
+               if span.attributes.get(key) not in (None, "")]
+    if span.error:
+        details.append("ERROR " + span.error)
+    return "{} [{}]{}".format(span.name, span.service,
+                              " " + " ".join(map(str, details)) if details else "")
+
+
+def report(spans: List[Span], tree: bool = False) -> None:
+    by_id = {span.span_id: span for span in spans}
+    children = defaultdict(list)
+    roots = []
+    for span in spans:
+        if span.parent_id in by_id:
+            children[span.parent_id].append(span)
+        else:
+            roots.append(span)
+    root = min(roots, key=lambda s: s.start)
+    path = critical_path(root, children)
+
+    print("Trace {} - {:.1f} ms - {} spans ({})".format(
+        root.trace_id, root.ms, len(spans),
+        ", ".join(sorted({span.service for span in spans}))))
+    if len(roots) > 1:
+        print("  ({} spans whose parent was not recorded are not shown)".format(len(roots) - 1))
+
+    if tree:
+        on_path = {span.span_id for span, _, _ in path}
+
+        def walk(span: Span, depth: int) -> None:
+            print("  {} {:>9.1f} ms {}{}".format("*" if span.span_id in on_path else " ",
+                                                 span.ms, "  " * depth, _describe(span)))
+            for child in sorted(children.get(span.span_id, []), key=lambda s: s.start):
+                walk(child, depth + 1)
+        walk(root, 0)
+    else:
+        print("  {:>9} {:>9}".format("total", "self"))
+        for span, depth, self_ms in path:
+            print("  {:>9.1f} {:>9.1f} ms {}{}".format(span.ms, self_ms, "  " * depth, _describe(span)))
+
+    # Time of the critical path spent in each service (the requests to Solr are waiting on Solr)
+    per_service = defaultdict(float)
+    for span, _, self_ms in path:
+        per_service["solr" if "solr.node" in span.attributes else span.service] += self_ms
+    print("  Critical path: " + ", ".join(
+        "{} {:.1f} ms".format(service, ms) for service, ms in
+        sorted(per_service.items(), key=lambda item: -item[1])))
+    print()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Prints the critical path of slow requests")
+    parser.add_argument("paths", nargs="*", default=["/data/traces"],
+                        help="Trace files or folders (default: /data/traces)")
+    parser.add_argument("--trace", help="Id of the trace to print")
+    parser.add_argument("--min-ms", type=float, default=1000,
+                        help="Minimum duration of the traces to print")
+    parser.add_argument("--top", type=int, default=5,
+                        help="Number of traces to print, slowest first")
+    parser.add_argument("--tree", action="store_true",
+                        help="Print all the spans, marking those on the critical path with '*'")
+    args = parser.parse_args()
+
+    traces = load(args.paths)
+    if args.trace:
+        if args.trace not in traces:
+            parser.exit(1, "Trace {} not found\n".format(args.trace))
+        selected = [traces[args.trace]]
+    else:
+        def duration(spans: List[Span]) -> float:
+            return (max(s.end for s in spans) - min(s.start for s in spans)) / 10 ** 6
+        selected = sorted((spans for spans in traces.values()
+                           if duration(spans) >= args.min_ms),
+                          key=duration, reverse=True)[:args.top]
+        if not selected:
+            print("No trace of {:g} ms or more in {} traces".format(args.min_ms, len(traces)))
+
+    for spans in selected:
+        report(spans, tree=args.tree)
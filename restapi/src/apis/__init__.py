@@ -4,6 +4,8 @@ from .namespace_corpora import api as ns1
 from .namespace_collections import api as ns2
 from .namespace_models import api as ns3
 from .namespace_queries import api as ns4
+from .namespace_admin import api as ns5
+from .namespace_jobs import api as ns6
 
 api = Api(
     title='Evaluation Workbench API',
@@ -14,4 +16,6 @@ api = Api(
 api.add_namespace(ns2, path='/collections')
 api.add_namespace(ns1, path='/corpora')
 api.add_namespace(ns3, path='/models')
-api.add_namespace(ns4, path='/queries')
\ No newline at end of file
+api.add_namespace(ns4, path='/queries')
+api.add_namespace(ns5, path='/admin')
+api.add_namespace(ns6, path='/jobs')
\ No newline at end of file
@@ -0,0 +1,376 @@
+"""
+This module provides the admission control of the query routes of the API.
+
+Each route is assigned a budget: 'metadata' for the cheap queries (counts, metadata fields, topic lookups, etc.) and 'documents' for the heavy ones that return documents. A budget admits a bounded number of concurrent requests and keeps a bounded queue of requests waiting for a slot, each of which waits at most a given time. Requests that find the queue full, or that do not get a slot in time, are rejected at once with '503 Service Unavailable' and a Retry-After header, instead of piling up on Solr. Routes can also be given their own (lower) concurrency limit, beyond which they are rejected without waiting.
+
+Since the budgets are separate, an overload of document queries only delays other document queries. Note that, with a threaded server, waiting requests hold a thread, so the slots plus the queue of the 'documents' budget should stay below the number of threads of a worker for cheap queries to always find one. The routes of the ASGI serving mode (see src.apis.asgi_queries) are admitted by the same pools, but wait for a slot without holding a thread.
+
+Admitted requests are also bounded by their deadline (see src.core.clients.base.deadline): a request does not wait for a slot beyond it, and the queries it sends to Solr are given the time left. Requests whose deadline passes get '504 Gateway Timeout'; if the client allowed partial results, the results found within the deadline are returned instead, flagged with the X-Partial-Results header.
+
+Author: Lorena Calvo-Bartolomé
+Date: 05/07/2023
+"""
+
+import asyncio
+import configparser
+import contextlib
+import functools
+import math
+import threading
+import time
+from typing import Dict
+
+from flask import Response, request
+from src.core.clients.base.deadline import (PARTIAL_HEADER, Deadline,
+                                            DeadlineExceeded, current_deadline)
+
+# Budgets of the routes
+METADATA = "metadata"
+DOCUMENTS = "documents"
+
+
+class Rejected(Exception):
+    """Raised when a request is not admitted."""
+
+    def __init__(self, reason: str, retry_after: int) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionPool(object):
+    """
+    A class to limit the number of concurrent requests, with a bounded wait queue.
+    """
+
+    def __init__(self,
+                 limit: int,
+                 queue_size: int = 0,
+                 max_wait: float = 0) -> None:
+        """
+        Parameters
+        ----------
+        limit : int
+            Maximum number of requests served at the same time.
+        queue_size : int, defaults to 0
+            Maximum number of requests waiting for a slot. Further requests are rejected at once.
+        max_wait : float, defaults to 0
+            Maximum time in seconds that a request waits for a slot.
+        """
+        self.limit = limit
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+
+        self._cond = threading.Condition()
+        # (loop, future) of the requests of the ASGI routes waiting for a slot
+        self._async_waiters = []
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        # Moving average of the time for which slots are held
+        self._service_s = None
+
+        return
+
+    def retry_after(self) -> int:
+        """Returns the seconds after which a rejected request should be retried: the expected time to serve the requests ahead of it."""
+        service_s = self._service_s or 1.0
+        return min(60, max(1, math.ceil(service_s * (self.waiting + 1) / self.limit)))
+
+    def acquire(self, max_wait: float = None) -> None:
+        """Takes a slot, waiting for one if needed.
+
+        Parameters
+        ----------
+        max_wait : float, optional
+            Maximum time in seconds to wait, if lower than that of the pool (e.g., the time left until the deadline of the request).
+
+        Raises
+        ------
+        Rejected
+            If the queue is full or no slot was freed within the maximum wait.
+        """
+        with self._cond:
+            if self.active < self.limit and self.waiting == 0:
+                self.active += 1
+                self.admitted += 1
+                return
+            if self.waiting >= self.queue_size:
+                self.rejected_full += 1
+                raise Rejected("queue full", self.retry_after())
+
+            self.waiting += 1
+            deadline = time.monotonic() + (self.max_wait if max_wait is None
+                                           else min(self.max_wait, max_wait))
+            try:
+                while self.active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected_timeout += 1
+                        raise Rejected("wait timeout", self.retry_after())
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.active += 1
+            self.admitted += 1
+
+        return
+
+    async def acquire_async(self, max_wait: float = None) -> None:
+        """Takes a slot as acquire does, but waits for it without blocking the event loop.
+
+        Raises
+        ------
+        Rejected
+            If the queue is full or no slot was freed within the maximum wait.
+        """
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if self.active < self.limit and self.waiting == 0:
+                self.active += 1
+                self.admitted += 1
+                return
+            if self.waiting >= self.queue_size:
+                self.rejected_full += 1
+                raise Rejected("queue full", self.retry_after())
+            self.waiting += 1
+
+        deadline = time.monotonic() + (self.max_wait if max_wait is None
+                                       else min(self.max_wait, max_wait))
+        admitted = False
+        try:
+            while True:
+                with self._cond:
+                    if self.active < self.limit:
+                        self.active += 1
+                        self.admitted += 1
+                        admitted = True
+                        return
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected_timeout += 1
+                        raise Rejected("wait timeout", self.retry_after())
+                    waiter = (loop, loop.create_future())
+                    self._async_waiters.append(waiter)
+                try:
+                    await asyncio.wait_for(waiter[1], remaining)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    with self._cond:
+                        if waiter in self._async_waiters:
+                            self._async_waiters.remove(waiter)
+        finally:
+            with self._cond:
+                self.waiting -= 1
+                if not admitted:
+                    # The slot freed for this request may be taken by another one
+                    self._wake()
+
+    def _wake(self) -> None:
+        """Wakes up the requests waiting for a slot. Must be called with the condition held."""
+        # Waiters whose deadline expired do not consume the wakeup
+        self._cond.notify_all()
+        for loop, future in self._async_waiters:
+            loop.call_soon_threadsafe(
+                lambda future=future: future.done() or future.set_result(None))
+        self._async_waiters.clear()
+        return
+
+    def release(self, service_s: float = None) -> None:
+        """Frees a slot, accounting for the time it was held."""
+        with self._cond:
+            self.active -= 1
+            if service_s is not None:
+                self._service_s = service_s if self._service_s is None else \
+                    0.9 * self._service_s + 0.1 * service_s
+            self._wake()
+
+        return
+
+    def stats(self) -> dict:
+        return {"limit": self.limit,
+                "queue_size": self.queue_size,
+                "max_wait": self.max_wait,
+                "active": self.active,
+                "waiting": self.waiting,
+                "admitted": self.admitted,
+                "rejected_queue_full": self.rejected_full,
+                "rejected_timeout": self.rejected_timeout}
+
+
+class AdmissionController(object):
+    """
+    A class to admit the requests of each route according to the pool of its budget (and its own pool, if it has a route limit).
+    """
+
+    def __init__(self, config_file: str = "/config/config.cf") -> None:
+        """
+        Parameters
+        ----------
+        config_file : str
+            Path to the configuration file, from which the limits are read ([admission] section).
+        """
+        cf = configparser.ConfigParser()
+        cf.read(config_file)
+
+        self.enabled = cf.getboolean('admission', 'enabled', fallback=True)
+        self.budgets = {
+            budget: AdmissionPool(
+                limit=cf.getint('admission', f'{budget}_limit', fallback=limit),
+                queue_size=cf.getint(
+                    'admission', f'{budget}_queue', fallback=queue_size),
+                max_wait=cf.getfloat(
+                    'admission', f'{budget}_max_wait', fallback=max_wait))
+            for budget, limit, queue_size, max_wait in (
+                (METADATA, 16, 32, 2), (DOCUMENTS, 3, 2, 10))}
+
+        # Per-route limits (route:limit), on top of those of the budgets. Requests to a route at its limit are rejected at once, so that they do not hold threads outside the queue of their budget
+        self.routes: Dict[str, AdmissionPool] = {}
+        for item in cf.get('admission', 'route_limits', fallback='').split(","):
+            if ":" in item:
+                route, limit = item.split(":")
+                self.routes[route.strip()] = AdmissionPool(limit=int(limit))
+
+        # Deadline of the requests that do not give one, maximum deadline and time reserved to send the response (in ms)
+        self.default_deadline_ms = cf.getfloat('deadline', 'default_ms', fallback=0)
+        self.max_deadline_ms = cf.getfloat('deadline', 'max_ms', fallback=0)
+        self.deadline_margin_ms = cf.getfloat('deadline', 'margin_ms', fallback=50)
+
+        return
+
+    def admit(self, route: str, budget: str, max_wait: float = None) -> list:
+        """Takes a slot of the route (if it has a limit) and of its budget, waiting at most max_wait seconds (if given) for the latter.
+
+        Returns
+        -------
+        pools : list
+            Pools in which a slot was taken, to be passed to release.
+
+        Raises
+        ------
+        Rejected
+            If the request is not admitted.
+        """
+        pools = [self.budgets[budget]]
+        if route in self.routes:
+            pools.insert(0, self.routes[route])
+
+        taken = []
+        try:
+            for pool in pools:
+                pool.acquire(max_wait)
+                taken.append(pool)
+        except Rejected:
+            self.release(taken)
+            raise
+        return taken
+
+    async def admit_async(self, route: str, budget: str, max_wait: float = None) -> list:
+        """Takes a slot of the route (if it has a limit) and of its budget without blocking the event loop (see admit)."""
+        pools = [self.budgets[budget]]
+        if route in self.routes:
+            pools.insert(0, self.routes[route])
+
+        taken = []
+        try:
+            for pool in pools:
+                await pool.acquire_async(max_wait)
+                taken.append(pool)
+        except (Rejected, asyncio.CancelledError):
+            self.release(taken)
+            raise
+        return taken
+
+    @contextlib.asynccontextmanager
+    async def admitted(self, route: str, budget: str, max_wait: float = None):
+        """Asynchronous context manager that holds a slot of the route and of its budget (see admit_async) while a request of the ASGI serving mode is served.
+
+        Raises
+        ------
+        Rejected
+            If the request is not admitted.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        pools = await self.admit_async(route, budget, max_wait)
+        time_start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(pools, time.monotonic() - time_start)
+
+    def release(self, pools: list, service_s: float = None) -> None:
+        for pool in pools:
+            pool.release(service_s)
+        return
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled,
+                "budgets": {budget: pool.stats() for budget, pool in self.budgets.items()},
+                "routes": {route: pool.stats() for route, pool in self.routes.items()}}
+
+    def limit(self, budget: str):
+        """Decorator of the methods of a resource that admits their requests with the given budget and serves them within their deadline. Rejected requests get '503 Service Unavailable' with a Retry-After header, and requests whose deadline passes get '504 Gateway Timeout'."""
+
+        def decorator(method):
+            @functools.wraps(method)
+            def wrapper(*args, **kwargs):
+                deadline = Deadline.from_headers(
+                    request.headers, self.default_deadline_ms,
+                    self.max_deadline_ms, self.deadline_margin_ms)
+                token = current_deadline.set(deadline)
+                try:
+                    if not self.enabled:
+                        return self._serve(method, deadline, [], *args, **kwargs)
+
+                    route = request.path.rstrip("/").rsplit("/", 1)[-1]
+                    try:
+                        pools = self.admit(route, budget, None if deadline is None
+                                           else max(deadline.remaining(), 0))
+                    except Rejected as e:
+                        return {"message": "The server is busy ({}), retry later".format(e.reason)}, \
+                            503, {"Retry-After": str(e.retry_after)}
+                    return self._serve(method, deadline, pools, *args, **kwargs)
+                finally:
+                    current_deadline.reset(token)
+
+            return wrapper
+
+        return decorator
+
+    def _serve(self, method, deadline: Deadline, pools: list, *args, **kwargs):
+        """Serves an admitted request, releasing its slots when its response has been sent."""
+
+        time_start = time.monotonic()
+        streamed = False
+        try:
+            try:
+                result = method(*args, **kwargs)
+            except DeadlineExceeded as e:
+                return {"message": str(e)}, 504
+
+            # Streamed responses hold the slot until they are sent
+            if isinstance(result, Response) and result.is_streamed:
+                result.call_on_close(lambda: self.release(
+                    pools, time.monotonic() - time_start))
+                streamed = True
+
+            # Flag the responses built from partial results
+            if deadline is not None and deadline.partial:
+                if isinstance(result, Response):
+                    result.headers[PARTIAL_HEADER] = "true"
+                elif isinstance(result, tuple) and len(result) == 2:
+                    result = result + ({PARTIAL_HEADER: "true"},)
+            return result
+        finally:
+            if not streamed:
+                self.release(pools, time.monotonic() - time_start)
+
+
+# Admission control of the process
+admission = AdmissionController()
@@ -0,0 +1,190 @@
+"""
+This script defines the routes of the Queries namespace for the ASGI serving mode of the API (see asgi.py), where the queries are awaited on Solr instead of blocking a thread each.
+
+The routes, their arguments, their admission budgets and their responses are those of namespace_queries, whose request parsers are reused.
+
+Author: Lorena Calvo-Bartolomé
+Date: 28/06/2023
+"""
+
+from contextlib import asynccontextmanager
+
+from flask_restx import reqparse
+from src.apis import namespace_queries as ns
+from src.apis.admission import DOCUMENTS, METADATA, Rejected, admission
+from src.core.clients.async_ewb_solr_client import AsyncEWBSolrClient
+from src.core.clients.base.deadline import (PARTIAL_HEADER, Deadline,
+                                            DeadlineExceeded, current_deadline)
+from src.core.clients.base.tracing import SERVER, tracer
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+try:
+    from orjson import dumps as json_dumps
+except ImportError:
+    import json
+
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+
+# ======================================================
+# Namespace variables
+# ======================================================
+# Create async Solr client (it plans the queries with the client of the namespace)
+asc = AsyncEWBSolrClient(ns.sc)
+
+
+class ORJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return json_dumps(content)
+
+
+class ArgumentError(Exception):
+    def __init__(self, name: str, help: str) -> None:
+        super().__init__(name)
+        self.errors = {name: help}
+
+
+def parse_args(parser: reqparse.RequestParser, request: Request) -> dict:
+    """Parses the query string of a request with the arguments of a flask_restx parser."""
+    args = {}
+    for arg in parser.args:
+        values = request.query_params.getlist(arg.name)
+        if not values:
+            if arg.required:
+                raise ArgumentError(
+                    arg.name, "Missing required parameter in the query string")
+            args[arg.dest or arg.name] = arg.default
+            continue
+        try:
+            values = [arg.type(value) for value in values]
+        except (TypeError, ValueError) as e:
+            raise ArgumentError(arg.name, "{} {}".format(arg.help or "", e))
+        if arg.choices and any(value not in arg.choices for value in values):
+            raise ArgumentError(
+                arg.name, "The value is not a valid choice: {}".format(arg.choices))
+        args[arg.dest or arg.name] = values if arg.action == "append" else values[0]
+    return args
+
+
+def route(path: str, parser: reqparse.RequestParser, budget: str, call) -> Route:
+    """Returns the route that executes the given call with the arguments of the request, once admitted with the given budget (see src.apis.admission)."""
+
+    async def endpoint(request: Request):
+        # Same span as the Flask requests (see src.apis.tracing)
+        with tracer.span("GET /queries" + path, kind=SERVER,
+                         traceparent=request.headers.get("traceparent"),
+                         **{"http.method": "GET", "http.route": "/queries" + path,
+                            "http.target": request.url.path + ("?" + request.url.query
+                                                               if request.url.query else "")}) as span:
+            response = await respond(request)
+            if span is not None:
+                span.set("http.status_code", response.status_code)
+                response.headers["X-Trace-Id"] = span.trace_id
+        return response
+
+    async def respond(request: Request):
+        try:
+            args = parse_args(parser, request)
+        except ArgumentError as e:
+            return ORJSONResponse({"errors": e.errors,
+                                   "message": "Input payload validation failed"},
+                                  status_code=400)
+
+        # Same deadline as the Flask requests (see src.apis.admission)
+        deadline = Deadline.from_headers(
+            request.headers, admission.default_deadline_ms,
+            admission.max_deadline_ms, admission.deadline_margin_ms)
+        token = current_deadline.set(deadline)
+        try:
+            async with admission.admitted(path.strip("/"), budget, None if deadline is None
+                                          else max(deadline.remaining(), 0)):
+                result = await call(args)
+        except Rejected as e:
+            return ORJSONResponse({"message": "The server is busy ({}), retry later".format(e.reason)},
+                                  status_code=503, headers={"Retry-After": str(e.retry_after)})
+        except DeadlineExceeded as e:
+            return ORJSONResponse({"message": str(e)}, status_code=504)
+        finally:
+            current_deadline.reset(token)
+
+        # Same responses as flask_restx: (body, status code) or null
+        headers = {PARTIAL_HEADER: "true"} if deadline is not None and deadline.partial else None
+        if isinstance(result, tuple):
+            return ORJSONResponse(result[0], status_code=result[1], headers=headers)
+        return ORJSONResponse(result, headers=headers)
+
+    return Route("/queries" + path, endpoint=endpoint, methods=["GET"])
+
+
+def paging(args: dict) -> dict:
+    return {"start": args["start"], "rows": args["rows"], "cursor": args["cursor"]}
+
+
+# ======================================================
+# Methods
+# ======================================================
+routes = [
+    route('/getOpenAccess/', ns.q1_parser, DOCUMENTS,
+          lambda args: asc.do_Q1(corpus_col=args['corpus_collection'],
+                                 open_access=args['open_access'], **paging(args))),
+    route('/getCorpusMetadataFields/', ns.q2_parser, METADATA,
+          lambda args: asc.do_Q2(corpus_col=args['corpus_collection'])),
+    route('/getNrDocsColl/', ns.q3_parser, METADATA,
+          lambda args: asc.do_Q3(col=args['collection'])),
+    route('/getDocsByYear/', ns.q4_parser, DOCUMENTS,
+          lambda args: asc.do_Q4(corpus_col=args['corpus_collection'],
+                                 year=args['year'], **paging(args))),
+    route('/getDocsByContinent/', ns.q5_parser, DOCUMENTS,
+          lambda args: asc.do_Q5(corpus_col=args['corpus_collection'],
+                                 continent=args['continent'], **paging(args))),
+    route('/getDocsByCity/', ns.q6_parser, DOCUMENTS,
+          lambda args: asc.do_Q6(corpus_col=args['corpus_collection'],
+                                 city=args['city'], **paging(args))),
+    route('/getDocsByInstitution/', ns.q7_parser, DOCUMENTS,
+          lambda args: asc.do_Q7(corpus_col=args['corpus_collection'],
+                                 institution=args['institution'], **paging(args))),
+    route('/getIdOfTopicLabel/', ns.q9_parser, METADATA,
+          lambda args: asc.do_Q9(model_col=args['model_name'],
+                                 topic_label=args['topic_label'])),
+    route('/getDocsByTopicLabel/', ns.q10_parser, DOCUMENTS,
+          lambda args: asc.do_Q10(corpus_col=args['corpus_collection'],
+                                  model_col=args['model_collection'],
+                                  topic_label=args['topic_label'],
+                                  min_weight=args['min_weight'], **paging(args))),
+    route('/getDocsByCitedCount/', ns.q12_parser, DOCUMENTS,
+          lambda args: asc.do_Q12(corpus_col=args['corpus_collection'],
+                                  lower_limit=args['lower_limit'],
+                                  upper_limit=args['upper_limit'], **paging(args))),
+    route('/getDocsByFundSponsor/', ns.q13_parser, DOCUMENTS,
+          lambda args: asc.do_Q13(corpus_col=args['corpus_collection'],
+                                  fund_sponsor=args['fund_sponsor'], **paging(args))),
+    route('/getTopicMap/', ns.q14_parser, METADATA,
+          lambda args: asc.do_Q14(model_col=args['model_collection'])),
+    route('/getNrDocsByYear/', ns.q15_parser, METADATA,
+          lambda args: asc.do_Q15(corpus_col=args['corpus_collection'])),
+    route('/getMostSimilarPairs/', ns.q16_parser, DOCUMENTS,
+          lambda args: asc.do_Q16(corpus_col=args['corpus_collection'],
+                                  model_col=args['model_collection'],
+                                  year=args['year'],
+                                  num_records=args['num_records'])),
+    route('/getSimilarDocs/', ns.q17_parser, DOCUMENTS,
+          lambda args: asc.do_Q17(model_col=args['model_collection'],
+                                  doc_id=args['doc_id'],
+                                  k=args['k'])),
+    route('/getDocCounts/', ns.q18_parser, METADATA,
+          lambda args: asc.do_Q18(corpus_col=args['corpus_collection'],
+                                  model_col=args['model_collection'],
+                                  **{key: args[key] for key in (
+                                      'topic_label', 'open_access', 'year', 'continent',
+                                      'city', 'institution', 'lower_limit', 'upper_limit',
+                                      'fund_sponsor')})),
+]
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    # Close the connections of the pool on shutdown
+    await asc.aclose()
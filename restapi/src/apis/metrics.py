@@ -0,0 +1,234 @@
+"""
+This module exposes the runtime metrics of the API in the Prometheus text format on /metrics:
+
+    * Latency, response size and status of the HTTP requests, per route.
+    * Client wall time and QTime of the queries sent to Solr, per collection and query type, and size of their responses, per collection (see QueryInstrumentation).
+    * Hits and size of the cache of query results.
+    * Hedging of Solr reads: hedges fired, won and skipped, and reads aborted.
+    * HTTP requests and Solr requests in flight.
+    * Slots and queues of the admission control.
+    * Status of the background jobs and throughput of the running ones.
+
+The HTTP metrics are recorded with fixed-bucket histograms and counters; everything else is read from the components that already keep it when /metrics is scraped. Metrics are kept per process, so each worker of a multi-worker server reports its own.
+
+Author: Lorena Calvo-Bartolomé
+Date: 07/07/2023
+"""
+
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from flask import Flask, Response, g, request
+from src.apis.admission import admission
+from src.apis.namespace_jobs import jobs
+from src.apis.namespace_queries import sc
+from src.core.clients.base.inflight import inflight
+from src.core.clients.base.query_cache import query_cache
+from src.core.clients.base.query_stats import (BYTES_BUCKETS,
+                                               LATENCY_BUCKETS_MS, Histogram,
+                                               instrumentation)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class RequestMetrics(object):
+    """
+    A class to record the latency, response size and status of the HTTP requests, per route.
+    """
+
+    def __init__(self) -> None:
+        self._latency: Dict[Tuple[str, str], Histogram] = {}
+        self._bytes: Dict[Tuple[str, str], Histogram] = {}
+        self._status: Dict[Tuple[str, str, int], int] = {}
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+        return
+
+    def record(self, method: str, route: str, status: int, latency_ms: float, nbytes: int) -> None:
+        key = (method, route)
+        latency = self._latency.get(key)
+        if latency is None:
+            with self._lock:
+                latency = self._latency.setdefault(key, Histogram(LATENCY_BUCKETS_MS))
+                self._bytes.setdefault(key, Histogram(BYTES_BUCKETS))
+        latency.observe(latency_ms)
+        if nbytes is not None:
+            self._bytes[key].observe(nbytes)
+        with self._lock:
+            self._status[(method, route, status)] = \
+                self._status.get((method, route, status), 0) + 1
+
+        return
+
+    def begin(self) -> None:
+        with self._lock:
+            self.in_flight += 1
+
+    def end(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+
+# HTTP metrics of the process
+request_metrics = RequestMetrics()
+
+
+# ======================================================
+# Prometheus text format
+# ======================================================
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(
+        key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels.items()) + "}"
+
+
+def _header(lines: List[str], name: str, kind: str, help: str) -> None:
+    lines.append("# HELP {} {}".format(name, help))
+    lines.append("# TYPE {} {}".format(name, kind))
+
+
+def _samples(lines: List[str], name: str, kind: str, help: str,
+             samples: List[Tuple[dict, float]]) -> None:
+    _header(lines, name, kind, help)
+    for labels, value in samples:
+        lines.append("{}{} {}".format(name, _labels(labels), value))
+
+
+def _histograms(lines: List[str], name: str, help: str,
+                histograms: List[Tuple[dict, dict]], scale: float = 1) -> None:
+    """Adds histograms, given as (labels, Histogram.snapshot()), dividing their bounds and sums by scale (e.g., 1000 to report ms in seconds)."""
+    _header(lines, name, "histogram", help)
+    for labels, snapshot in histograms:
+        for bound, count in zip(snapshot["buckets"], snapshot["cumulative_counts"]):
+            le = bound if bound == "+Inf" else "{:g}".format(bound / scale)
+            lines.append("{}_bucket{} {}".format(
+                name, _labels(dict(labels, le=le)), count))
+        lines.append("{}_sum{} {}".format(name, _labels(labels), snapshot["sum"] / scale))
+        lines.append("{}_count{} {}".format(name, _labels(labels), snapshot["count"]))
+
+
+def render() -> str:
+    """Returns the metrics of the process in the Prometheus text format."""
+    lines = []
+
+    # HTTP requests
+    with request_metrics._lock:
+        latency = list(request_metrics._latency.items())
+        nbytes = list(request_metrics._bytes.items())
+        status = list(request_metrics._status.items())
+    _histograms(lines, "ewb_http_request_duration_seconds",
+                "Latency of the HTTP requests, per route.",
+                [({"method": m, "route": r}, h.snapshot()) for (m, r), h in latency], 1000)
+    _histograms(lines, "ewb_http_response_bytes",
+                "Size of the HTTP responses (not streamed), per route.",
+                [({"method": m, "route": r}, h.snapshot()) for (m, r), h in nbytes])
+    _samples(lines, "ewb_http_requests_total", "counter",
+             "HTTP requests, per route and status code.",
+             [({"method": m, "route": r, "status": s}, n) for (m, r, s), n in status])
+    _samples(lines, "ewb_http_requests_in_flight", "gauge",
+             "HTTP requests being served.", [({}, request_metrics.in_flight)])
+
+    # Solr queries
+    by_query = instrumentation.query_snapshot()
+    by_col = instrumentation.snapshot()
+    _histograms(lines, "ewb_solr_query_duration_seconds",
+                "Client wall time of the queries sent to Solr, per collection and query type.",
+                [({"collection": col, "query": query}, stats["wall_ms"])
+                 for (col, query), stats in by_query.items()], 1000)
+    _histograms(lines, "ewb_solr_qtime_seconds",
+                "Time reported by Solr (QTime) for the queries, per collection and query type.",
+                [({"collection": col, "query": query}, stats["qtime_ms"])
+                 for (col, query), stats in by_query.items()], 1000)
+    _histograms(lines, "ewb_solr_response_bytes",
+                "Size of the responses of the queries sent to Solr, per collection.",
+                [({"collection": col}, stats["bytes_in"]) for col, stats in by_col.items()])
+    _samples(lines, "ewb_solr_requests_in_flight", "gauge",
+             "Requests to Solr waiting for a response.", [({}, inflight.count)])
+
+    # Cache of query results
+    cache = query_cache.stats()
+    _samples(lines, "ewb_query_cache_hits_total", "counter",
+             "Queries served from the cache.", [({}, cache.get("hits", 0))])
+    _samples(lines, "ewb_query_cache_misses_total", "counter",
+             "Cacheable queries sent to Solr.", [({}, cache.get("misses", 0))])
+    if cache.get("bytes") is not None:
+        _samples(lines, "ewb_query_cache_bytes", "gauge",
+                 "Memory used by the cached results.", [({}, cache["bytes"])])
+
+    # Hedging of Solr reads
+    if sc.hedging is not None:
+        hedging = sc.hedging.counters()
+        for name, key, help in (
+                ("ewb_solr_hedged_reads_total", "requests", "Reads sent with hedging enabled."),
+                ("ewb_solr_hedges_fired_total", "hedges_fired", "Duplicate reads sent to another replica."),
+                ("ewb_solr_hedges_won_total", "hedges_won", "Duplicate reads that answered first."),
+                ("ewb_solr_hedges_skipped_budget_total", "hedges_skipped_budget",
+                 "Reads not hedged because the budget was exhausted."),
+                ("ewb_solr_hedges_skipped_busy_total", "hedges_skipped_busy",
+                 "Reads not hedged because all the threads for hedged reads were busy."),
+                ("ewb_solr_reads_cancelled_total", "reads_cancelled",
+                 "Reads aborted because another one answered first.")):
+            _samples(lines, name, "counter", help, [({}, hedging[key])])
+
+    # Admission control
+    pools = [({"budget": budget}, stats)
+             for budget, stats in admission.stats()["budgets"].items()]
+    pools += [({"route": route}, stats)
+              for route, stats in admission.stats()["routes"].items()]
+    for name, key, kind, help in (
+            ("ewb_admission_active", "active", "gauge", "Requests holding a slot."),
+            ("ewb_admission_queue_depth", "waiting", "gauge", "Requests waiting for a slot."),
+            ("ewb_admission_rejected_queue_full_total", "rejected_queue_full", "counter",
+             "Requests rejected because the queue was full."),
+            ("ewb_admission_rejected_timeout_total", "rejected_timeout", "counter",
+             "Requests rejected because no slot was freed in time.")):
+        _samples(lines, name, kind, help, [(labels, stats[key]) for labels, stats in pools])
+
+    # Background jobs (read from the job log, shared by all the processes)
+    _samples(lines, "ewb_jobs", "gauge", "Jobs in the job log, per status.",
+             [({"status": s}, n) for s, n in jobs.log.counts().items()])
+    running = jobs.log.running()
+    _samples(lines, "ewb_job_docs_indexed", "gauge",
+             "Documents indexed in the current stage of the running jobs.",
+             [({"job_id": job["id"], "kind": job["kind"], "stage": job["stage"]},
+               job["docs_indexed"]) for job in running])
+    _samples(lines, "ewb_job_docs_per_second", "gauge",
+             "Indexing throughput of the running jobs.",
+             [({"job_id": job["id"], "kind": job["kind"], "stage": job["stage"]},
+               job["docs_per_sec"]) for job in running if job["docs_per_sec"] is not None])
+
+    return "\n".join(lines) + "\n"
+
+
+def install(app: Flask) -> None:
+    """Records the metrics of the requests served by the app and serves them on /metrics."""
+
+    @app.before_request
+    def _start():
+        g._metrics_start = time.perf_counter()
+        request_metrics.begin()
+
+    @app.after_request
+    def _record(response):
+        start = g.get("_metrics_start")
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            request_metrics.record(
+                request.method, route, response.status_code,
+                (time.perf_counter() - start) * 1000,
+                None if response.is_streamed else response.content_length)
+        return response
+
+    @app.teardown_request
+    def _end(exc):
+        if g.get("_metrics_start") is not None:
+            request_metrics.end()
+
+    app.add_url_rule("/metrics", "metrics",
+                     lambda: Response(render(), content_type=CONTENT_TYPE))
+
+    return
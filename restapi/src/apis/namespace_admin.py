@@ -0,0 +1,57 @@
+"""
+This script defines a Flask RESTful namespace for the administration of the EWB API (e.g., inspecting and clearing the cache of query results).
+
+Author: Lorena Calvo-Bartolomé
+Date: 22/06/2023
+"""
+
+from flask_restx import Namespace, Resource, reqparse
+from src.apis.admission import admission
+from src.apis.namespace_queries import sc
+from src.core.clients.base.query_cache import query_cache
+
+# ======================================================
+# Define namespace for administration
+# ======================================================
+api = Namespace(
+    'Admin', description='Administration of the EWB API (query cache, etc.)')
+
+# ======================================================
+# Namespace variables
+# ======================================================
+# Define parser to take inputs from user
+cache_parser = reqparse.RequestParser()
+cache_parser.add_argument(
+    'collection', help='Name of the collection whose cached results are invalidated. If not given, the whole cache is cleared')
+
+
+# ======================================================
+# Methods
+# ======================================================
+@api.route('/cache/')
+class Cache(Resource):
+    def get(self):
+        return query_cache.stats(), 200
+
+    @api.doc(parser=cache_parser)
+    def delete(self):
+        args = cache_parser.parse_args()
+        if args['collection']:
+            query_cache.invalidate(args['collection'].lower())
+        else:
+            query_cache.clear()
+        return '', 200
+
+
+@api.route('/admission/')
+class Admission(Resource):
+    def get(self):
+        return admission.stats(), 200
+
+
+@api.route('/hedging/')
+class Hedging(Resource):
+    def get(self):
+        if sc.hedging is None:
+            return {'enabled': False}, 200
+        return dict(sc.hedging.counters(), enabled=True), 200
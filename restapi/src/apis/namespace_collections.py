@@ -18,7 +18,7 @@ api = Namespace('Collections',
 # Namespace variables
 # ======================================================
 # Create Solr client
-sc = EWBSolrClient(api.logger)
+sc = EWBSolrClient.shared(api.logger)
 
 # Define parsers to take inputs from user
 parser = reqparse.RequestParser()
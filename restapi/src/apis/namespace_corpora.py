@@ -6,6 +6,7 @@ Date: 27/03/2023
 """
 from flask_restx import Namespace, Resource, fields, reqparse
 from src.core.clients.ewb_solr_client import EWBSolrClient
+from src.core.clients.job_engine import JobEngine
 
 # ======================================================
 # Define namespace for managing corpora
@@ -17,7 +18,9 @@ api = Namespace(
 # Namespace variables
 # ======================================================
 # Create Solr client
-sc = EWBSolrClient(api.logger)
+sc = EWBSolrClient.shared(api.logger)
+# Get job engine to run the indexing / deletion in the background
+jobs = JobEngine.shared(sc)
 
 # Define parser to take inputs from user
 parser = reqparse.RequestParser()
@@ -35,8 +38,7 @@ class IndexCorpus(Resource):
     def post(self):
         args = parser.parse_args()
         corpus_path = args['corpus_path']
-        sc.index_corpus(corpus_path)
-        return '', 200
+        return jobs.submit('index_corpus', corpus_path), 202
 
 
 @api.route('/deleteCorpus/')
@@ -45,8 +47,7 @@ class DeleteCorpus(Resource):
     def post(self):
         args = parser.parse_args()
         corpus_path = args['corpus_path']
-        sc.delete_corpus(corpus_path)
-        return '', 200
+        return jobs.submit('delete_corpus', corpus_path), 202
 
 
 @api.route('/listAllCorpus/')
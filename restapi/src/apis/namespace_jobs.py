@@ -0,0 +1,67 @@
+"""
+This script defines a Flask RESTful namespace for following and cancelling the background jobs that index and delete corpora and models (see namespace_corpora and namespace_models, whose index/delete routes submit them).
+
+Author: Lorena Calvo-Bartolomé
+Date: 03/07/2023
+"""
+
+from flask_restx import Namespace, Resource, reqparse
+from src.core.clients.ewb_solr_client import EWBSolrClient
+from src.core.clients.job_engine import JobEngine
+
+# ======================================================
+# Define namespace for managing jobs
+# ======================================================
+api = Namespace(
+    'Jobs', description='Background jobs of the EWB (i.e., status, progress and cancellation of the indexing / deletion of corpora and models)')
+
+# ======================================================
+# Namespace variables
+# ======================================================
+# Get the job engine of the process
+jobs = JobEngine.shared(EWBSolrClient.shared(api.logger))
+
+# Define parsers to take inputs from user
+job_parser = reqparse.RequestParser()
+job_parser.add_argument(
+    'job_id', help='Id of the job, as returned when it was submitted', required=True)
+
+list_parser = reqparse.RequestParser()
+list_parser.add_argument(
+    'limit', help='Maximum number of jobs to list, most recent first', type=int, default=50)
+
+
+# ======================================================
+# Methods
+# ======================================================
+@api.route('/getJobStatus/')
+class getJobStatus(Resource):
+    @api.doc(parser=job_parser)
+    def get(self):
+        args = job_parser.parse_args()
+        job = jobs.get(args['job_id'])
+        if job is None:
+            return "Job not found", 404
+        return job, 200
+
+
+@api.route('/listJobs/')
+class listJobs(Resource):
+    @api.doc(parser=list_parser)
+    def get(self):
+        args = list_parser.parse_args()
+        return jobs.list(limit=args['limit']), 200
+
+
+@api.route('/cancelJob/')
+class cancelJob(Resource):
+    @api.doc(parser=job_parser)
+    def post(self):
+        args = job_parser.parse_args()
+        job = jobs.cancel(args['job_id'])
+        if job is None:
+            return "Job not found", 404
+        if not job['cancel_requested']:
+            # The job had already ended
+            return job, 409
+        return job, 200
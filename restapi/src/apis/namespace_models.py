@@ -7,6 +7,7 @@ Date: 27/03/2023
 
 from flask_restx import Namespace, Resource, reqparse
 from src.core.clients.ewb_solr_client import EWBSolrClient
+from src.core.clients.job_engine import JobEngine
 
 # ======================================================
 # Define namespace for managing models
@@ -18,7 +19,9 @@ api = Namespace(
 # Namespace variables
 # ======================================================
 # Create Solr client
-sc = EWBSolrClient(api.logger)
+sc = EWBSolrClient.shared(api.logger)
+# Get job engine to run the indexing / deletion in the background
+jobs = JobEngine.shared(sc)
 
 # Define parser to take inputs from user
 parser = reqparse.RequestParser()
@@ -32,8 +35,7 @@ class IndexModel(Resource):
     def post(self):
         args = parser.parse_args()
         model_path = args['model_path']
-        sc.index_model(model_path)
-        return '', 200
+        return jobs.submit('index_model', model_path), 202
 
 
 @api.route('/deleteModel/')
@@ -42,8 +44,7 @@ class DeleteModel(Resource):
     def post(self):
         args = parser.parse_args()
         model_path = args['model_path']
-        sc.delete_model(model_path)
-        return '', 200
+        return jobs.submit('delete_model', model_path), 202
 
 
 @api.route('/listAllModels/')
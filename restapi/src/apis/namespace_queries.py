@@ -5,8 +5,11 @@ Author: Lorena Calvo-Bartolomé
 Date: 13/04/2023
 """
 
+from flask import Response
 from flask_restx import Namespace, Resource, reqparse
+from src.apis.admission import DOCUMENTS, METADATA, admission
 from src.core.clients.ewb_solr_client import EWBSolrClient
+from src.core.entities.export_formats import ENCODERS, FORMATS
 
 # ======================================================
 # Define namespace for managing queries
@@ -18,7 +21,19 @@ api = Namespace(
 # Namespace variables
 # ======================================================
 # Create Solr client
-sc = EWBSolrClient(api.logger)
+sc = EWBSolrClient.shared(api.logger)
+
+
+def add_paging_arguments(parser: reqparse.RequestParser) -> reqparse.RequestParser:
+    """Adds the paging arguments shared by all the document queries to the given parser."""
+    parser.add_argument(
+        'start', type=int, help='Offset of the first document to retrieve. If given (and cursor is not), offset paging is used')
+    parser.add_argument(
+        'rows', type=int, help='Number of documents to retrieve (page size). It is capped to the maximum page size configured in the API')
+    parser.add_argument(
+        'cursor', help="Cursor mark of the page to retrieve, as returned in 'nextCursorMark' by the previous page. Use '*' (or omit start) for the first page")
+    return parser
+
 
 # Define parsers to take inputs from user
 q1_parser = reqparse.RequestParser()
@@ -26,6 +41,7 @@ q1_parser.add_argument(
     'corpus_collection', help='Name of the corpus collection', required=True)
 q1_parser.add_argument(
     'open_access', help='Specify with 1 to filter by open access documents, 0 otherwise.', required=True)
+add_paging_arguments(q1_parser)
 
 q2_parser = reqparse.RequestParser()
 q2_parser.add_argument(
@@ -40,24 +56,28 @@ q4_parser.add_argument(
     'corpus_collection', help='Name of the corpus collection', required=True)
 q4_parser.add_argument(
     'year', help='Publication year to filter by', required=True)
+add_paging_arguments(q4_parser)
 
 q5_parser = reqparse.RequestParser()
 q5_parser.add_argument(
     'corpus_collection', help='Name of the corpus collection', required=True)
 q5_parser.add_argument(
     'continent', help='Continent by which to filter the document collection', required=True)
+add_paging_arguments(q5_parser)
 
 q6_parser = reqparse.RequestParser()
 q6_parser.add_argument(
     'corpus_collection', help='Name of the corpus collection', required=True)
 q6_parser.add_argument(
     'city', help="City by which to filter the document collection", required=True)
+add_paging_arguments(q6_parser)
 
 q7_parser = reqparse.RequestParser()
 q7_parser.add_argument(
     'corpus_collection', help='Name of the corpus collection', required=True)
 q7_parser.add_argument(
     'institution', help="Institution by which to filter the document collection", required=True)
+add_paging_arguments(q7_parser)
 
 q9_parser = reqparse.RequestParser()
 q9_parser.add_argument(
@@ -72,6 +92,9 @@ q10_parser.add_argument(
     'model_collection', help='Name of the model collection', required=True)
 q10_parser.add_argument(
     'topic_label', help="Label of the topic whose id is retrieved", required=True)
+q10_parser.add_argument(
+    'min_weight', type=int, help='Minimum weight of the topic in the documents retrieved, in [0, 1000] (the weights of a document add up to 1000)')
+add_paging_arguments(q10_parser)
 
 q12_parser = reqparse.RequestParser()
 q12_parser.add_argument(
@@ -80,33 +103,100 @@ q12_parser.add_argument(
     'lower_limit', help='Lower limit to filter by number of citations', required=True)
 q12_parser.add_argument(
     'upper_limit', help='Upper limit to filter by number of citations', required=True)
+add_paging_arguments(q12_parser)
 
 q13_parser = reqparse.RequestParser()
 q13_parser.add_argument(
     'corpus_collection', help='Name of the corpus collection', required=True)
 q13_parser.add_argument(
     'fund_sponsor', help='Funding Sponsor by which to filter the document collection', required=True)
+add_paging_arguments(q13_parser)
 
 q14_parser = reqparse.RequestParser()
 q14_parser.add_argument(
     'model_collection', help='Name of the model collection', required=True)
 
+q15_parser = reqparse.RequestParser()
+q15_parser.add_argument(
+    'corpus_collection', help='Name of the corpus collection', required=True)
+
+q16_parser = reqparse.RequestParser()
+q16_parser.add_argument(
+    'corpus_collection', help='Name of the corpus collection', required=True)
+q16_parser.add_argument(
+    'model_collection', help='Name of the model collection whose document similarities are used', required=True)
+q16_parser.add_argument(
+    'year', type=int, help='Publication year of the documents among which the pairs are searched. If not given, all the documents are considered')
+q16_parser.add_argument(
+    'num_records', type=int, default=100, help='Number of pairs to retrieve')
+
+q17_parser = reqparse.RequestParser()
+q17_parser.add_argument(
+    'model_collection', help='Name of the model collection whose document similarities are used', required=True)
+q17_parser.add_argument(
+    'doc_id', help='ID of the document whose most similar documents are retrieved', required=True)
+q17_parser.add_argument(
+    'k', type=int, default=10, help='Number of documents to retrieve')
+
+q18_parser = reqparse.RequestParser()
+q18_parser.add_argument(
+    'corpus_collection', help='Name of the corpus collection', required=True)
+q18_parser.add_argument(
+    'model_collection', help='Name of the model collection of the topic label (required if topic_label is given)')
+q18_parser.add_argument(
+    'topic_label', help='Label of the topic by which to filter the documents')
+q18_parser.add_argument(
+    'open_access', help='Specify with 1 to filter by open access documents, 0 otherwise.')
+q18_parser.add_argument(
+    'year', help='Publication year to filter by')
+q18_parser.add_argument(
+    'continent', help='Continent by which to filter the documents')
+q18_parser.add_argument(
+    'city', help='City by which to filter the documents')
+q18_parser.add_argument(
+    'institution', help='Institution by which to filter the documents')
+q18_parser.add_argument(
+    'lower_limit', help='Lower limit to filter by number of citations')
+q18_parser.add_argument(
+    'upper_limit', help='Upper limit to filter by number of citations')
+q18_parser.add_argument(
+    'fund_sponsor', help='Funding Sponsor by which to filter the documents')
+
+export_parser = reqparse.RequestParser()
+export_parser.add_argument(
+    'collection', help='Name of the collection', required=True)
+export_parser.add_argument(
+    'q', default='*:*', help='Query selecting the documents to export')
+export_parser.add_argument(
+    'fq', action='append', help='Filter query (e.g., fund_sponsor:"European Commission"). It can be given several times')
+export_parser.add_argument(
+    'fl', help='Comma-separated fields to export. If not given, all the metadata fields are exported')
+export_parser.add_argument(
+    'sort', help="Sort order of the documents (e.g., 'year desc'). It defaults to 'id asc'")
+export_parser.add_argument(
+    'format', default='ndjson', choices=list(FORMATS), help='Format of the exported file')
+
 
 @api.route('/getOpenAccess/')
 class getOpenAccess(Resource):
     @api.doc(parser=q1_parser)
+    @admission.limit(DOCUMENTS)
     def get(self):
         args = q1_parser.parse_args()
         corpus_collection = args['corpus_collection']
         open_access = args['open_access']
 
         return sc.do_Q1(corpus_col=corpus_collection,
-                        open_access=open_access)
+                        open_access=open_access,
+                        start=args['start'],
+                        rows=args['rows'],
+                        cursor=args['cursor'])
 
 
 @api.route('/getCorpusMetadataFields/')
 class getCorpusMetadataFields(Resource):
     @api.doc(parser=q2_parser)
+    @admission.limit(METADATA)
     def get(self):
         args = q2_parser.parse_args()
         corpus_collection = args['corpus_collection']
@@ -117,6 +207,7 @@ class getCorpusMetadataFields(Resource):
 @api.route('/getNrDocsColl/')
 class getNrDocsColl(Resource):
     @api.doc(parser=q3_parser)
+    @admission.limit(METADATA)
     def get(self):
         args = q3_parser.parse_args()
         collection = args['collection']
@@ -127,54 +218,71 @@ class getNrDocsColl(Resource):
 @api.route('/getDocsByYear/')
 class getDocsByYear(Resource):
     @api.doc(parser=q4_parser)
+    @admission.limit(DOCUMENTS)
     def get(self):
         args = q4_parser.parse_args()
         corpus_collection = args['corpus_collection']
         year = args['year']
 
         return sc.do_Q4(corpus_col=corpus_collection,
-                        year=year)
+                        year=year,
+                        start=args['start'],
+                        rows=args['rows'],
+                        cursor=args['cursor'])
 
 
 @api.route('/getDocsByContinent/')
 class getDocsByContinent(Resource):
     @api.doc(parser=q5_parser)
+    @admission.limit(DOCUMENTS)
     def get(self):
         args = q5_parser.parse_args()
         corpus_collection = args['corpus_collection']
         continent = args['continent']
 
         return sc.do_Q5(corpus_col=corpus_collection,
-                        continent=continent)
+                        continent=continent,
+                        start=args['start'],
+                        rows=args['rows'],
+                        cursor=args['cursor'])
 
 
 @api.route('/getDocsByCity/')
 class getDocsByCity(Resource):
     @api.doc(parser=q6_parser)
+    @admission.limit(DOCUMENTS)
     def get(self):
         args = q6_parser.parse_args()
         corpus_collection = args['corpus_collection']
         city = args['city']
 
         return sc.do_Q6(corpus_col=corpus_collection,
-                        city=city)
+                        city=city,
+                        start=args['start'],
+                        rows=args['rows'],
+                        cursor=args['cursor'])
 
 
 @api.route('/getDocsByInstitution/')
 class getDocsByInstitution(Resource):
     @api.doc(parser=q7_parser)
+    @admission.limit(DOCUMENTS)
     def get(self):
         args = q7_parser.parse_args()
         corpus_collection = args['corpus_collection']
         institution = args['institution']
 
         return sc.do_Q7(corpus_col=corpus_collection,
-                        institution=institution)
+                        institution=institution,
+                        start=args['start'],
+                        rows=args['rows'],
+                        cursor=args['cursor'])
 
 
 @api.route('/getIdOfTopicLabel/')
 class getIdOfTopicLabel(Resource):
     @api.doc(parser=q9_parser)
+    @admission.limit(METADATA)
     def get(self):
         args = q9_parser.parse_args()
         model_col = args['model_name']
@@ -187,6 +295,7 @@ class getIdOfTopicLabel(Resource):
 @api.route('/getDocsByTopicLabel/')
 class getDocsByTopicLabel(Resource):
     @api.doc(parser=q10_parser)
+    @admission.limit(DOCUMENTS)
     def get(self):
         args = q10_parser.parse_args()
         corpus_collection = args['corpus_collection']
@@ -195,11 +304,16 @@ class getDocsByTopicLabel(Resource):
 
         return sc.do_Q10(corpus_col=corpus_collection,
                          model_col=model_collection,
-                         topic_label=topic_label)
+                         topic_label=topic_label,
+                         min_weight=args['min_weight'],
+                         start=args['start'],
+                         rows=args['rows'],
+                         cursor=args['cursor'])
 
 @api.route('/getDocsByCitedCount/')
 class getDocsByCitedCount(Resource):
     @api.doc(parser=q12_parser)
+    @admission.limit(DOCUMENTS)
     def get(self):
         args = q12_parser.parse_args()
         corpus_collection = args['corpus_collection']
@@ -208,24 +322,113 @@ class getDocsByCitedCount(Resource):
 
         return sc.do_Q12(corpus_col=corpus_collection,
                          lower_limit=lower_limit,
-                         upper_limit=upper_limit)
+                         upper_limit=upper_limit,
+                         start=args['start'],
+                         rows=args['rows'],
+                         cursor=args['cursor'])
 
 @api.route('/getDocsByFundSponsor/')
 class getDocsByFundSponsor(Resource):
     @api.doc(parser=q13_parser)
+    @admission.limit(DOCUMENTS)
     def get(self):
         args = q13_parser.parse_args()
         corpus_collection = args['corpus_collection']
         fund_sponsor = args['fund_sponsor']
 
         return sc.do_Q13(corpus_col=corpus_collection,
-                        fund_sponsor=fund_sponsor)
+                         fund_sponsor=fund_sponsor,
+                         start=args['start'],
+                         rows=args['rows'],
+                         cursor=args['cursor'])
     
 @api.route('/getTopicMap/')
 class getTopicMap(Resource):
     @api.doc(parser=q14_parser)
+    @admission.limit(METADATA)
     def get(self):
         args = q14_parser.parse_args()
         model_collection = args['model_collection']
 
-        return sc.do_Q14(model_col=model_collection)
\ No newline at end of file
+        return sc.do_Q14(model_col=model_collection)
+
+
+@api.route('/getNrDocsByYear/')
+class getNrDocsByYear(Resource):
+    @api.doc(parser=q15_parser)
+    @admission.limit(METADATA)
+    def get(self):
+        args = q15_parser.parse_args()
+        corpus_collection = args['corpus_collection']
+
+        return sc.do_Q15(corpus_col=corpus_collection)
+
+
+@api.route('/getMostSimilarPairs/')
+class getMostSimilarPairs(Resource):
+    @api.doc(parser=q16_parser)
+    @admission.limit(DOCUMENTS)
+    def get(self):
+        args = q16_parser.parse_args()
+
+        return sc.do_Q16(corpus_col=args['corpus_collection'],
+                         model_col=args['model_collection'],
+                         year=args['year'],
+                         num_records=args['num_records'])
+
+
+@api.route('/getSimilarDocs/')
+class getSimilarDocs(Resource):
+    @api.doc(parser=q17_parser)
+    @admission.limit(DOCUMENTS)
+    def get(self):
+        args = q17_parser.parse_args()
+
+        return sc.do_Q17(model_col=args['model_collection'],
+                         doc_id=args['doc_id'],
+                         k=args['k'])
+
+
+@api.route('/getDocCounts/')
+class getDocCounts(Resource):
+    @api.doc(parser=q18_parser)
+    @admission.limit(METADATA)
+    def get(self):
+        args = q18_parser.parse_args()
+
+        return sc.do_Q18(corpus_col=args['corpus_collection'],
+                         model_col=args['model_collection'],
+                         topic_label=args['topic_label'],
+                         open_access=args['open_access'],
+                         year=args['year'],
+                         continent=args['continent'],
+                         city=args['city'],
+                         institution=args['institution'],
+                         lower_limit=args['lower_limit'],
+                         upper_limit=args['upper_limit'],
+                         fund_sponsor=args['fund_sponsor'])
+
+
+@api.route('/exportDocs/')
+class exportDocs(Resource):
+    @api.doc(parser=export_parser)
+    @admission.limit(DOCUMENTS)
+    def get(self):
+        args = export_parser.parse_args()
+
+        export = sc.export_docs(col=args['collection'],
+                                q=args['q'],
+                                fq=args['fq'],
+                                fl=args['fl'],
+                                sort=args['sort'])
+        if export is None:
+            return None, 400
+        (columns, docs), _ = export
+
+        # The file is streamed (chunked) as the documents are read from Solr
+        mimetype, extension = FORMATS[args['format']]
+        return Response(
+            ENCODERS[args['format']](docs, columns),
+            mimetype=mimetype,
+            headers={'Content-Disposition': 'attachment; filename={}.{}'.format(
+                args['collection'].lower(), extension)})
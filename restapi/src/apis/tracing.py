@@ -0,0 +1,38 @@
+"""
+This module traces the requests served by the API: each request is timed as a server span that continues the trace given in its 'traceparent' header (e.g., sent by the dashboard), and under which the queries and the requests to Solr that it triggers are recorded (see src.core.clients.base.tracing). The trace id is returned in the 'X-Trace-Id' header of the response.
+
+Author: Lorena Calvo-Bartolomé
+Date: 10/07/2023
+"""
+
+from flask import Flask, g, request
+from src.core.clients.base.tracing import SERVER, tracer
+
+
+def install(app: Flask) -> None:
+    """Records a span for each request served by the app."""
+
+    @app.before_request
+    def _start():
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        g._trace = tracer.start(
+            "{} {}".format(request.method, route), kind=SERVER,
+            traceparent=request.headers.get("traceparent"),
+            **{"http.method": request.method,
+               "http.route": route,
+               "http.target": request.full_path.rstrip("?")})
+
+    @app.after_request
+    def _record(response):
+        span, _ = g.get("_trace", (None, None))
+        if span is not None:
+            span.set("http.status_code", response.status_code)
+            response.headers["X-Trace-Id"] = span.trace_id
+        return response
+
+    @app.teardown_request
+    def _end(exc):
+        span, token = g.pop("_trace", (None, None))
+        tracer.finish(span, token, exc)
+
+    return
@@ -0,0 +1,221 @@
+"""
+This module provides the asynchronous counterpart of EWBSolrClient for the ASGI serving mode of the API.
+
+The EWB queries are planned by the (synchronous) EWBSolrClient, whose registries, topic tables and planner are shared, and only their execution in Solr is awaited. Every call to the synchronous client that may block (planning a query or looking up a collection may read the registries from Solr and the shared generations from disk) and the queries bound by CPU or disk (e.g., the similarity queries) are run in a worker thread, so that the event loop is never blocked.
+
+Author: Lorena Calvo-Bartolomé
+Date: 28/06/2023
+"""
+
+import configparser
+from typing import Union
+
+from anyio import to_thread
+from src.core.clients.base.async_solr_client import AsyncSolrClient
+from src.core.clients.base.query_stats import current_query
+from src.core.clients.base.tracing import tracer
+from src.core.clients.ewb_solr_client import EWBSolrClient
+
+
+class AsyncEWBSolrClient(object):
+    """
+    A class to execute the EWB queries asynchronously.
+    """
+
+    def __init__(self,
+                 client: EWBSolrClient,
+                 config_file: str = "/config/config.cf") -> None:
+        """
+        Parameters
+        ----------
+        client : EWBSolrClient
+            The synchronous client used to plan the queries and to answer those not sent to Solr.
+        config_file : str
+            Path to the configuration file, from which the size of the connection pool and the timeout of the queries are read ([asgi] section).
+        """
+        cf = configparser.ConfigParser()
+        cf.read(config_file)
+
+        self.client = client
+        self.logger = client.logger
+        self.solr = AsyncSolrClient(
+            logger=client.logger,
+            cluster=client.cluster,
+            max_connections=cf.getint('asgi', 'max_connections', fallback=100),
+            timeout=cf.getfloat('asgi', 'solr_timeout', fallback=30),
+            query_instrumentation=client.instrumentation,
+            cache=client.cache)
+
+        return
+
+    async def aclose(self) -> None:
+        await self.solr.aclose()
+        return
+
+    async def run_query(self,
+                        name: str,
+                        col: str,
+                        start: int = None,
+                        rows: int = None,
+                        cursor: str = None,
+                        **values) -> Union[tuple, int]:
+        """Executes the EWB query with the given name on a collection (see EWBSolrClient.run_query)."""
+
+        plan = await to_thread.run_sync(
+            lambda: self.client.plan_query(name, col, start=start, rows=rows,
+                                           cursor=cursor, **values))
+        if plan is None:
+            return
+        col, params, page = plan
+
+        token = current_query.set(name)
+        try:
+            with tracer.span("query {}".format(name), **{"solr.collection": col}) as span:
+                sc, results = await self.solr.execute_query(col_name=col, **params)
+                if span is not None:
+                    span.set("solr.status_code", sc)
+        finally:
+            current_query.reset(token)
+
+        return self.client.finish_query(name, sc, results, page)
+
+    # ======================================================
+    # QUERIES
+    # ======================================================
+    async def do_Q1(self, corpus_col: str, open_access: str,
+                    start: int = None, rows: int = None, cursor: str = None) -> Union[dict, int]:
+        return await self.run_query('Q1', corpus_col, start=start, rows=rows, cursor=cursor,
+                                    open_access=open_access)
+
+    async def do_Q2(self, corpus_col: str) -> Union[dict, int]:
+        return await to_thread.run_sync(lambda: self.client.do_Q2(corpus_col=corpus_col))
+
+    async def do_Q3(self, col: str) -> Union[dict, int]:
+        results, sc = await self.run_query('Q3', col) or (None, None)
+        if results is None:
+            return
+
+        return {'ndocs': int(results.hits)}, sc
+
+    async def do_Q4(self, corpus_col: str, year: str,
+                    start: int = None, rows: int = None, cursor: str = None) -> Union[dict, int]:
+        return await self.run_query('Q4', corpus_col, start=start, rows=rows, cursor=cursor,
+                                    year=year)
+
+    async def do_Q5(self, corpus_col: str, continent: str,
+                    start: int = None, rows: int = None, cursor: str = None) -> Union[dict, int]:
+        # The whole collection is returned for 'world'
+        return await self.run_query('Q5', corpus_col, start=start, rows=rows, cursor=cursor,
+                                    continent=None if continent == 'world' else continent.lower())
+
+    async def do_Q6(self, corpus_col: str, city: str,
+                    start: int = None, rows: int = None, cursor: str = None) -> Union[dict, int]:
+        return await self.run_query('Q6', corpus_col, start=start, rows=rows, cursor=cursor,
+                                    city=city)
+
+    async def do_Q7(self, corpus_col: str, institution: str,
+                    start: int = None, rows: int = None, cursor: str = None) -> Union[dict, int]:
+        return await self.run_query('Q7', corpus_col, start=start, rows=rows, cursor=cursor,
+                                    institution=institution)
+
+    async def do_Q9(self, model_col: str, topic_label: str) -> Union[dict, int]:
+
+        # Look up the label in the topic metadata of the model
+        model_col = model_col.lower()
+
+        def topic_table():
+            if not self.client.check_is_model(model_col):
+                return False
+            return self.client.topics.get(model_col)
+
+        table = await to_thread.run_sync(topic_table)
+        if table is False:
+            return
+        if table is not None:
+            topic_id = table.id_of_label(topic_label)
+            if topic_id is not None:
+                return [{'id': topic_id}], 200
+
+        # Labels that do not match exactly are resolved by Solr
+        results, sc = await self.run_query(
+            'Q9', model_col, topic_label=topic_label) or (None, None)
+        if results is None:
+            return
+
+        return results.docs, sc
+
+    async def do_Q10(self, corpus_col: str, model_col: str, topic_label: str,
+                     min_weight: int = None, start: int = None, rows: int = None,
+                     cursor: str = None) -> Union[dict, int]:
+        corpus_col = corpus_col.lower()
+        model_col = model_col.lower()
+        if not await to_thread.run_sync(
+                lambda: self.client.check_is_corpus(corpus_col) and self.client.check_is_model(model_col)):
+            return
+
+        results_docs, sc = await self.do_Q9(model_col=model_col, topic_label=topic_label) \
+            or (None, None)
+        if sc != 200 or not results_docs:
+            self.logger.error(
+                f"-- -- Error executing query Q10. Aborting operation...")
+            return
+
+        # Documents are sorted by the weight of the topic
+        return await self.run_query('Q10', corpus_col, start=start, rows=rows, cursor=cursor,
+                                    model_col=model_col, topic_id=results_docs[0]["id"],
+                                    min_weight=min_weight)
+
+    async def do_Q12(self, corpus_col: str, lower_limit: str, upper_limit: str,
+                     start: int = None, rows: int = None, cursor: str = None) -> Union[dict, int]:
+        return await self.run_query('Q12', corpus_col, start=start, rows=rows, cursor=cursor,
+                                    lower_limit=lower_limit, upper_limit=upper_limit)
+
+    async def do_Q13(self, corpus_col: str, fund_sponsor: str,
+                     start: int = None, rows: int = None, cursor: str = None) -> Union[dict, int]:
+        return await self.run_query('Q13', corpus_col, start=start, rows=rows, cursor=cursor,
+                                    fund_sponsor=fund_sponsor)
+
+    async def do_Q14(self, model_col: str) -> Union[dict, int]:
+        return await to_thread.run_sync(lambda: self.client.do_Q14(model_col=model_col))
+
+    async def do_Q15(self, corpus_col: str) -> Union[dict, int]:
+        results, sc = await self.run_query('Q15', corpus_col) or (None, None)
+        if results is None:
+            return
+
+        years = [{'year': int(year), 'ndocs': ndocs}
+                 for year, ndocs in self.client.facet_counts(results, 'year')]
+
+        return years, sc
+
+    async def do_Q16(self, **kwargs) -> Union[dict, int]:
+        return await to_thread.run_sync(lambda: self.client.do_Q16(**kwargs))
+
+    async def do_Q17(self, **kwargs) -> Union[dict, int]:
+        return await to_thread.run_sync(lambda: self.client.do_Q17(**kwargs))
+
+    async def do_Q18(self, corpus_col: str, model_col: str = None, topic_label: str = None,
+                     continent: str = None, **filters) -> Union[dict, int]:
+        topic_id = None
+        if topic_label is not None:
+            if model_col is None:
+                self.logger.error(
+                    f"-- -- A model collection is required to filter by topic. Aborting operation...")
+                return
+            model_col = model_col.lower()
+            results_docs, sc = await self.do_Q9(model_col=model_col, topic_label=topic_label) \
+                or (None, None)
+            if sc != 200 or not results_docs:
+                self.logger.error(
+                    f"-- -- Error executing query Q18. Aborting operation...")
+                return
+            topic_id = results_docs[0]["id"]
+
+        results, sc = await self.run_query(
+            'Q18', corpus_col, model_col=model_col, topic_id=topic_id,
+            continent=None if continent in (None, 'world') else continent.lower(),
+            **filters) or (None, None)
+        if results is None:
+            return
+
+        return self.client.doc_counts(results), sc
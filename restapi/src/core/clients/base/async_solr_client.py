@@ -0,0 +1,203 @@
+"""
+This module provides a class to send queries to Solr without blocking, for the ASGI serving mode of the API.
+
+All the queries of a process share one pool of keep-alive connections, so that hundreds of concurrent requests can wait on Solr without holding an OS thread each. Responses are parsed, cached and instrumented exactly as those of the synchronous SolrClient, whose cluster state (if cloud routing is enabled) is also shared. The calls to the cluster state and the cache that may block (reading CLUSTERSTATUS, the shared generations or Redis) are run in a worker thread.
+
+Author: Lorena Calvo-Bartolomé
+Date: 28/06/2023
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Union
+from urllib import parse
+
+import httpx
+from anyio import to_thread
+from src.core.clients.base.deadline import DeadlineExceeded, current_deadline
+from src.core.clients.base.inflight import inflight
+from src.core.clients.base.query_cache import QueryCache, query_cache
+from src.core.clients.base.query_stats import (QueryInstrumentation,
+                                               instrumentation)
+from src.core.clients.base.solr_client import (SolrClient, SolrResp, SolrResults,
+                                               decode_response_header)
+from src.core.clients.base.solr_cluster import SolrClusterState
+from src.core.clients.base.tracing import CLIENT, tracer
+
+
+class AsyncSolrClient(object):
+    """
+    A class to send queries to Solr asynchronously.
+    """
+
+    def __init__(self,
+                 logger: logging.Logger = None,
+                 cluster: SolrClusterState = None,
+                 max_connections: int = 100,
+                 timeout: float = 30,
+                 query_instrumentation: QueryInstrumentation = None,
+                 cache: QueryCache = None) -> None:
+        """
+        Parameters
+        ----------
+        logger : logging.Logger
+            The logger object to log messages and errors.
+        cluster : SolrClusterState, defaults to None
+            State of the SolrCloud cluster used to route the queries. If None, queries are sent to SOLR_URL.
+        max_connections : int, defaults to 100
+            Maximum number of simultaneous connections to Solr. Further queries wait for a free connection.
+        timeout : float, defaults to 30
+            Timeout in seconds of the queries.
+        query_instrumentation : QueryInstrumentation, defaults to None
+            Object in which the statistics of the queries are recorded. If None, the process-wide instrumentation is used.
+        cache : QueryCache, defaults to None
+            Cache of query results. If None, the process-wide cache is used.
+        """
+        self.solr_url = os.environ.get('SOLR_URL')
+        self.logger = logger or logging.getLogger('Solr')
+        self.cluster = cluster
+        self.instrumentation = query_instrumentation or instrumentation
+        self.cache = cache or query_cache
+
+        self.http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(timeout))
+
+        return
+
+    async def aclose(self) -> None:
+        """Closes the connections of the pool."""
+        await self.http.aclose()
+        return
+
+    def _cache_lookup(self, col_name: str, params: dict) -> tuple:
+        """Returns the cache key of a query and its cached content (None if it is not cached)."""
+        cache_key = self.cache.key(col_name, params)
+        return cache_key, self.cache.get(cache_key)
+
+    async def _get(self, url: str) -> SolrResp:
+        """Sends a GET request to the given url, within a span of the current trace (see SolrClient._do_request)."""
+
+        url_parts = parse.urlsplit(url)
+        with tracer.span("solr GET {}".format(url_parts.path), kind=CLIENT,
+                         **{"http.method": "GET", "solr.node": url_parts.netloc}) as span:
+            headers = None
+            if span is not None:
+                headers = tracer.inject()
+                url += ("&" if url_parts.query else "?") + \
+                    "ewb_trace={}".format(span.trace_id)
+            resp = await self.http.get(url, headers=headers)
+            solr_resp = SolrResp.from_requests_response(resp, self.logger, lazy=True)
+            if span is not None:
+                span.set("http.status_code", solr_resp.status_code)
+                span.set("http.response_size", solr_resp.nbytes)
+
+        return solr_resp
+
+    async def _read_request(self,
+                            col_name: str,
+                            path: str,
+                            max_attempts: int = 3) -> SolrResp:
+        """Sends a read request on the given collection to a healthy replica (or to SOLR_URL), retrying on another replica if the chosen one is unreachable."""
+
+        if self.cluster is None:
+            return await self._get('{}/solr/{}/{}'.format(self.solr_url, col_name, path))
+
+        tried = []
+        for attempt in range(max_attempts):
+            if self.cluster.needs_refresh(col_name):
+                # The cluster state is read from Solr
+                node = await to_thread.run_sync(
+                    lambda: self.cluster.pick_replica(col_name, exclude=tried))
+            else:
+                node = self.cluster.pick_replica(col_name, exclude=tried)
+            node = node or self.solr_url
+            self.cluster.begin(node)
+            try:
+                return await self._get('{}/solr/{}/{}'.format(node, col_name, path))
+            except (httpx.ConnectError, httpx.TimeoutException):
+                if node == self.solr_url or attempt == max_attempts - 1:
+                    raise
+                tried.append(node)
+                await to_thread.run_sync(self.cluster.mark_down, node)
+            finally:
+                self.cluster.end(node)
+
+    async def execute_query(self,
+                            q: str,
+                            col_name: str,
+                            **kwargs) -> Union[int, SolrResults]:
+        """Performs a query and returns the results (see SolrClient.execute_query).
+
+        Parameters
+        ----------
+        q : str
+            The query to be executed.
+        col_name : str
+            The name of the Solr collection to query.
+        **kwargs
+            Additional options to be passed through the Solr URL.
+
+        Returns
+        -------
+        int
+            The HTTP status code of the Solr API response.
+        SolrResults
+            The results of the query.
+        """
+
+        params = {"q": q}
+        params.update(kwargs)
+        params["wt"] = "json"
+
+        path_ = 'select?{}'.format(parse.urlencode(params, doseq=True))
+
+        # Serve the query from the cache if possible
+        cache_key = None
+        if self.cache.enabled:
+            cache_key, content = await to_thread.run_sync(
+                lambda: self._cache_lookup(col_name, params))
+            if content is not None:
+                return 200, SolrResults.from_content(
+                    content, decode_response_header(content))
+
+        # Bound the query by the deadline of the request, if any (see SolrClient.execute_query)
+        deadline = current_deadline.get()
+        timeout = None
+        if deadline is not None and "timeAllowed" not in params:
+            path_ += '&timeAllowed={}'.format(deadline.time_allowed_ms())
+            timeout = max(deadline.remaining(), 0.001)
+
+        time_start = time.perf_counter()
+        with inflight.track():
+            try:
+                # The request is cancelled when the deadline passes
+                solr_resp = await asyncio.wait_for(
+                    self._read_request(col_name=col_name, path=path_), timeout)
+            except asyncio.TimeoutError as e:
+                raise DeadlineExceeded() from e
+        wall_ms = (time.perf_counter() - time_start) * 1000
+
+        results = solr_resp.results
+        if self.instrumentation.enabled:
+            rows = params.get("rows")
+            self.instrumentation.record(
+                col_name=col_name,
+                wall_ms=wall_ms,
+                qtime_ms=results.qtime if isinstance(results, SolrResults) else None,
+                bytes_out=len(path_),
+                bytes_in=solr_resp.nbytes,
+                rows=int(rows) if str(rows).isdigit() else None,
+                params=params)
+
+        if cache_key is not None and solr_resp.status_code == 200 and \
+                isinstance(results, SolrResults) and results._content is not None and \
+                not results.partial:
+            await to_thread.run_sync(
+                self.cache.put, cache_key, col_name, results._content)
+        SolrClient._check_partial(deadline, results)
+
+        return solr_resp.status_code, results
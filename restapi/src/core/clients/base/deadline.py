@@ -0,0 +1,112 @@
+"""
+This module provides the deadline of the request being served, so that the queries it sends to Solr do not outlive it.
+
+The client of the API gives the time it is willing to wait in the 'X-Deadline-Ms' header (relative, so that it does not depend on the clocks of the machines being in sync). While the request is served, its deadline is kept in a context variable, from which the Solr client bounds each query: Solr is told to stop searching when the deadline is near (timeAllowed), and the request to Solr is abandoned when it passes.
+
+When Solr stops a search because of timeAllowed, it returns the documents found so far and flags the response as partial. Partial results are only returned if the client asks for them ('X-Allow-Partial-Results: true'); otherwise, the request fails with DeadlineExceeded.
+
+Author: Lorena Calvo-Bartolomé
+Date: 11/07/2023
+"""
+
+import time
+from contextvars import ContextVar
+from typing import Mapping, Union
+
+DEADLINE_HEADER = "X-Deadline-Ms"
+ALLOW_PARTIAL_HEADER = "X-Allow-Partial-Results"
+PARTIAL_HEADER = "X-Partial-Results"
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the deadline of the request passes before its results are ready."""
+
+    def __init__(self, message: str = "The deadline of the request was exceeded") -> None:
+        super().__init__(message)
+
+
+class Deadline(object):
+    """
+    A class to represent the deadline of a request.
+    """
+
+    def __init__(self,
+                 timeout_ms: float,
+                 allow_partial: bool = False,
+                 margin_ms: float = 50) -> None:
+        """
+        Parameters
+        ----------
+        timeout_ms : float
+            Time in ms from now until the deadline.
+        allow_partial : bool, defaults to False
+            Whether the client accepts partial results.
+        margin_ms : float, defaults to 50
+            Time in ms reserved to send the response after Solr stops searching.
+        """
+        self.expires = time.monotonic() + timeout_ms / 1000
+        self.allow_partial = allow_partial
+        self.margin_ms = margin_ms
+        # Whether any of the results of the request is partial
+        self.partial = False
+
+        return
+
+    def remaining(self) -> float:
+        """Returns the time left in seconds (negative if the deadline has passed)."""
+        return self.expires - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def time_allowed_ms(self) -> int:
+        """Returns the time that Solr is allowed to spend on a query sent now.
+
+        Raises
+        ------
+        DeadlineExceeded
+            If the deadline has passed.
+        """
+        remaining_ms = self.remaining() * 1000
+        if remaining_ms <= 0:
+            raise DeadlineExceeded()
+        return max(1, int(remaining_ms - self.margin_ms))
+
+    @classmethod
+    def from_headers(cls,
+                     headers: Mapping[str, str],
+                     default_ms: float = 0,
+                     max_ms: float = 0,
+                     margin_ms: float = 50) -> Union['Deadline', None]:
+        """Returns the deadline given in the headers of a request.
+
+        Parameters
+        ----------
+        headers : Mapping[str, str]
+            Headers of the request.
+        default_ms : float, defaults to 0
+            Deadline of the requests that do not give one (0 for none).
+        max_ms : float, defaults to 0
+            Maximum deadline (0 for no maximum).
+
+        Returns
+        -------
+        deadline : Deadline
+            The deadline, or None if the request has none.
+        """
+        try:
+            timeout_ms = float(headers.get(DEADLINE_HEADER) or default_ms)
+        except ValueError:
+            timeout_ms = default_ms
+        if max_ms:
+            timeout_ms = min(timeout_ms, max_ms) if timeout_ms > 0 else max_ms
+        if timeout_ms <= 0:
+            return None
+        allow_partial = str(headers.get(ALLOW_PARTIAL_HEADER, "")).lower() in ("1", "true")
+        return cls(timeout_ms, allow_partial, margin_ms)
+
+
+# Deadline of the request being served (None if it has none)
+current_deadline: ContextVar[Union[Deadline, None]] = ContextVar(
+    "current_deadline", default=None)
@@ -0,0 +1,124 @@
+"""
+This module provides the generations shared by all the processes of the API (the workers of the server and those of the jobs), which tell each process when the caches it keeps in memory (collection registry, topic tables, query results) no longer reflect Solr.
+
+A generation is a counter, identified by a name, kept in an SQLite database (the job log): a process that modifies the collections bumps it, and every process compares it with the value its caches were built at. Generations are read at most once per check interval, which bounds the cost of the check and the staleness of the caches.
+
+Author: Lorena Calvo-Bartolomé
+Date: 03/07/2023
+"""
+
+import logging
+import pathlib
+import sqlite3
+import threading
+import time
+from typing import Dict
+
+# Generation bumped whenever corpora or models are indexed or deleted
+COLLECTIONS = "collections"
+
+
+class GenerationStore(object):
+    """
+    A class to read and bump the generations shared by the processes of the API.
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS generations (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )"""
+
+    # Stores shared within the process, by path
+    _shared: Dict[str, 'GenerationStore'] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self,
+                 path: str,
+                 interval: float = 1,
+                 logger: logging.Logger = None) -> None:
+        """
+        Parameters
+        ----------
+        path : str
+            Path of the database. It is created if it does not exist.
+        interval : float, defaults to 1
+            Time in seconds during which the generations read from the database are reused.
+        logger : logging.Logger
+            The logger object to log messages and errors.
+        """
+        self.path = str(path)
+        self.interval = interval
+        self.logger = logger or logging.getLogger('Generations')
+
+        # name -> value, as read at self._read_at
+        self._values: Dict[str, int] = {}
+        self._read_at = None
+        self._lock = threading.Lock()
+
+        try:
+            pathlib.Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(self._SCHEMA)
+        except (OSError, sqlite3.Error) as e:
+            self.logger.error(
+                f"-- -- Shared generations could not be initialized in {self.path}: {e}")
+
+        return
+
+    @classmethod
+    def shared(cls,
+               path: str,
+               interval: float = 1,
+               logger: logging.Logger = None) -> 'GenerationStore':
+        """Returns the store of the process for the given database, creating it if it does not exist yet.
+
+        Parameters
+        ----------
+        path, interval, logger
+            See __init__. interval and logger are only used if the store is created.
+        """
+        with cls._shared_lock:
+            if str(path) not in cls._shared:
+                cls._shared[str(path)] = cls(path, interval=interval, logger=logger)
+            return cls._shared[str(path)]
+
+    def _connect(self) -> sqlite3.Connection:
+        # Short-lived connections, so that the store can be used from any thread or process
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _read(self) -> None:
+        try:
+            with self._connect() as conn:
+                rows = conn.execute(
+                    "SELECT name, value FROM generations").fetchall()
+        except sqlite3.Error as e:
+            # The last values read are kept until the database is available again
+            self.logger.warning(f"-- -- Shared generations unavailable: {e}")
+            rows = self._values.items()
+        with self._lock:
+            self._values = dict(rows)
+            self._read_at = time.monotonic()
+        return
+
+    def get(self, name: str) -> int:
+        """Returns the current value of the generation with the given name (0 if it has never been bumped)."""
+        read_at = self._read_at
+        if read_at is None or time.monotonic() - read_at >= self.interval:
+            self._read()
+        return self._values.get(name, 0)
+
+    def bump(self, name: str) -> None:
+        """Bumps the generation with the given name, so that the caches built at its previous value are discarded by all the processes."""
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT INTO generations (name, value) VALUES (?, 1) "
+                    "ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,))
+        except sqlite3.Error as e:
+            self.logger.error(
+                f"-- -- Shared generation {name} could not be bumped: {e}")
+        # The process that bumps it sees the new value right away
+        self._read()
+        return
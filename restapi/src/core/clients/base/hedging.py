@@ -0,0 +1,245 @@
+"""
+This module provides the policy used to hedge Solr reads: when a query has not been answered within a delay derived from the latency percentiles observed for its collection, a duplicate is sent to another replica and the first response wins.
+
+The extra load is capped with a token bucket: every read adds ``budget`` tokens and every hedge consumes one, so that at most a ``budget`` fraction of the reads is duplicated in the long run.
+
+Hedged reads share the pooled connections of a session of the client (see hedging_session), which hands each connection over to the read using it, so that the read that loses can be aborted by shutting its connection down: the thread waiting for it is released at once, and Solr sees the client go away.
+
+Author: Lorena Calvo-Bartolomé
+Date: 15/06/2023
+"""
+
+import contextlib
+import socket
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from src.core.clients.base.query_stats import Histogram
+
+
+class HedgingPolicy(object):
+    """
+    A class to decide when Solr reads are hedged and to count how often hedges fire and win.
+    """
+
+    def __init__(self,
+                 percentile: float = 95,
+                 default_delay_ms: float = 250,
+                 min_delay_ms: float = 20,
+                 min_samples: int = 50,
+                 budget: float = 0.05,
+                 max_tokens: float = 10) -> None:
+        """
+        Parameters
+        ----------
+        percentile : float, defaults to 95
+            Percentile of the client latency of the collection after which a read is hedged.
+        default_delay_ms : float, defaults to 250
+            Delay (in ms) used while fewer than min_samples reads have been observed for the collection.
+        min_delay_ms : float, defaults to 20
+            Lower bound of the delay (in ms).
+        min_samples : int, defaults to 50
+            Number of observed reads required to trust the latency percentile.
+        budget : float, defaults to 0.05
+            Maximum fraction of reads that can be hedged.
+        max_tokens : float, defaults to 10
+            Maximum number of hedges that can be accumulated for bursts.
+        """
+        self.percentile = percentile
+        self.default_delay_ms = default_delay_ms
+        self.min_delay_ms = min_delay_ms
+        self.min_samples = min_samples
+        self.budget = budget
+        self.max_tokens = max_tokens
+
+        self._tokens = max_tokens
+        self._requests = 0
+        self._fired = 0
+        self._won = 0
+        self._skipped = 0
+        self._skipped_busy = 0
+        self._cancelled = 0
+        self._lock = threading.Lock()
+
+        return
+
+    def delay_ms(self, latencies: Histogram = None) -> float:
+        """Returns the time (in ms) to wait for the first response before hedging.
+
+        Parameters
+        ----------
+        latencies : Histogram
+            Histogram of the client latencies of the collection being queried.
+        """
+        delay = None
+        if latencies is not None and latencies.count >= self.min_samples:
+            delay = latencies.percentile(self.percentile)
+        if delay is None or delay == float("inf"):
+            delay = self.default_delay_ms
+        return max(delay, self.min_delay_ms)
+
+    def on_request(self) -> None:
+        """Accounts for a new read, which adds budget for future hedges."""
+        with self._lock:
+            self._requests += 1
+            self._tokens = min(self.max_tokens, self._tokens + self.budget)
+        return
+
+    def try_acquire(self) -> bool:
+        """Consumes budget for a hedge.
+
+        Returns
+        -------
+        bool
+            True if the hedge can be sent, False if the budget is exhausted.
+        """
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self._fired += 1
+                return True
+            self._skipped += 1
+            return False
+
+    def on_hedge_won(self) -> None:
+        """Accounts for a hedge that answered before the original read."""
+        with self._lock:
+            self._won += 1
+        return
+
+    def on_skipped_busy(self) -> None:
+        """Accounts for a read that was not hedged because all the threads for hedged reads were busy."""
+        with self._lock:
+            self._skipped_busy += 1
+        return
+
+    def on_cancelled(self) -> None:
+        """Accounts for a read that was aborted because the other one answered first."""
+        with self._lock:
+            self._cancelled += 1
+        return
+
+    def counters(self) -> dict:
+        """Returns the hedging counters."""
+        with self._lock:
+            return {"requests": self._requests,
+                    "hedges_fired": self._fired,
+                    "hedges_won": self._won,
+                    "hedges_skipped_budget": self._skipped,
+                    "hedges_skipped_busy": self._skipped_busy,
+                    "reads_cancelled": self._cancelled}
+
+
+# Hedged request being sent by the current thread (see _TrackingAdapter)
+_current = threading.local()
+
+
+class _TrackingAdapter(HTTPAdapter):
+    """HTTP adapter that hands the connections it uses over to the HedgedRequest being sent by the thread that uses them (see HedgedRequest.active), while the request holds them."""
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+
+        def tracking(pool_cls):
+            class Connection(pool_cls.ConnectionCls):
+                def connect(self):
+                    super().connect()
+                    request = getattr(_current, "request", None)
+                    if request is not None:
+                        request._acquired(self)
+
+            class Pool(pool_cls):
+                ConnectionCls = Connection
+
+                def _make_request(self, conn, *args, **kwargs):
+                    # Connections reused from the pool are already connected
+                    request = getattr(_current, "request", None)
+                    if request is not None and conn.sock is not None:
+                        request._acquired(conn)
+                    return super()._make_request(conn, *args, **kwargs)
+
+                def _put_conn(self, conn):
+                    request = getattr(_current, "request", None)
+                    if request is not None and conn is not None:
+                        request._released(conn)
+                    return super()._put_conn(conn)
+            return Pool
+
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: tracking(pool_cls) for scheme, pool_cls in
+            self.poolmanager.pool_classes_by_scheme.items()}
+
+
+def hedging_session(pool_size: int) -> requests.Session:
+    """Returns a session whose pooled connections can be aborted by the HedgedRequest that is using them.
+
+    Parameters
+    ----------
+    pool_size : int
+        Maximum number of connections kept per Solr node.
+    """
+    session = requests.Session()
+    adapter = _TrackingAdapter(pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class HedgedRequest(object):
+    """
+    A read sent as part of a hedged query (through a session returned by hedging_session), which can be aborted from another thread.
+    """
+
+    def __init__(self) -> None:
+        self.cancelled = False
+        # Connections held by the request
+        self._connections = []
+        self._lock = threading.Lock()
+
+        return
+
+    @contextlib.contextmanager
+    def active(self):
+        """Marks the request as the one being sent by the current thread."""
+        _current.request = self
+        try:
+            yield self
+        finally:
+            _current.request = None
+            with self._lock:
+                self._connections = []
+
+    def _acquired(self, connection) -> None:
+        """Called (from the thread sending the request) when the request starts using a connection."""
+        with self._lock:
+            if self.cancelled:
+                self._shutdown(connection.sock)
+            elif connection not in self._connections:
+                self._connections.append(connection)
+        return
+
+    def _released(self, connection) -> None:
+        """Called (from the thread sending the request) when a connection is returned to the pool, so that cancelling the request no longer affects it."""
+        with self._lock:
+            if connection in self._connections:
+                self._connections.remove(connection)
+        return
+
+    @staticmethod
+    def _shutdown(sock) -> None:
+        # shutdown (unlike close) wakes up the thread blocked reading from the socket
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except (OSError, AttributeError):
+            pass
+
+    def cancel(self) -> None:
+        """Aborts the request: the thread waiting for its response gets a ConnectionError, and its connection is discarded by the pool."""
+        with self._lock:
+            self.cancelled = True
+            for connection in self._connections:
+                self._shutdown(connection.sock)
+            self._connections = []
+
+        return
@@ -0,0 +1,74 @@
+"""
+This module keeps count of the requests to Solr that are in flight in the process, so that a worker can wait for them to finish (drain) before it exits.
+
+Author: Lorena Calvo-Bartolomé
+Date: 29/06/2023
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class InflightRequests(object):
+    """
+    A class to count the requests in flight and to wait until there are none.
+    """
+
+    def __init__(self) -> None:
+        self._count = 0
+        self._cond = threading.Condition()
+
+        return
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @contextmanager
+    def track(self):
+        """Accounts for a request for as long as the context is active."""
+        with self._cond:
+            self._count += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._count -= 1
+                if self._count == 0:
+                    self._cond.notify_all()
+
+    def drain(self, timeout: float = None) -> bool:
+        """Waits until there are no requests in flight.
+
+        Parameters
+        ----------
+        timeout : float, defaults to None
+            Maximum time to wait in seconds. If None, it waits indefinitely.
+
+        Returns
+        -------
+        bool
+            True if all the requests finished, False if the timeout expired first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._count > 0:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _after_fork(self) -> None:
+        # Requests in flight in the parent are not in flight in the child
+        self._count = 0
+        self._cond = threading.Condition()
+
+
+# Process-wide count of the requests to Solr
+inflight = InflightRequests()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=inflight._after_fork)
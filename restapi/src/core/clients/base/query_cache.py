@@ -0,0 +1,321 @@
+"""
+This module provides a cache for the results of the queries sent to Solr.
+
+Results are cached as the raw bytes returned by Solr, keyed by the collection, the normalized query parameters, the version of the collection and the shared generation of the collections (see generations.py). The version of a collection is bumped every time documents are committed to or deleted from it through the API, and the generation every time a corpus or a model is indexed or deleted by any process of the API, which makes the affected cached results unreachable at once.
+
+The LocalCacheBackend class keeps the entries in process memory, evicting the least recently used ones when a byte budget is exceeded; the collection versions are kept as shared generations, so that a commit made by any process (another worker of the server or a job) is seen by all of them. The RedisCacheBackend class keeps the entries and the collection versions in a Redis server shared by all the workers of a deployment.
+
+Author: Lorena Calvo-Bartolomé
+Date: 22/06/2023
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Union
+
+from src.core.clients.base.generations import COLLECTIONS, GenerationStore
+
+# Parameters that do not change the content of the results
+_IGNORED_PARAMS = ("wt",)
+
+
+def normalize_params(params: dict) -> str:
+    """Returns a canonical representation of the parameters of a query, so that equivalent queries (e.g., same parameters in a different order or with different whitespace) share a cache entry.
+
+    Parameters
+    ----------
+    params : dict
+        Parameters of the query.
+    """
+    items = []
+    for key in sorted(params):
+        if key in _IGNORED_PARAMS or params[key] is None:
+            continue
+        value = params[key]
+        values = value if isinstance(value, (list, tuple)) else [value]
+        for value in values:
+            items.append(key + "=" + " ".join(str(value).split()))
+    return "&".join(items)
+
+
+class LocalCacheBackend(object):
+    """
+    A class to keep cached results in process memory, with LRU eviction under a byte budget.
+    """
+
+    def __init__(self,
+                 max_bytes: int = 256 * 1024 ** 2,
+                 max_entry_bytes: int = None,
+                 generations: GenerationStore = None) -> None:
+        """
+        Parameters
+        ----------
+        max_bytes : int
+            Maximum size (in bytes) of the cached results.
+        max_entry_bytes : int
+            Maximum size (in bytes) of a single result. It defaults to a tenth of max_bytes.
+        generations : GenerationStore
+            Store in which the versions of the collections are shared with the other processes of the API. If None, versions are only kept (and bumped) in this process.
+        """
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max_bytes // 10
+        self.generations = generations
+
+        # key -> (collection, expiration time, content)
+        self._entries: OrderedDict = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self.nbytes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        return
+
+    def version(self, col_name: str) -> str:
+        version = self._versions.get(col_name, 0)
+        if self.generations is None:
+            return str(version)
+        return "{}.{}".format(version, self.generations.get("collection:" + col_name))
+
+    def bump_version(self, col_name: str) -> None:
+        if self.generations is not None:
+            self.generations.bump("collection:" + col_name)
+        with self._lock:
+            self._versions[col_name] = self._versions.get(col_name, 0) + 1
+            # The entries of the collection are unreachable, so they are freed right away
+            for key in [key for key, entry in self._entries.items()
+                        if entry[0] == col_name]:
+                self.nbytes -= len(self._entries.pop(key)[2])
+        return
+
+    def get(self, key: str) -> Union[bytes, None]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] < time.monotonic():
+                del self._entries[key]
+                self.nbytes -= len(entry[2])
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def set(self, key: str, col_name: str, content: bytes, ttl: float = None) -> None:
+        if len(content) > self.max_entry_bytes:
+            return
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= len(old[2])
+            self._entries[key] = (col_name, expires, content)
+            self.nbytes += len(content)
+            while self.nbytes > self.max_bytes and self._entries:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.nbytes -= len(evicted)
+                self.evictions += 1
+        return
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+        return
+
+    def stats(self) -> dict:
+        return {"backend": "local",
+                "entries": len(self._entries),
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions}
+
+
+class RedisCacheBackend(object):
+    """
+    A class to keep cached results in a Redis server, so that they are shared by all the workers of the API. Entries are evicted by Redis according to its own memory policy (e.g., maxmemory-policy allkeys-lru).
+    """
+
+    def __init__(self, url: str, prefix: str = "ewb:cache:") -> None:
+        """
+        Parameters
+        ----------
+        url : str
+            URL of the Redis server (e.g., 'redis://redis:6379/0').
+        prefix : str
+            Prefix of the keys written by the cache.
+        """
+        # Only required when a shared backend is configured
+        import redis
+
+        self.url = url
+        self.prefix = prefix
+        self.redis = redis.Redis.from_url(url)
+
+        return
+
+    def version(self, col_name: str) -> int:
+        return int(self.redis.get(self.prefix + "version:" + col_name) or 0)
+
+    def bump_version(self, col_name: str) -> None:
+        self.redis.incr(self.prefix + "version:" + col_name)
+        return
+
+    def get(self, key: str) -> Union[bytes, None]:
+        return self.redis.get(self.prefix + key)
+
+    def set(self, key: str, col_name: str, content: bytes, ttl: float = None) -> None:
+        self.redis.set(self.prefix + key, content,
+                       ex=int(ttl) if ttl else None)
+        return
+
+    def clear(self) -> None:
+        for key in self.redis.scan_iter(match=self.prefix + "q:*"):
+            self.redis.delete(key)
+        return
+
+    def stats(self) -> dict:
+        info = self.redis.info("memory")
+        return {"backend": "redis",
+                "url": self.url,
+                "bytes": info.get("used_memory"),
+                "max_bytes": info.get("maxmemory")}
+
+
+class QueryCache(object):
+    """
+    A class to cache the results of the queries sent to Solr.
+    """
+
+    def __init__(self,
+                 enabled: bool = False,
+                 max_bytes: int = 256 * 1024 ** 2,
+                 ttl: float = 600,
+                 backend_url: str = None,
+                 logger: logging.Logger = None) -> None:
+        """
+        Parameters
+        ----------
+        enabled : bool, defaults to False
+            Whether query results are cached.
+        max_bytes : int, defaults to 256 MB
+            Memory budget of the in-process cache.
+        ttl : float, defaults to 600
+            Time in seconds after which a cached result expires, to bound staleness when collections are modified outside the API. If None or 0, results only expire when their collection is modified through the API.
+        backend_url : str
+            URL of a shared backend (only 'redis://' URLs are supported). If None or empty, results are cached in process memory.
+        logger : logging.Logger
+            The logger object to log messages and errors.
+        """
+        self.logger = logger or logging.getLogger('Solr')
+        self.enabled = False
+        self.ttl = None
+        self.generations = None
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+        self.configure(enabled=enabled, max_bytes=max_bytes,
+                       ttl=ttl, backend_url=backend_url)
+
+        return
+
+    def configure(self,
+                  enabled: bool = None,
+                  max_bytes: int = None,
+                  ttl: float = None,
+                  backend_url: str = None,
+                  generations: GenerationStore = None) -> None:
+        """Updates the cache settings, replacing the backend (and thus dropping the cached results) if the memory budget or the backend change. Settings given as None are left unchanged; an empty backend_url switches back to the in-process backend. generations is the store of the generations shared by the processes of the API, which the in-process backend requires to see the commits made by other processes.
+        """
+        if generations is not None:
+            self.generations = generations
+
+        if ttl is not None:
+            self.ttl = ttl if ttl > 0 else None
+
+        if backend_url:
+            if not isinstance(self.backend, RedisCacheBackend) or \
+                    self.backend.url != backend_url:
+                if not backend_url.startswith(("redis://", "rediss://")):
+                    raise ValueError(
+                        f"Unsupported cache backend {backend_url}")
+                self.backend = RedisCacheBackend(backend_url)
+        elif self.backend is None or \
+                (backend_url is not None and not isinstance(self.backend, LocalCacheBackend)):
+            self.backend = LocalCacheBackend(
+                max_bytes=max_bytes or 256 * 1024 ** 2, generations=self.generations)
+        elif max_bytes is not None and isinstance(self.backend, LocalCacheBackend) and \
+                self.backend.max_bytes != max_bytes:
+            self.backend = LocalCacheBackend(
+                max_bytes=max_bytes, generations=self.generations)
+        if isinstance(self.backend, LocalCacheBackend):
+            self.backend.generations = self.generations
+
+        if enabled is not None:
+            self.enabled = enabled
+
+        return
+
+    def key(self, col_name: str, params: dict) -> str:
+        """Returns the cache key of a query on the given collection, which includes the current version of the collection and the shared generation of the collections."""
+        normalized = normalize_params(params)
+        version = self.backend.version(col_name)
+        if self.generations is not None:
+            version = "{}.{}".format(version, self.generations.get(COLLECTIONS))
+        digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+        return f"q:{col_name}:{version}:{digest}"
+
+    def get(self, key: str) -> Union[bytes, None]:
+        """Returns the cached result for the given key, or None if there is none."""
+        try:
+            content = self.backend.get(key)
+        except Exception as e:
+            self.logger.warning(f"-- -- Query cache unavailable: {e}")
+            content = None
+        if content is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return content
+
+    def put(self, key: str, col_name: str, content: bytes) -> None:
+        """Caches the result of a query."""
+        try:
+            self.backend.set(key, col_name, content, ttl=self.ttl)
+        except Exception as e:
+            self.logger.warning(f"-- -- Query cache unavailable: {e}")
+        return
+
+    def invalidate(self, col_name: str) -> None:
+        """Makes all the cached results of the given collection unreachable."""
+        try:
+            self.backend.bump_version(col_name)
+        except Exception as e:
+            self.logger.error(
+                f"-- -- Query cache could not be invalidated for {col_name}: {e}")
+        return
+
+    def clear(self) -> None:
+        """Drops all the cached results."""
+        self.backend.clear()
+        self.hits = self.misses = 0
+        return
+
+    def stats(self) -> dict:
+        """Returns the hit ratio and the memory used by the cache."""
+        lookups = self.hits + self.misses
+        stats = {"enabled": self.enabled,
+                 "hits": self.hits,
+                 "misses": self.misses,
+                 "hit_ratio": self.hits / lookups if lookups else None,
+                 "ttl": self.ttl}
+        try:
+            stats.update(self.backend.stats())
+        except Exception as e:
+            stats["error"] = str(e)
+        return stats
+
+
+# Process-wide cache shared by all the Solr clients
+query_cache = QueryCache()
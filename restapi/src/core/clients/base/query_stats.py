@@ -0,0 +1,254 @@
+"""
+This module provides low-overhead instrumentation for the queries sent to Solr.
+
+The Histogram class is a fixed-bucket, thread-safe histogram that records observations without storing them individually.
+
+The QueryInstrumentation class records, per collection, the client wall time, the Solr QTime, the bytes sent and received and the number of rows requested for each query, and logs a sample of the queries slower than a configurable threshold. Wall time and QTime are also recorded per collection and query type (the EWB query being run, see ``current_query``).
+
+Author: Lorena Calvo-Bartolomé
+Date: 12/06/2023
+"""
+
+import bisect
+import logging
+import random
+import threading
+from contextvars import ContextVar
+from typing import Dict, List, Tuple
+
+# Bucket upper bounds (inclusive); the last bucket catches everything else
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000,
+                      2500, 5000, 10000, 30000, 60000)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(11))
+ROWS_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+# Type of the query being sent to Solr (e.g., the name of the EWB query), in the current thread or task
+current_query: ContextVar[str] = ContextVar("current_query", default="other")
+
+
+class Histogram(object):
+    """
+    A fixed-bucket histogram.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        """
+        Parameters
+        ----------
+        buckets : Tuple[float, ...]
+            Sorted upper bounds of the buckets.
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+        return
+
+    def observe(self, value: float) -> None:
+        """Records an observation.
+
+        Parameters
+        ----------
+        value : float
+            The value to record.
+        """
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[idx] += 1
+            self.sum += value
+            self.count += 1
+
+        return
+
+    def percentile(self, q: float) -> float:
+        """Estimates the q-th percentile as the upper bound of the bucket in which it falls.
+
+        Parameters
+        ----------
+        q : float
+            Percentile to estimate, in [0, 100].
+
+        Returns
+        -------
+        float
+            The estimated percentile, or None if nothing has been observed yet.
+        """
+        with self._lock:
+            counts = list(self.counts)
+            total = self.count
+        if total == 0:
+            return None
+
+        target = total * q / 100.0
+        acc = 0
+        for idx, count in enumerate(counts):
+            acc += count
+            if acc >= target and count:
+                return self.buckets[idx] if idx < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def snapshot(self) -> dict:
+        """Returns a copy of the state of the histogram.
+
+        Returns
+        -------
+        dict
+            Dictionary with the bucket bounds, the cumulative counts per bucket, the sum and the count of the observations.
+        """
+        with self._lock:
+            counts = list(self.counts)
+            total, sum_ = self.count, self.sum
+        cumulative = []
+        acc = 0
+        for count in counts:
+            acc += count
+            cumulative.append(acc)
+        return {"buckets": list(self.buckets) + ["+Inf"],
+                "cumulative_counts": cumulative,
+                "sum": sum_,
+                "count": total}
+
+
+class QueryInstrumentation(object):
+    """
+    A class to record per-collection statistics of the queries sent to Solr.
+    """
+
+    def __init__(self,
+                 enabled: bool = True,
+                 slow_query_ms: float = 1000,
+                 slow_query_sample_rate: float = 1.0,
+                 logger: logging.Logger = None) -> None:
+        """
+        Parameters
+        ----------
+        enabled : bool, defaults to True
+            Whether queries are instrumented. When disabled, the query path does not time nor format anything.
+        slow_query_ms : float, defaults to 1000
+            Client wall time (in ms) above which a query is considered slow. If None, slow queries are not logged.
+        slow_query_sample_rate : float, defaults to 1.0
+            Fraction of the slow queries that are logged.
+        logger : logging.Logger
+            The logger object to log slow queries.
+        """
+        self.enabled = enabled
+        self.slow_query_ms = slow_query_ms
+        self.slow_query_sample_rate = slow_query_sample_rate
+        self.logger = logger or logging.getLogger('Solr')
+
+        self._stats: Dict[str, Dict[str, Histogram]] = {}
+        self._by_query: Dict[Tuple[str, str], Dict[str, Histogram]] = {}
+        self._lock = threading.Lock()
+
+        return
+
+    def configure(self,
+                  enabled: bool = None,
+                  slow_query_ms: float = None,
+                  slow_query_sample_rate: float = None) -> None:
+        """Updates the instrumentation settings. Settings given as None are left unchanged.
+        """
+        if enabled is not None:
+            self.enabled = enabled
+        if slow_query_ms is not None:
+            self.slow_query_ms = slow_query_ms if slow_query_ms > 0 else None
+        if slow_query_sample_rate is not None:
+            self.slow_query_sample_rate = slow_query_sample_rate
+
+        return
+
+    def _get_stats(self, col_name: str) -> Dict[str, Histogram]:
+        stats = self._stats.get(col_name)
+        if stats is None:
+            with self._lock:
+                stats = self._stats.setdefault(col_name, {
+                    "wall_ms": Histogram(LATENCY_BUCKETS_MS),
+                    "qtime_ms": Histogram(LATENCY_BUCKETS_MS),
+                    "bytes_out": Histogram(BYTES_BUCKETS),
+                    "bytes_in": Histogram(BYTES_BUCKETS),
+                    "rows": Histogram(ROWS_BUCKETS),
+                })
+        return stats
+
+    def _get_query_stats(self, col_name: str, query: str) -> Dict[str, Histogram]:
+        stats = self._by_query.get((col_name, query))
+        if stats is None:
+            with self._lock:
+                stats = self._by_query.setdefault((col_name, query), {
+                    "wall_ms": Histogram(LATENCY_BUCKETS_MS),
+                    "qtime_ms": Histogram(LATENCY_BUCKETS_MS),
+                })
+        return stats
+
+    def record(self,
+               col_name: str,
+               wall_ms: float,
+               qtime_ms: float,
+               bytes_out: int,
+               bytes_in: int,
+               rows: int,
+               params: dict = None) -> None:
+        """Records the statistics of a query.
+
+        Parameters
+        ----------
+        col_name : str
+            The name of the queried collection.
+        wall_ms : float
+            Client wall time of the query, in ms.
+        qtime_ms : float
+            Time reported by Solr (QTime), in ms. None if not available.
+        bytes_out : int
+            Size of the request sent to Solr.
+        bytes_in : int
+            Size of the response received from Solr.
+        rows : int
+            Number of rows requested. None if not given.
+        params : dict
+            Parameters of the query, only used for slow query logging.
+        """
+        stats = self._get_stats(col_name)
+        stats["wall_ms"].observe(wall_ms)
+        if qtime_ms is not None:
+            stats["qtime_ms"].observe(qtime_ms)
+        query_stats = self._get_query_stats(col_name, current_query.get())
+        query_stats["wall_ms"].observe(wall_ms)
+        if qtime_ms is not None:
+            query_stats["qtime_ms"].observe(qtime_ms)
+        stats["bytes_out"].observe(bytes_out)
+        stats["bytes_in"].observe(bytes_in)
+        if rows is not None:
+            stats["rows"].observe(rows)
+
+        if self.slow_query_ms is not None and wall_ms >= self.slow_query_ms and \
+                random.random() < self.slow_query_sample_rate:
+            self.logger.warning(
+                "-- -- Slow query on %s: %.1f ms (QTime %s ms, %d bytes in) %s",
+                col_name, wall_ms, qtime_ms, bytes_in, params)
+
+        return
+
+    def collections(self) -> List[str]:
+        """Returns the names of the collections that have been queried so far."""
+        return list(self._stats)
+
+    def histogram(self, col_name: str, metric: str) -> Histogram:
+        """Returns the histogram of the given metric ('wall_ms', 'qtime_ms', 'bytes_out', 'bytes_in' or 'rows') for the given collection, or None if the collection has not been queried yet."""
+        stats = self._stats.get(col_name)
+        return stats[metric] if stats else None
+
+    def snapshot(self) -> dict:
+        """Returns the state of all the histograms, per collection and metric."""
+        return {col: {metric: hist.snapshot() for metric, hist in stats.items()}
+                for col, stats in list(self._stats.items())}
+
+    def query_snapshot(self) -> dict:
+        """Returns the state of the wall time and QTime histograms, per (collection, query type) and metric."""
+        return {key: {metric: hist.snapshot() for metric, hist in stats.items()}
+                for key, stats in list(self._by_query.items())}
+
+
+# Process-wide instrumentation shared by all the Solr clients
+instrumentation = QueryInstrumentation()
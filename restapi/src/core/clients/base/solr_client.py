@@ -11,13 +11,74 @@ Author: Lorena Calvo-Bartolomé
 Date: 27/03/2023
 """
 
+import contextvars
+import json
 import logging
 import os
-from typing import List, Union
+import threading
+import time
+from concurrent.futures import (FIRST_COMPLETED, Future, ThreadPoolExecutor,
+                                wait)
+from typing import Callable, Iterable, Iterator, List, Tuple, Union
 from urllib import parse
-from typing import List
 
 import requests
+from src.core.clients.base.deadline import DeadlineExceeded, current_deadline
+from src.core.clients.base.hedging import (HedgedRequest, HedgingPolicy,
+                                          hedging_session)
+from src.core.clients.base.inflight import inflight
+from src.core.clients.base.query_cache import QueryCache, query_cache
+from src.core.clients.base.query_stats import (QueryInstrumentation,
+                                               instrumentation)
+from src.core.clients.base.solr_cluster import SolrClusterState
+from src.core.clients.base.tracing import CLIENT, tracer
+from src.core.clients.base.solr_stream import (SolrStreamError,
+                                               iter_json_array)
+
+try:
+    # orjson decodes large Solr responses several times faster than the stdlib
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# Solr always writes the responseHeader first, so it can be decoded from a
+# prefix of the body without touching the (potentially huge) document list
+_HEADER_KEY = b'"responseHeader"'
+_HEADER_WINDOW = 1 << 16
+_header_decoder = json.JSONDecoder()
+
+
+def decode_response_header(content: bytes) -> Union[dict, None]:
+    """Decodes only the ``responseHeader`` object of a raw Solr JSON response.
+
+    Parameters
+    ----------
+    content: bytes
+        Raw body of the Solr response.
+
+    Returns
+    -------
+    dict or None
+        The decoded response header, or None if it could not be located at the beginning of the response.
+    """
+
+    pos = content.find(_HEADER_KEY, 0, 256)
+    if pos < 0:
+        return None
+    start = content.index(b':', pos + len(_HEADER_KEY)) + 1
+
+    window = _HEADER_WINDOW
+    while True:
+        # The last char of the window may be a truncated multi-byte sequence
+        chunk = content[start:start + window].decode(
+            'utf-8', errors='ignore').lstrip()
+        try:
+            header, _ = _header_decoder.raw_decode(chunk)
+            return header if isinstance(header, dict) else None
+        except json.JSONDecodeError:
+            if start + window >= len(content):
+                return None
+            window *= 4
 
 
 class SolrResults(object):
@@ -25,56 +86,173 @@ class SolrResults(object):
 
     Individual documents can be retrieved either through ``docs`` attribute
     or by iterating over results instance.
+
+    The body of the response can be given either already decoded (``json_response``) or as the raw bytes returned by Solr (see ``from_content``). In the latter case, only the response header is decoded eagerly; the rest of the response (documents, facets, etc.) is decoded the first time it is accessed, and the raw bytes are released afterwards.
     """
 
     def __init__(self,
-                 json_response: dict,
-                 next_page_query: bool = None) -> None:
+                 json_response: dict) -> None:
         """Init method.
 
         Parameters
         ----------
         json_response: dict
             JSON response from Solr.
-        next_page_query: bool, defaults to None
-            If True, then the next page of results is fetched.
         """
-        self.solr_json_response = json_response
+        self._content = None
+        self._json = json_response
+        self.header = json_response.get("responseHeader", {})
+        self._materialize()
+
+        return
+
+    @classmethod
+    def from_content(cls,
+                     content: bytes,
+                     header: dict) -> 'SolrResults':
+        """Creates a SolrResults object from the raw body of a Solr response, deferring its decoding until the documents or any other part of the body are accessed.
+
+        Parameters
+        ----------
+        content: bytes
+            Raw body of the Solr response.
+        header: dict
+            Already decoded response header.
+
+        Returns
+        -------
+        SolrResults
+            The lazily decoded results.
+        """
+        results = cls.__new__(cls)
+        results._content = content
+        results._json = None
+        results.header = header
+        return results
+
+    def _materialize(self) -> None:
+        """Decodes the body of the response (if not done yet) and sets the results attributes."""
+
+        if self._json is None:
+            self._json = json_loads(self._content)
+            # The raw bytes are not needed anymore
+            self._content = None
+        json_response = self._json
 
         # Main response part of decoded Solr response
         response = json_response.get("response") or {}
-        self.docs = response.get("docs", ())
-        self.hits = response.get("numFound", 0)
+        self._docs = response.get("docs", ())
+        self._hits = response.get("numFound", 0)
 
         # other response metadata
-        self.debug = json_response.get("debug", {})
-        self.highlighting = json_response.get("highlighting", {})
-        self.facets = json_response.get("facet_counts", {})
-        self.spellcheck = json_response.get("spellcheck", {})
-        self.stats = json_response.get("stats", {})
-        self.qtime = json_response.get("responseHeader", {}).get("QTime", None)
-        self.grouped = json_response.get("grouped", {})
-        self.nextCursorMark = json_response.get("nextCursorMark", None)
-        self._next_page_query = (
-            self.nextCursorMark is not None and next_page_query or None
-        )
+        self._debug = json_response.get("debug", {})
+        self._highlighting = json_response.get("highlighting", {})
+        self._facets = json_response.get("facet_counts", {})
+        self._spellcheck = json_response.get("spellcheck", {})
+        self._stats = json_response.get("stats", {})
+        self._grouped = json_response.get("grouped", {})
+        self._nextCursorMark = json_response.get("nextCursorMark", None)
 
         return
 
+    def _get(self, attr: str):
+        if self._json is None:
+            self._materialize()
+        return getattr(self, attr)
+
+    @property
+    def solr_json_response(self) -> dict:
+        return self._get("_json")
+
+    @property
+    def docs(self) -> list:
+        return self._get("_docs")
+
+    @property
+    def hits(self) -> int:
+        return self._get("_hits")
+
+    @property
+    def debug(self) -> dict:
+        return self._get("_debug")
+
+    @property
+    def highlighting(self) -> dict:
+        return self._get("_highlighting")
+
+    @property
+    def facets(self) -> dict:
+        return self._get("_facets")
+
+    @property
+    def spellcheck(self) -> dict:
+        return self._get("_spellcheck")
+
+    @property
+    def stats(self) -> dict:
+        return self._get("_stats")
+
+    @property
+    def grouped(self) -> dict:
+        return self._get("_grouped")
+
+    @property
+    def nextCursorMark(self) -> str:
+        return self._get("_nextCursorMark")
+
+    @property
+    def qtime(self) -> int:
+        return self.header.get("QTime", None)
+
+    @property
+    def partial(self) -> bool:
+        """Whether Solr stopped the search before it was complete (e.g., because of timeAllowed)."""
+        return bool(self.header.get("partialResults", False))
+
     def __len__(self) -> int:
-        """Return the number of documents in the results."""
-        if self._next_page_query:
-            return self.hits
-        else:
-            return len(self.docs)
+        """Return the number of documents in this page of the results (see ``hits`` for the total)."""
+        return len(self.docs)
 
     def __iter__(self) -> iter:
-        """Iterate over the documents in the results."""
-        result = self
-        while result:
-            for d in result.docs:
-                yield d
-            result = result._next_page_query and result._next_page_query()
+        """Iterate over the documents in this page of the results. The following pages are requested by the caller with ``nextCursorMark``."""
+        return iter(self.docs)
+
+    def to_arrow(self, columns: List[str] = None):
+        """Returns the documents in the results as a ``pyarrow.Table``. The table is built in one pass over the decoded documents (Solr's JSON response cannot be read by Arrow directly); if columns are given, only those are converted.
+
+        Parameters
+        ----------
+        columns: List[str], defaults to None
+            Columns to keep. If None, all the fields returned by Solr are kept.
+
+        Returns
+        -------
+        table: pyarrow.Table
+            Table with one row per document.
+        """
+        import pyarrow as pa
+
+        # Documents only hold the fields they have a value for. Columns that none of the documents has are left out
+        docs = self.docs
+        present = dict.fromkeys(key for doc in docs for key in doc)
+        if columns is not None:
+            present = [col for col in columns if col in present]
+        return pa.table({col: [doc.get(col) for doc in docs] for col in present})
+
+    def to_dataframe(self, columns: List[str] = None):
+        """Returns the documents in the results as a ``pandas.DataFrame`` (see ``to_arrow``).
+
+        Parameters
+        ----------
+        columns: List[str], defaults to None
+            Columns to keep. If None, all the fields returned by Solr are kept.
+
+        Returns
+        -------
+        df: pandas.DataFrame
+            DataFrame with one row per document.
+        """
+        return self.to_arrow(columns=columns).to_pandas()
 
 
 class SolrResp(object):
@@ -132,6 +310,8 @@ class SolrResp(object):
         self.text = text
         self.data = data
         self.results = results
+        # Size in bytes of the raw response body
+        self.nbytes = 0
 
         return
 
@@ -140,7 +320,9 @@ class SolrResp(object):
         return SolrResp(status_code, text, [])
 
     @staticmethod
-    def from_requests_response(resp: requests.Response, logger: logging.Logger):
+    def from_requests_response(resp: requests.Response,
+                               logger: logging.Logger,
+                               lazy: bool = False):
         """
         Parameters
         ----------
@@ -148,6 +330,8 @@ class SolrResp(object):
             The Solr API response.
         logger : logging.Logger
             The logger object to log messages and errors.
+        lazy : bool, defaults to False
+            If True, the response is known to come from a query handler, so only its header is decoded here and the decoding of the documents is deferred until they are accessed.
         """
 
         status_code = 400
@@ -155,8 +339,18 @@ class SolrResp(object):
         text = ""
         results = {}
 
+        content = resp.content
+
+        if lazy:
+            header = decode_response_header(content)
+            if header is not None and header.get('status') == 0:
+                results = SolrResults.from_content(content, header)
+                solr_resp = SolrResp(200, text, data, results)
+                solr_resp.nbytes = len(content)
+                return solr_resp
+
         # Get JSON object of the result
-        resp = resp.json()
+        resp = json_loads(content)
 
         # If response header has status 0, request is acknowledged
         if 'responseHeader' in resp and resp['responseHeader']['status'] == 0:
@@ -172,11 +366,17 @@ class SolrResp(object):
         # If collections are returned in response, set data attribute to collections list
         if 'collections' in resp:
             data = resp['collections']
+        # If schema fields are returned in response, set data attribute to fields list
+        elif 'fields' in resp:
+            data = resp['fields']
 
         if 'response' in resp:
-            results = SolrResults(resp, True)
+            results = SolrResults(resp)
 
-        return SolrResp(status_code, text, data, results)
+        solr_resp = SolrResp(status_code, text, data, results)
+        solr_resp.nbytes = len(content)
+
+        return solr_resp
 
 
 class SolrClient(object):
@@ -184,12 +384,19 @@ class SolrClient(object):
     A class to handle Solr API requests.
     """
 
-    def __init__(self, logger: logging.Logger) -> None:
+    def __init__(self,
+                 logger: logging.Logger,
+                 query_instrumentation: QueryInstrumentation = None,
+                 cache: QueryCache = None) -> None:
         """
         Parameters
         ----------
         logger : logging.Logger
             The logger object to log messages and errors.
+        query_instrumentation : QueryInstrumentation, defaults to None
+            Object in which the statistics of the queries are recorded. If None, the process-wide instrumentation is used.
+        cache : QueryCache, defaults to None
+            Cache of query results. If None, the process-wide cache is used.
         """
 
         # Get the Solr URL from the environment variables
@@ -198,16 +405,284 @@ class SolrClient(object):
         # Initialize requests session and logger
         self.solr = requests.Session()
         # self.logger = logger
-        import logging
-        logging.basicConfig(level='DEBUG')
+        # The logging configuration is left to the application
         self.logger = logging.getLogger('Solr')
 
+        self.instrumentation = query_instrumentation or instrumentation
+        self.cache = cache or query_cache
+
+        # SolrCloud-aware routing is disabled until enable_cloud_routing is called
+        self.cluster = None
+        # Hedging of reads is disabled until enable_hedging is called
+        self.hedging = None
+        self._hedge_pool = None
+        self._hedge_workers = 0
+        self._hedge_timeout = None
+        self._hedge_session = None
+        # Threads of the hedging pool running a read (including those that lost and are being aborted)
+        self._hedge_busy = 0
+        self._hedge_lock = threading.Lock()
+
+        return
+
+    def enable_cloud_routing(self,
+                             balancing: str = "round_robin",
+                             ttl: float = 30,
+                             extra_nodes: List[str] = ()) -> None:
+        """Enables the routing of the requests on collections to the nodes of the SolrCloud cluster according to its live state: queries are balanced among the healthy replicas of the collection and updates are sent to shard leaders.
+
+        Parameters
+        ----------
+        balancing : str, defaults to 'round_robin'
+            Balancing policy for queries, either 'round_robin' or 'least_outstanding'.
+        ttl : float, defaults to 30
+            Time in seconds for which the cluster state is cached.
+        extra_nodes : List[str]
+            URLs of other Solr nodes, besides SOLR_URL, from which the cluster state can be read.
+        """
+        self.cluster = SolrClusterState(
+            seed_urls=[self.solr_url] + list(extra_nodes),
+            balancing=balancing,
+            ttl=ttl,
+            logger=self.logger)
+
         return
 
+    def enable_hedging(self,
+                       policy: HedgingPolicy = None,
+                       max_workers: int = 16,
+                       timeout: float = 30) -> None:
+        """Enables the hedging of queries: if a query has not been answered within the delay given by the policy, a duplicate is sent to another replica and the first response is used. It only has effect when cloud routing is enabled and the collection has more than one healthy replica.
+
+        Parameters
+        ----------
+        policy : HedgingPolicy, defaults to None
+            The hedging policy. If None, a policy with the default settings is used.
+        max_workers : int, defaults to 16
+            Maximum number of concurrent hedged requests (original reads and duplicates). When all of them are busy, reads are sent without hedging.
+        timeout : float, defaults to 30
+            Timeout in seconds of the hedged requests when the request being served has no deadline.
+        """
+        self.hedging = policy or HedgingPolicy()
+        self._hedge_workers = max_workers
+        self._hedge_timeout = timeout
+        self._hedge_pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='solr-hedge')
+        # Connections to Solr reused by the hedged reads
+        self._hedge_session = hedging_session(pool_size=max_workers)
+
+        return
+
+    def reset_after_fork(self) -> None:
+        """Replaces the state that a forked process cannot inherit: the threads of the hedging pool do not exist in the child, and its pooled connections are shared with the parent, so a new pool and a new session are created."""
+        if self._hedge_pool is not None:
+            self._hedge_pool = ThreadPoolExecutor(
+                max_workers=self._hedge_workers, thread_name_prefix='solr-hedge')
+            self._hedge_session = hedging_session(pool_size=self._hedge_workers)
+            self._hedge_busy = 0
+            self._hedge_lock = threading.Lock()
+
+        return
+
+    def close(self) -> None:
+        """Releases the threads of the client, waiting for the hedged requests in flight."""
+        if self._hedge_pool is not None:
+            self._hedge_pool.shutdown(wait=True)
+            self._hedge_session.close()
+
+        return
+
+    def _send_to_node(self,
+                      type: str,
+                      node: str,
+                      col_name: str,
+                      path: str,
+                      **params) -> SolrResp:
+        """Sends a request on the given collection to the given node, accounting for it in the cluster state."""
+
+        url_ = '{}/solr/{}/{}'.format(node, col_name, path)
+        self.cluster.begin(node)
+        try:
+            return self._do_request(type=type, url=url_, **params)
+        finally:
+            self.cluster.end(node)
+
+    def _submit_hedged(self,
+                       node: str,
+                       col_name: str,
+                       path: str,
+                       **params) -> Tuple[Future, HedgedRequest]:
+        """Sends a read to the given node from the hedging pool, if one of its threads is free.
+
+        Returns
+        -------
+        Tuple[Future, HedgedRequest]
+            The future of the response and the request (to abort it), or (None, None) if all the threads are busy.
+        """
+        with self._hedge_lock:
+            if self._hedge_busy >= self._hedge_workers:
+                return None, None
+            self._hedge_busy += 1
+
+        request = HedgedRequest()
+
+        def send():
+            try:
+                with request.active():
+                    return self._send_to_node("get", node, col_name, path,
+                                              session=self._hedge_session, **params)
+            finally:
+                with self._hedge_lock:
+                    self._hedge_busy -= 1
+
+        # The request runs in a copy of the context of the caller, so that its span belongs to the trace of the request
+        return self._hedge_pool.submit(contextvars.copy_context().run, send), request
+
+    def _read_request(self,
+                      col_name: str,
+                      path: str,
+                      **params) -> SolrResp:
+        """Sends a read request on the given collection, hedging it if hedging is enabled (see ``enable_hedging``).
+
+        Parameters
+        ----------
+        col_name: str
+            The name of the collection.
+        path: str
+            Path of the request relative to the collection (e.g., 'select?q=*:*').
+        **params
+            Additional parameters for _do_request.
+
+        Returns
+        -------
+        SolrResp : SolrResp
+            The response object.
+        """
+
+        if self.hedging is None or self.cluster is None:
+            return self._route_request(type="get", col_name=col_name,
+                                       path=path, read=True, **params)
+
+        primary = self.cluster.pick_replica(col_name)
+        if primary is None:
+            return self._route_request(type="get", col_name=col_name,
+                                       path=path, read=True, **params)
+
+        # Hedged requests are always bounded in time
+        if params.get("timeout") is None:
+            params["timeout"] = self._hedge_timeout
+
+        self.hedging.on_request()
+        future, request = self._submit_hedged(primary, col_name, path, **params)
+        if future is None:
+            # No free thread: send the read from this thread, without hedging
+            self.hedging.on_skipped_busy()
+            return self._route_request(type="get", col_name=col_name,
+                                       path=path, read=True, **params)
+        # future -> (node, request)
+        attempts = {future: (primary, request)}
+
+        try:
+            delay_ms = self.hedging.delay_ms(
+                self.instrumentation.histogram(col_name, "wall_ms"))
+            done, _ = wait(attempts, timeout=delay_ms / 1000)
+            if not done:
+                backup = self.cluster.pick_replica(col_name, exclude=[primary])
+                if backup is not None and self.hedging.try_acquire():
+                    future, request = self._submit_hedged(backup, col_name, path, **params)
+                    if future is None:
+                        self.hedging.on_skipped_busy()
+                    else:
+                        attempts[future] = (backup, request)
+
+            pending = set(attempts)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node, _ = attempts[future]
+                    try:
+                        solr_resp = future.result()
+                    except (requests.exceptions.ConnectionError,
+                            requests.exceptions.Timeout):
+                        self.cluster.mark_down(node)
+                        continue
+                    if node != primary:
+                        self.hedging.on_hedge_won()
+                    return solr_resp
+        finally:
+            # The reads still running lost (or the caller gave up): abort them, so that they release their thread and their connection to Solr
+            for future, (_, request) in attempts.items():
+                if not future.done():
+                    request.cancel()
+                    self.hedging.on_cancelled()
+
+        # Every node we tried failed: fall back on the regular failover
+        return self._route_request(type="get", col_name=col_name,
+                                   path=path, read=True, **params)
+
+    def _route_request(self,
+                       type: str,
+                       col_name: str,
+                       path: str,
+                       read: bool,
+                       max_attempts: int = 3,
+                       **params) -> SolrResp:
+        """Sends a request on the given collection to the node chosen by the cluster state (if cloud routing is enabled) or to SOLR_URL otherwise. If the chosen node is unreachable, it is taken out of rotation and the request is retried on another node.
+
+        Parameters
+        ----------
+        type: str
+            The type of request to send.
+        col_name: str
+            The name of the collection.
+        path: str
+            Path of the request relative to the collection (e.g., 'select?q=*:*').
+        read: bool
+            Whether the request is a read (sent to any healthy replica) or an update (sent to a shard leader).
+        max_attempts: int, defaults to 3
+            Maximum number of nodes to which the request is sent.
+        **params
+            Additional parameters for _do_request.
+
+        Returns
+        -------
+        SolrResp : SolrResp
+            The response object.
+        """
+
+        if self.cluster is None:
+            url_ = '{}/solr/{}/{}'.format(self.solr_url, col_name, path)
+            return self._do_request(type=type, url=url_, **params)
+
+        tried = []
+        for attempt in range(max_attempts):
+            if read:
+                node = self.cluster.pick_replica(col_name, exclude=tried)
+            else:
+                node = self.cluster.pick_leader(col_name)
+            if node is None:
+                # Unknown collection or no healthy node: fall back on SOLR_URL
+                node = self.solr_url
+            url_ = '{}/solr/{}/{}'.format(node, col_name, path)
+
+            self.cluster.begin(node)
+            try:
+                return self._do_request(type=type, url=url_, **params)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout):
+                if node == self.solr_url or attempt == max_attempts - 1:
+                    raise
+                tried.append(node)
+                self.cluster.mark_down(node)
+            finally:
+                self.cluster.end(node)
+
     def _do_request(self,
                     type: str,
                     url: str,
                     timeout: int = None,
+                    lazy: bool = False,
+                    session: requests.Session = None,
                     **params) -> SolrResp:
         """Sends a requests to the given url with the given params and returns an object of the SolrResp class
 
@@ -219,6 +694,10 @@ class SolrClient(object):
             The url to send the request to.
         timeout: int, defaults to 10
             The timeout in seconds to use for the request.
+        lazy: bool, defaults to False
+            Whether the decoding of the documents in the response should be deferred until they are accessed (only for query requests).
+        session: requests.Session, defaults to None
+            Session with which the request is sent (e.g., that of the hedged reads). If None, a new connection is used.
 
         Returns
         -------
@@ -226,26 +705,42 @@ class SolrClient(object):
             The response object.
         """
 
-        # Send request
-        if type == "get":
-            resp = requests.get(
-                url=url,
-                timeout=timeout,
-                **params
-            )
-            pass
-        elif type == "post":
-            resp = requests.post(
-                url=url,
-                timeout=timeout,
-                **params
-            )
-        else:
+        if type not in ("get", "post"):
             self.logger.error(f"-- -- Invalid type {type}")
             return
 
-        # Parse Solr response
-        solr_resp = SolrResp.from_requests_response(resp, self.logger)
+        url_parts = parse.urlsplit(url)
+        with tracer.span("solr {} {}".format(type.upper(), url_parts.path), kind=CLIENT,
+                         **{"http.method": type.upper(),
+                            "solr.node": url_parts.netloc}) as span:
+            if span is not None:
+                # Propagate the trace to Solr, and tag the request with the trace id so that it can be found in Solr's request log
+                params["headers"] = tracer.inject(params.get("headers"))
+                url += ("&" if url_parts.query else "?") + \
+                    "ewb_trace={}".format(span.trace_id)
+
+            # Send request
+            try:
+                with inflight.track():
+                    resp = getattr(session or requests, type)(
+                        url=url,
+                        timeout=timeout,
+                        **params
+                    )
+            except requests.exceptions.Timeout as e:
+                # Not a failure of the node: the request ran out of time
+                deadline = current_deadline.get()
+                if deadline is not None and deadline.expired:
+                    raise DeadlineExceeded() from e
+                raise
+
+            # Parse Solr response
+            solr_resp = SolrResp.from_requests_response(
+                resp, self.logger, lazy=lazy)
+
+            if span is not None:
+                span.set("http.status_code", solr_resp.status_code)
+                span.set("http.response_size", solr_resp.nbytes)
 
         return solr_resp
 
@@ -296,6 +791,28 @@ class SolrClient(object):
 
         return [{'name': col_name}], solr_resp.status_code
 
+    def get_schema_fields(self, col_name: str) -> Union[List[dict], int]:
+        """Returns the fields of the schema of the collection given by 'col_name', with the default properties of their types (e.g., 'docValues') resolved.
+
+        Parameters
+        ----------
+        col_name: str
+            The name of the collection.
+
+        Returns
+        -------
+        List[dict]
+            The fields of the schema, as returned by the Schema API.
+        int
+            The status code of the response.
+        """
+
+        solr_resp = self._route_request(
+            type="get", col_name=col_name,
+            path='schema/fields?showDefaults=true&wt=json', read=True)
+
+        return solr_resp.data, solr_resp.status_code
+
     def delete_field_from_schema(self,
                                  col_name: str,
                                  field_name: str) -> Union[List[dict], int]:
@@ -327,6 +844,7 @@ class SolrClient(object):
         # Send request to Solr
         solr_resp = self._do_request(type="post", url=url_,
                                      headers=headers_, json=data)
+        self.cache.invalidate(col_name)
 
         return [{'name': col_name}], solr_resp.status_code
 
@@ -379,6 +897,8 @@ class SolrClient(object):
         # Send request to Solr
         solr_resp = self._do_request(type="post", url=url_,
                                      headers=headers_, json=data)
+        if self.cluster is not None:
+            self.cluster.forget_missing(col_name)
 
         return col_name, solr_resp.status_code
 
@@ -403,6 +923,7 @@ class SolrClient(object):
 
         # Send request to Solr
         solr_resp = self._do_request(type="get", url=url_)
+        self.cache.invalidate(col_name)
 
         return [{'name': col_name}], solr_resp.status_code
 
@@ -431,11 +952,11 @@ class SolrClient(object):
             'wt': 'json'
         }
 
-        url_ = '{}/solr/{}/update'.format(self.solr_url, col_name)
-
         # Send request to Solr
-        solr_resp = self._do_request(type="post", url=url_,
-                                     headers=headers_, data=data_, params=params_)
+        solr_resp = self._route_request(type="post", col_name=col_name,
+                                        path="update", read=False,
+                                        headers=headers_, data=data_, params=params_)
+        self.cache.invalidate(col_name)
 
         return solr_resp.status_code
 
@@ -462,7 +983,7 @@ class SolrClient(object):
     # ======================================================
 
     def index_batch(self,
-                    docs_batch: List[dict],
+                    docs_batch: Union[List[dict], bytes],
                     col_name: str,
                     to_index: int,
                     index_from: int,
@@ -471,8 +992,8 @@ class SolrClient(object):
 
         Parameters
         ----------
-        docs_batch : list[dict])
-            A list of dictionaries where each dictionary represents a document to be indexed.
+        docs_batch : Union[list[dict], bytes]
+            A list of dictionaries where each dictionary represents a document to be indexed, or the list already serialized as a JSON array.
         col_name : str
             The name of the Solr collection to index the documents into.
         to_index : int
@@ -496,12 +1017,12 @@ class SolrClient(object):
             'wt': 'json'
         }
 
-        url_ = '{}/solr/{}/update'.format(self.solr_url, col_name)
-
         # Send request to Solr
-        solr_resp = self._do_request(
-            type="post", url=url_, headers=headers_, json=docs_batch,
-            params=params, proxies={})
+        body = {"data": docs_batch} if isinstance(docs_batch, bytes) \
+            else {"json": docs_batch}
+        solr_resp = self._route_request(
+            type="post", col_name=col_name, path="update", read=False,
+            headers=headers_, params=params, proxies={}, **body)
 
         if solr_resp.status_code == 200:
             self.logger.info(
@@ -512,7 +1033,8 @@ class SolrClient(object):
     def index_documents(self,
                         json_docs: List[dict],
                         col_name: str,
-                        batch_size: int = 100) -> None:
+                        batch_size: int = 100,
+                        progress: Callable[[str, int, int], None] = None) -> None:
         """It takes a list of documents in JSON format and a Solr collection name, splits the list into batches, and sends a POST request to the Solr server to index the documents in batches. The method returns the status code of the response.
 
         Parameters
@@ -523,6 +1045,8 @@ class SolrClient(object):
             The name of the Solr collection to index the documents into.
         batch_size : int
             Batch size with which the documents will be indexed
+        progress : Callable[[str, int, int], None], defaults to None
+            Function called with the name of the collection, the number of documents indexed so far and the total number of documents after each batch. Exceptions raised by it (e.g., to cancel the operation) stop the indexing.
         """
 
         docs_batch = []
@@ -539,14 +1063,84 @@ class SolrClient(object):
                 index_from = index + 1
                 self.logger.info("==== indexed {} documents ======"
                                  .format(index))
+                if progress is not None:
+                    progress(col_name, index_from, to_index)
         # To index the rest, when 'documents' list < batch_size.
         if docs_batch:
             self.index_batch(docs_batch, col_name, to_index,
                              index_from=index_from, index_to=index)
+        self.commit(col_name)
+        if progress is not None:
+            progress(col_name, to_index, to_index)
         self.logger.info("-- -- Finished indexing")
 
         return
 
+    def index_batches(self,
+                      batches: Iterable[Tuple[int, bytes]],
+                      col_name: str,
+                      to_index: int = None,
+                      progress: Callable[[str, int, int], None] = None) -> int:
+        """Indexes batches of documents as they are produced (e.g., by Corpus.iter_doc_batches), so that only the batches being built and sent are held in memory.
+
+        Parameters
+        ----------
+        batches : Iterable[Tuple[int, bytes]]
+            Batches of documents, as the number of documents and the documents serialized as a JSON array.
+        col_name : str
+            The name of the Solr collection to index the documents into.
+        to_index : int, defaults to None
+            The total number of documents, if known in advance.
+        progress : Callable[[str, int, int], None], defaults to None
+            Function to which the progress of the indexing is reported (see index_documents).
+
+        Returns
+        -------
+        indexed : int
+            The number of documents indexed.
+        """
+
+        indexed = 0
+        for n_docs, payload in batches:
+            self.index_batch(payload, col_name, to_index or indexed + n_docs,
+                             index_from=indexed, index_to=indexed + n_docs - 1)
+            indexed += n_docs
+            if progress is not None:
+                progress(col_name, indexed, max(to_index or 0, indexed))
+        self.commit(col_name)
+        if progress is not None:
+            progress(col_name, indexed, indexed)
+        self.logger.info("-- -- Finished indexing")
+
+        return indexed
+
+    def commit(self, col_name: str) -> int:
+        """Commits the pending updates of the given collection, making them visible to searches, and invalidates the cached results of the collection.
+
+        Parameters
+        ----------
+        col_name : str
+            The name of the Solr collection.
+
+        Returns
+        -------
+        sc : int
+            The status code of the response.
+        """
+
+        params = {
+            'commit': 'true',
+            'wt': 'json'
+        }
+
+        # Send request to Solr
+        solr_resp = self._route_request(
+            type="post", col_name=col_name, path="update", read=False,
+            params=params, proxies={})
+        self.cache.invalidate(col_name)
+
+        return solr_resp.status_code
+
     # ======================================================
     # QUERIES
     # ======================================================
@@ -588,15 +1182,144 @@ class SolrClient(object):
         # We want the result of the query as json
         params["wt"] = "json"
 
-        # Encode query
-        self.logger.info(params)
-        query_string = parse.urlencode(params)
-        self.logger.info(query_string)
+        # Encode query (list values, e.g. several 'fq', are sent as repeated parameters)
+        query_string = parse.urlencode(params, doseq=True)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("-- -- Query on %s: %s", col_name, params)
+
+        path_ = 'select?{}'.format(query_string)
+
+        # Serve the query from the cache if possible
+        cache_key = None
+        if self.cache.enabled:
+            cache_key = self.cache.key(col_name, params)
+            content = self.cache.get(cache_key)
+            if content is not None:
+                return 200, SolrResults.from_content(
+                    content, decode_response_header(content))
+
+        # Bound the query by the deadline of the request, if any (it is not part of the cache key)
+        deadline = current_deadline.get()
+        timeout = None
+        if deadline is not None and "timeAllowed" not in params:
+            path_ += '&timeAllowed={}'.format(deadline.time_allowed_ms())
+            timeout = max(deadline.remaining(), 0.001)
+
+        # Send query to Solr
+        if not self.instrumentation.enabled:
+            solr_resp = self._read_request(
+                col_name=col_name, path=path_, lazy=True, timeout=timeout)
+            self._cache_results(cache_key, col_name, solr_resp)
+            self._check_partial(deadline, solr_resp.results)
+            return solr_resp.status_code, solr_resp.results
+
+        time_start = time.perf_counter()
+        solr_resp = self._read_request(
+            col_name=col_name, path=path_, lazy=True, timeout=timeout)
+        wall_ms = (time.perf_counter() - time_start) * 1000
+
+        results = solr_resp.results
+        rows = params.get("rows")
+        self.instrumentation.record(
+            col_name=col_name,
+            wall_ms=wall_ms,
+            qtime_ms=results.qtime if isinstance(results, SolrResults) else None,
+            bytes_out=len(path_),
+            bytes_in=solr_resp.nbytes,
+            rows=int(rows) if str(rows).isdigit() else None,
+            params=params)
+        self._cache_results(cache_key, col_name, solr_resp)
+        self._check_partial(deadline, results)
+
+        return solr_resp.status_code, results
 
-        url_ = '{}/solr/{}/select?{}'.format(self.solr_url,
-                                             col_name, query_string)
+    @staticmethod
+    def _check_partial(deadline, results) -> None:
+        """Accounts for the partial results of a query bounded by the deadline of the request.
 
-       # Send query to Solr
-        solr_resp = self._do_request(type="get", url=url_)
+        Raises
+        ------
+        DeadlineExceeded
+            If the results are partial and the client did not allow partial results.
+        """
+        if deadline is None or not isinstance(results, SolrResults) or not results.partial:
+            return
+        if not deadline.allow_partial:
+            raise DeadlineExceeded()
+        deadline.partial = True
+
+        return
+
+    def _cache_results(self,
+                       cache_key: str,
+                       col_name: str,
+                       solr_resp: SolrResp) -> None:
+        """Caches the raw body of a successful query response, if caching is enabled and the body has not been decoded yet."""
+        if cache_key is None or solr_resp.status_code != 200 or \
+                not isinstance(solr_resp.results, SolrResults) or solr_resp.results.partial:
+            return
+        content = solr_resp.results._content
+        if content is not None:
+            self.cache.put(cache_key, col_name, content)
+        return
+
+    def stream_documents(self,
+                         col_name: str,
+                         expr: str,
+                         chunk_size: int = 1 << 16,
+                         timeout: int = 60) -> Iterator[dict]:
+        """Sends a streaming expression to the /stream handler of the collection given by 'col_name' and yields the resulting tuples as they are received, so that result sets of any size can be read with constant memory.
+
+        Parameters
+        ----------
+        col_name: str
+            The name of the collection.
+        expr: str
+            The streaming expression (e.g., as built by solr_stream.search_expression).
+        chunk_size: int, defaults to 64 KB
+            Size of the chunks in which the response is read.
+        timeout: int, defaults to 60
+            Timeout in seconds for connecting and for each read from Solr.
+
+        Yields
+        ------
+        doc: dict
+            Tuples of the stream, without the final EOF tuple.
+
+        Raises
+        ------
+        SolrStreamError
+            If Solr reports an error (before or while streaming).
+        """
 
-        return solr_resp.status_code, solr_resp.results
+        node = None
+        if self.cluster is not None:
+            node = self.cluster.pick_replica(col_name)
+        url_ = '{}/solr/{}/stream'.format(node or self.solr_url, col_name)
+        # The stream outlives the span of the request that opened it, so it is only tagged with its trace
+        headers_ = tracer.inject()
+        if tracer.current is not None:
+            url_ += "?ewb_trace={}".format(tracer.current.trace_id)
+
+        if node is not None:
+            self.cluster.begin(node)
+        try:
+            with inflight.track(), \
+                    requests.post(url=url_, data={"expr": expr}, headers=headers_,
+                                  stream=True, timeout=timeout) as resp:
+                for doc in iter_json_array(resp.iter_content(chunk_size)):
+                    if "EXCEPTION" in doc:
+                        raise SolrStreamError(doc["EXCEPTION"])
+                    if doc.get("EOF"):
+                        return
+                    yield doc
+                if resp.status_code != 200:
+                    raise SolrStreamError(
+                        f"Stream request failed with status {resp.status_code}")
+        except SolrStreamError as e:
+            self.logger.error(
+                f"-- -- Error streaming documents from {col_name}: {e}")
+            raise
+        finally:
+            if node is not None:
+                self.cluster.end(node)
@@ -0,0 +1,267 @@
+"""
+This module provides a class to keep a cached view of the state of a SolrCloud cluster and to route requests to its nodes.
+
+The cluster state is read with the Collections API (CLUSTERSTATUS) from any of the known nodes and cached for a configurable time. Concurrent refreshes are collapsed into one, and collections that are not in the cluster state are remembered as missing for the same time, so that queries on them do not read the cluster state again each time (they are sent to the default node meanwhile). Reads are balanced among the healthy replicas of a collection (round-robin or least-outstanding-requests), while updates are sent to shard leaders. Nodes that fail are taken out of rotation until the next refresh of the cluster state.
+
+Author: Lorena Calvo-Bartolomé
+Date: 14/06/2023
+"""
+
+import itertools
+import logging
+import threading
+import time
+from typing import Dict, List, Union
+
+import requests
+
+ROUND_ROBIN = "round_robin"
+LEAST_OUTSTANDING = "least_outstanding"
+
+
+class SolrClusterState(object):
+    """
+    A class to cache the state of a SolrCloud cluster and to pick the node to which each request is sent.
+    """
+
+    def __init__(self,
+                 seed_urls: List[str],
+                 balancing: str = ROUND_ROBIN,
+                 ttl: float = 30,
+                 timeout: float = 5,
+                 logger: logging.Logger = None) -> None:
+        """
+        Parameters
+        ----------
+        seed_urls : List[str]
+            URLs of the Solr nodes (e.g., 'http://solr:8983') used to read the cluster state.
+        balancing : str, defaults to 'round_robin'
+            Balancing policy for reads, either 'round_robin' or 'least_outstanding'.
+        ttl : float, defaults to 30
+            Time in seconds for which the cluster state is cached.
+        timeout : float, defaults to 5
+            Timeout in seconds of the CLUSTERSTATUS requests.
+        logger : logging.Logger
+            The logger object to log messages and errors.
+        """
+        if balancing not in (ROUND_ROBIN, LEAST_OUTSTANDING):
+            raise ValueError(f"Unknown balancing policy {balancing}")
+
+        self.seed_urls = [url.rstrip("/") for url in seed_urls if url]
+        self.balancing = balancing
+        self.ttl = ttl
+        self.timeout = timeout
+        self.logger = logger or logging.getLogger('Solr')
+
+        # collection -> list of node URLs with an active replica
+        self._replicas: Dict[str, List[str]] = {}
+        # collection -> list of node URLs hosting a shard leader
+        self._leaders: Dict[str, List[str]] = {}
+        self._down = set()
+        self._outstanding: Dict[str, int] = {}
+        self._counters: Dict[str, itertools.count] = {}
+        # collection -> time at which it was found missing from the cluster state
+        self._missing: Dict[str, float] = {}
+        self._loaded_at = None
+        # Time at which the last refresh finished, and its result
+        self._refreshed_at = None
+        self._refresh_ok = False
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+        return
+
+    # ======================================================
+    # CLUSTER STATE
+    # ======================================================
+    @staticmethod
+    def _node_url(replica: dict) -> str:
+        """Returns the URL of the node hosting a replica without the trailing '/solr', as in the SOLR_URL environment variable."""
+        base_url = replica["base_url"].rstrip("/")
+        if base_url.endswith("/solr"):
+            base_url = base_url[:-len("/solr")]
+        return base_url
+
+    def _parse_cluster_status(self, cluster: dict) -> Union[dict, dict]:
+        """Extracts the healthy replicas and the shard leaders of each collection from the 'cluster' object of a CLUSTERSTATUS response."""
+
+        live_nodes = set(cluster.get("live_nodes", []))
+        replicas, leaders = {}, {}
+        for col_name, col in cluster.get("collections", {}).items():
+            col_replicas, col_leaders = [], []
+            for shard in col.get("shards", {}).values():
+                if shard.get("state", "active") != "active":
+                    continue
+                for replica in shard.get("replicas", {}).values():
+                    if replica.get("state") != "active" or \
+                            replica.get("node_name") not in live_nodes:
+                        continue
+                    node = self._node_url(replica)
+                    if node not in col_replicas:
+                        col_replicas.append(node)
+                    if replica.get("leader") == "true" and node not in col_leaders:
+                        col_leaders.append(node)
+            replicas[col_name] = col_replicas
+            leaders[col_name] = col_leaders
+
+        return replicas, leaders
+
+    def refresh(self) -> bool:
+        """Reads the cluster state from the first node that answers and replaces the cached one. If another thread is already reading it, waits for it and returns its result instead.
+
+        Returns
+        -------
+        bool
+            True if the cluster state could be read, False otherwise.
+        """
+        requested_at = time.monotonic()
+        with self._refresh_lock:
+            # The state was read while waiting for the lock
+            if self._refreshed_at is not None and self._refreshed_at >= requested_at:
+                return self._refresh_ok
+            self._refresh_ok = self._read_cluster_status()
+            self._refreshed_at = time.monotonic()
+            return self._refresh_ok
+
+    def _read_cluster_status(self) -> bool:
+        """Reads the cluster state (see refresh), without collapsing concurrent reads."""
+
+        # Known nodes go first so that the seed URL is not a single point of failure
+        candidates = [node for nodes in self._replicas.values()
+                      for node in nodes if node not in self._down]
+        candidates = list(dict.fromkeys(candidates + self.seed_urls))
+
+        for node in candidates:
+            url_ = '{}/solr/admin/collections?action=CLUSTERSTATUS&wt=json'.format(
+                node)
+            try:
+                resp = requests.get(url=url_, timeout=self.timeout)
+                cluster = resp.json()["cluster"]
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                self.logger.warning(
+                    f"-- -- Could not read cluster state from {node}: {e}")
+                continue
+
+            replicas, leaders = self._parse_cluster_status(cluster)
+            with self._lock:
+                self._replicas = replicas
+                self._leaders = leaders
+                self._down = set()
+                self._loaded_at = time.monotonic()
+            return True
+
+        # Retry on the next request rather than waiting for the whole ttl
+        with self._lock:
+            self._loaded_at = time.monotonic() - self.ttl / 2
+        self.logger.error("-- -- Could not read cluster state from any node")
+        return False
+
+    def _is_stale(self) -> bool:
+        return self._loaded_at is None or \
+            time.monotonic() - self._loaded_at >= self.ttl
+
+    def _is_unknown(self, col_name: str, states: Dict[str, List[str]]) -> bool:
+        """Returns True if the collection is not in the given (cached) states and it has not been found missing within the ttl."""
+        if col_name in states:
+            return False
+        missing_at = self._missing.get(col_name)
+        return missing_at is None or time.monotonic() - missing_at >= self.ttl
+
+    def needs_refresh(self, col_name: str) -> bool:
+        """Returns True if routing a request on the given collection requires reading the cluster state (i.e., if pick_replica or pick_leader may block on it)."""
+        return self._is_stale() or self._is_unknown(col_name, self._replicas)
+
+    def _ensure_fresh(self, col_name: str, states: str) -> None:
+        """Refreshes the cluster state if it is stale or if it does not contain the collection (unless it was found missing within the ttl)."""
+        refreshed = self._is_stale()
+        if refreshed:
+            self.refresh()
+        if self._is_unknown(col_name, getattr(self, states)):
+            # The collection may have been created after the last refresh
+            if not refreshed:
+                self.refresh()
+            if col_name not in getattr(self, states):
+                with self._lock:
+                    self._missing[col_name] = time.monotonic()
+        return
+
+    def forget_missing(self, col_name: str) -> None:
+        """Makes the next request on the given collection (e.g., once it has been created) read the cluster state if the collection is not in it."""
+        with self._lock:
+            self._missing.pop(col_name, None)
+        return
+
+    # ======================================================
+    # ROUTING
+    # ======================================================
+    def _pick(self, key: str, nodes: List[str]) -> Union[str, None]:
+        nodes = [node for node in nodes if node not in self._down]
+        if not nodes:
+            return None
+        if self.balancing == LEAST_OUTSTANDING:
+            return min(nodes, key=lambda node: self._outstanding.get(node, 0))
+        counter = self._counters.setdefault(key, itertools.count())
+        return nodes[next(counter) % len(nodes)]
+
+    def pick_replica(self,
+                     col_name: str,
+                     exclude: List[str] = ()) -> Union[str, None]:
+        """Returns the URL of the node to which a read on the given collection should be sent, or None if no healthy replica is known.
+
+        Parameters
+        ----------
+        col_name : str
+            The name of the collection.
+        exclude : List[str]
+            Nodes that must not be returned (e.g., those already tried).
+        """
+        self._ensure_fresh(col_name, "_replicas")
+        nodes = [node for node in self._replicas.get(col_name, [])
+                 if node not in exclude]
+        return self._pick("r:" + col_name, nodes)
+
+    def pick_leader(self, col_name: str) -> Union[str, None]:
+        """Returns the URL of a node hosting a shard leader of the given collection, or None if no leader is known.
+
+        Parameters
+        ----------
+        col_name : str
+            The name of the collection.
+        """
+        self._ensure_fresh(col_name, "_leaders")
+        return self._pick("w:" + col_name, self._leaders.get(col_name, []))
+
+    def begin(self, node: str) -> None:
+        """Accounts for a request being sent to the given node."""
+        with self._lock:
+            self._outstanding[node] = self._outstanding.get(node, 0) + 1
+        return
+
+    def end(self, node: str) -> None:
+        """Accounts for a request to the given node being finished."""
+        with self._lock:
+            self._outstanding[node] = max(
+                0, self._outstanding.get(node, 0) - 1)
+        return
+
+    def mark_down(self, node: str) -> None:
+        """Takes the given node out of rotation and refreshes the cluster state.
+
+        Parameters
+        ----------
+        node : str
+            URL of the node that failed.
+        """
+        self.logger.warning(f"-- -- Solr node {node} failed. Refreshing cluster state")
+        with self._lock:
+            self._down.add(node)
+        if self.refresh():
+            # The node may still be reported as live for a while
+            with self._lock:
+                self._down.add(node)
+        return
+
+    def nodes(self) -> Dict[str, List[str]]:
+        """Returns the healthy nodes of each collection as currently cached."""
+        return {col: [node for node in nodes if node not in self._down]
+                for col, nodes in self._replicas.items()}
@@ -0,0 +1,125 @@
+"""
+This module provides the helpers to read whole result sets out of Solr without holding them in memory.
+
+Result sets are read through the /export handler, which streams the documents matching a query sorted by docValues fields, driven by a 'search' streaming expression sent to the /stream handler of the collection (so that, in SolrCloud, every shard is exported and the shard streams are merged by Solr). The response is decoded incrementally, one tuple at a time, as it is received.
+
+Author: Lorena Calvo-Bartolomé
+Date: 26/06/2023
+"""
+
+import json
+import re
+from typing import Iterable, Iterator, List
+
+# Start of the tuple list in the responses of the /stream and /export handlers
+_DOCS_KEY = b'"docs"'
+_SKIP = re.compile(r"[\s,]*")
+_decoder = json.JSONDecoder()
+
+
+class SolrStreamError(Exception):
+    """Raised when Solr reports an error while a result set is being streamed."""
+    pass
+
+
+def quote_expr(value: str) -> str:
+    """Quotes a parameter value of a streaming expression."""
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def search_expression(col_name: str,
+                      q: str,
+                      fl: List[str],
+                      sort: str,
+                      fq: List[str] = (),
+                      qt: str = "/export") -> str:
+    """Returns the 'search' streaming expression exporting the documents of a collection that match a query.
+
+    Parameters
+    ----------
+    col_name : str
+        The name of the collection.
+    q : str
+        The query.
+    fl : List[str]
+        Fields to return (all of them must have docValues).
+    sort : str
+        Sort order of the documents (on single-valued docValues fields).
+    fq : List[str]
+        Filter queries.
+    qt : str, defaults to '/export'
+        Request handler with which each shard is read.
+    """
+    params = ["q=" + quote_expr(q),
+              "fl=" + quote_expr(",".join(fl)),
+              "sort=" + quote_expr(sort),
+              "qt=" + quote_expr(qt)]
+    params += ["fq=" + quote_expr(filter_q) for filter_q in fq or ()]
+
+    return "search({}, {})".format(col_name, ", ".join(params))
+
+
+def iter_json_array(chunks: Iterable[bytes],
+                    key: bytes = _DOCS_KEY) -> Iterator[dict]:
+    """Decodes, one by one, the objects of the JSON array under the given key of a response that is received in chunks, so that only the current object (plus a chunk) is held in memory.
+
+    Parameters
+    ----------
+    chunks : Iterable[bytes]
+        Chunks of the response body (e.g., requests.Response.iter_content()).
+    key : bytes, defaults to b'"docs"'
+        Key of the array, which must be the first occurrence of that string in the body.
+
+    Yields
+    ------
+    item : dict
+        Objects of the array, in order.
+    """
+    chunks = iter(chunks)
+    buffer = b""
+
+    # Skip everything up to the opening bracket of the array
+    for chunk in chunks:
+        buffer += chunk
+        pos = buffer.find(key)
+        if pos >= 0:
+            bracket = buffer.find(b"[", pos + len(key))
+            if bracket >= 0:
+                buffer = buffer[bracket + 1:]
+                break
+        else:
+            # Keep a tail long enough to hold a split key
+            buffer = buffer[-len(key):]
+    else:
+        raise SolrStreamError(
+            "Malformed response: {} not found".format(key.decode()))
+
+    pending = buffer
+    text, pos = "", 0
+    while True:
+        if pending:
+            try:
+                text = text[pos:] + pending.decode("utf-8")
+                pending, pos = b"", 0
+            except UnicodeDecodeError:
+                # A multi-byte character was split between chunks
+                pass
+
+        pos = _SKIP.match(text, pos).end()
+        if text.startswith("]", pos):
+            return
+        if pos < len(text):
+            try:
+                item, pos_end = _decoder.raw_decode(text, pos)
+            except json.JSONDecodeError:
+                item = None
+            if item is not None:
+                pos = pos_end
+                yield item
+                continue
+
+        # The next object is incomplete: read another chunk
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise SolrStreamError("Response ended in the middle of the array")
+        pending += chunk
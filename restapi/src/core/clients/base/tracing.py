@@ -0,0 +1,243 @@
+"""
+This module provides a lightweight tracer to follow a request across the dashboard, the API and Solr.
+
+The trace context is propagated with the W3C 'traceparent' header: the API continues the trace of the dashboard request that called it, and passes it on to Solr (in the header, and as the 'ewb_trace' parameter so that the trace id appears in Solr's request log). Spans are kept in a context variable, so that they follow the request across functions, threads (when the context is copied) and asyncio tasks.
+
+Finished spans are written to a local file in the OTLP/JSON format (one ExportTraceServiceRequest per line, as written by the file exporter of the OpenTelemetry Collector), so that they can be read by scripts/trace_view.py or loaded into any OTLP backend.
+
+Author: Lorena Calvo-Bartolomé
+Date: 10/07/2023
+"""
+
+import json
+import os
+import pathlib
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import List, Tuple, Union
+
+# Kinds of spans (as in OTLP)
+INTERNAL = 1
+SERVER = 2
+CLIENT = 3
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+class Span(object):
+    """
+    A class to represent a timed operation of a trace.
+    """
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind",
+                 "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: str = None,
+                 kind: int = INTERNAL, attributes: dict = None) -> None:
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.error = None
+
+        return
+
+    def set(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    @property
+    def traceparent(self) -> str:
+        return "00-{}-{}-01".format(self.trace_id, self.span_id)
+
+    def to_otlp(self) -> dict:
+        span = {"traceId": self.trace_id,
+                "spanId": self.span_id,
+                "name": self.name,
+                "kind": self.kind,
+                "startTimeUnixNano": str(self.start_ns),
+                "endTimeUnixNano": str(self.end_ns),
+                "attributes": [_attribute(key, value) for key, value in self.attributes.items()
+                               if value is not None]}
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.error is not None:
+            span["status"] = {"code": 2, "message": self.error}
+        return span
+
+
+def _attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class FileExporter(object):
+    """
+    A class to write finished spans to a file in the OTLP/JSON format.
+    """
+
+    def __init__(self, path: str, service: str, max_bytes: int = 100 * 1024 ** 2,
+                 batch_size: int = 64) -> None:
+        """
+        Parameters
+        ----------
+        path : str
+            Path of the file. When it grows over max_bytes, it is rotated to '<path>.1'.
+        service : str
+            Name of the service that produces the spans.
+        max_bytes : int, defaults to 100 MB
+            Maximum size of the file.
+        batch_size : int, defaults to 64
+            Number of spans after which they are written, if no trace ends before.
+        """
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.service = service
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+
+        self._spans: List[Span] = []
+        self._lock = threading.Lock()
+
+        return
+
+    def export(self, span: Span, flush: bool = False) -> None:
+        with self._lock:
+            self._spans.append(span)
+            if flush or len(self._spans) >= self.batch_size:
+                self._write()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._write()
+
+    def _write(self) -> None:
+        if not self._spans:
+            return
+        spans, self._spans = self._spans, []
+        line = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": [_attribute("service.name", self.service)]},
+            "scopeSpans": [{"scope": {"name": "ewb"},
+                            "spans": [span.to_otlp() for span in spans]}]}]},
+            separators=(",", ":"))
+        try:
+            if self.path.exists() and self.path.stat().st_size > self.max_bytes:
+                self.path.replace(self.path.with_name(self.path.name + ".1"))
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+        except OSError:
+            # Tracing must never break the request being traced
+            pass
+
+
+class Tracer(object):
+    """
+    A class to create the spans of the process and send them to the exporter.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.exporter = None
+        self._current: ContextVar[Union[Span, None]] = ContextVar(
+            "current_span", default=None)
+
+        return
+
+    def configure(self,
+                  enabled: bool = None,
+                  path: str = None,
+                  service: str = "restapi",
+                  max_bytes: int = 100 * 1024 ** 2) -> None:
+        """Enables or disables tracing, writing the spans to the given file."""
+        if enabled is not None:
+            self.enabled = enabled
+        if self.enabled and path:
+            self.exporter = FileExporter(path, service, max_bytes=max_bytes)
+        self.enabled = self.enabled and self.exporter is not None
+
+        return
+
+    @property
+    def current(self) -> Union[Span, None]:
+        return self._current.get()
+
+    def start(self, name: str, kind: int = INTERNAL, traceparent: str = None,
+              **attributes) -> Union[Tuple[Span, Token], Tuple[None, None]]:
+        """Starts a span as a child of the current span (or of the span given by the traceparent header, or as the root of a new trace) and makes it the current span.
+
+        Returns
+        -------
+        span : Span
+            The span, or None if tracing is disabled.
+        token : Token
+            Token to restore the previous current span, to be passed to finish.
+        """
+        if not self.enabled:
+            return None, None
+
+        parent = self._current.get()
+        if parent is not None:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            match = _TRACEPARENT.match(traceparent or "")
+            trace_id, parent_id = match.groups() if match else (os.urandom(16).hex(), None)
+
+        span = Span(name, trace_id, parent_id, kind, attributes)
+        return span, self._current.set(span)
+
+    def finish(self, span: Span, token: Token, error: BaseException = None) -> None:
+        """Ends a span started with start and sends it to the exporter."""
+        if span is None:
+            return
+        span.end_ns = time.time_ns()
+        if error is not None:
+            span.error = "{}: {}".format(type(error).__name__, error)
+        try:
+            self._current.reset(token)
+        except ValueError:
+            # Ended in another context (e.g., after a streamed response)
+            pass
+        # The trace is written as soon as its local root finishes
+        self.exporter.export(span, flush=span.parent_id is None or span.kind == SERVER)
+
+        return
+
+    @contextmanager
+    def span(self, name: str, kind: int = INTERNAL, traceparent: str = None, **attributes):
+        """Times the operation run within the context (see start).
+
+        Yields
+        ------
+        span : Span
+            The span, or None if tracing is disabled.
+        """
+        span, token = self.start(name, kind, traceparent, **attributes)
+        try:
+            yield span
+        except Exception as e:
+            self.finish(span, token, e)
+            raise
+        self.finish(span, token)
+
+    def inject(self, headers: dict = None) -> dict:
+        """Returns the given headers (or new ones) with the traceparent of the current span, if any."""
+        headers = dict(headers or {})
+        span = self._current.get()
+        if self.enabled and span is not None:
+            headers["traceparent"] = span.traceparent
+        return headers
+
+
+# Tracer of the process
+tracer = Tracer()
@@ -0,0 +1,168 @@
+"""
+This module provides an in-process registry of the corpora and models available in the EWB (i.e., the content of the corpora collection in Solr), so that the checks performed before every query do not require additional requests to Solr.
+
+The registry is loaded on first use, cached for a configurable time, and explicitly invalidated whenever a corpus or a model is indexed or deleted, in this process or (through a shared generation, see generations.py) in any other. Registries are shared by all the clients in the process that point to the same Solr corpora collection.
+
+Author: Lorena Calvo-Bartolomé
+Date: 19/06/2023
+"""
+
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Union
+
+
+class CollectionRegistry(object):
+    """
+    A class to cache the corpora and models available in the EWB, together with their fields.
+    """
+
+    # Registries shared within the process, by key
+    _shared: Dict[str, 'CollectionRegistry'] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self,
+                 loader: Callable[[], Union[List[dict], None]],
+                 ttl: float = 300,
+                 generation: Callable[[], int] = None,
+                 logger: logging.Logger = None) -> None:
+        """
+        Parameters
+        ----------
+        loader : Callable[[], Union[List[dict], None]]
+            Function returning all the documents of the corpora collection (with fields 'id', 'corpus_name', 'fields' and 'models'), or None if they could not be retrieved.
+        ttl : float, defaults to 300
+            Time in seconds for which the registry is cached.
+        generation : Callable[[], int], defaults to None
+            Function returning the shared generation of the collections. The registry is reloaded when it changes.
+        logger : logging.Logger
+            The logger object to log messages and errors.
+        """
+        self.loader = loader
+        self.ttl = ttl
+        self.generation = generation
+        self.logger = logger or logging.getLogger('Registry')
+
+        # corpus name -> {'id': ..., 'fields': [...], 'models': [...]}
+        self._corpora: Dict[str, dict] = None
+        # model name -> corpus name
+        self._models: Dict[str, str] = None
+        self._loaded_at = None
+        self._loaded_generation = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+        return
+
+    @classmethod
+    def shared(cls,
+               key: str,
+               loader: Callable[[], Union[List[dict], None]],
+               ttl: float = 300,
+               generation: Callable[[], int] = None,
+               logger: logging.Logger = None) -> 'CollectionRegistry':
+        """Returns the registry of the process for the given key, creating it if it does not exist yet.
+
+        Parameters
+        ----------
+        key : str
+            Key identifying the corpora collection (e.g., Solr URL and collection name).
+        loader, ttl, generation, logger
+            See __init__. Only used if the registry is created.
+        """
+        with cls._shared_lock:
+            if key not in cls._shared:
+                cls._shared[key] = cls(loader, ttl=ttl, generation=generation,
+                                       logger=logger)
+            return cls._shared[key]
+
+    def refresh(self) -> bool:
+        """Reloads the registry.
+
+        Returns
+        -------
+        bool
+            True if the registry could be loaded, False otherwise.
+        """
+        # Read before loading, so that changes made while loading are not missed
+        generation = self.generation() if self.generation is not None else None
+        docs = self.loader()
+        if docs is None:
+            self.logger.error("-- -- Collection registry could not be loaded")
+            return False
+
+        corpora, models = {}, {}
+        for doc in docs:
+            name = doc.get("corpus_name")
+            if name is None:
+                continue
+            corpora[name] = {"id": doc.get("id"),
+                             "fields": doc.get("fields", []),
+                             "models": doc.get("models", [])}
+            for model in corpora[name]["models"]:
+                models[model] = name
+
+        with self._lock:
+            self._corpora = corpora
+            self._models = models
+            self._loaded_at = time.monotonic()
+            self._loaded_generation = generation
+        self.logger.info(
+            f"-- -- Collection registry loaded: {len(corpora)} corpora, {len(models)} models")
+
+        return True
+
+    def invalidate(self) -> None:
+        """Discards the cached registry so that it is reloaded on next use."""
+        with self._lock:
+            self._loaded_at = None
+        return
+
+    def _is_stale(self) -> bool:
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at >= self.ttl:
+            return True
+        return self.generation is not None and \
+            self.generation() != self._loaded_generation
+
+    def _ensure_fresh(self) -> bool:
+        """Reloads the registry if it is stale. Returns False if there is no registry available."""
+        if self._is_stale():
+            with self._refresh_lock:
+                # Another thread may have reloaded it while waiting
+                if self._is_stale() and not self.refresh():
+                    return self._corpora is not None
+        return True
+
+    def corpora(self) -> Union[List[str], None]:
+        """Returns the names of the corpus collections, or None if the registry could not be loaded."""
+        if not self._ensure_fresh():
+            return None
+        return list(self._corpora)
+
+    def models(self) -> Union[List[str], None]:
+        """Returns the names of the model collections, or None if the registry could not be loaded."""
+        if not self._ensure_fresh():
+            return None
+        return list(self._models)
+
+    def corpus(self, corpus_name: str) -> Union[dict, None]:
+        """Returns the registry entry ('id', 'fields' and 'models') of the given corpus, or None if it is not a corpus collection."""
+        if not self._ensure_fresh():
+            return None
+        return self._corpora.get(corpus_name)
+
+    def model_corpus(self, model_name: str) -> Union[str, None]:
+        """Returns the name of the corpus the given model was trained on, or None if it is not a model collection."""
+        if not self._ensure_fresh():
+            return None
+        return self._models.get(model_name)
+
+    def is_corpus(self, name: str) -> bool:
+        """Returns True if the given collection is a corpus collection."""
+        return self.corpus(name) is not None
+
+    def is_model(self, name: str) -> bool:
+        """Returns True if the given collection is a model collection."""
+        return self.model_corpus(name) is not None
@@ -6,20 +6,32 @@ Date: 17/04/2023
 """
 
 import configparser
+import functools
+import itertools
 import logging
 import pathlib
-import pandas as pd
-from typing import List, Union
+import threading
+from typing import Callable, Dict, Iterator, List, Union
 
+from src.core.clients.base.generations import COLLECTIONS, GenerationStore
+from src.core.clients.base.hedging import HedgingPolicy
+from src.core.clients.base.query_stats import current_query
 from src.core.clients.base.solr_client import SolrClient
+from src.core.clients.base.solr_stream import (SolrStreamError,
+                                               search_expression)
+from src.core.clients.base.tracing import tracer
+from src.core.clients.collection_registry import CollectionRegistry
+from src.core.clients.topic_registry import TopicRegistry
 from src.core.clients.ewb_inferencer_client import EWBInferencerClient
-from src.core.entities.corpus import Corpus
-from src.core.entities.model import Model
+from src.core.entities.export_formats import Column
 from src.core.entities.queries import Queries
 
 
 class EWBSolrClient(SolrClient):
 
+    _shared: Dict[str, 'EWBSolrClient'] = {}
+    _shared_lock = threading.Lock()
+
     def __init__(self,
                  logger: logging.Logger,
                  config_file: str = "/config/config.cf") -> None:
@@ -32,6 +44,88 @@ class EWBSolrClient(SolrClient):
         self.corpus_col = cf.get('restapi', 'corpus_col')
         self.no_meta_fields = cf.get('restapi', 'no_meta_fields').split(",")
         self.max_sum = int(cf.get('restapi', 'max_sum'))
+        self.default_rows = int(cf.get('restapi', 'default_rows', fallback=100))
+        self.max_rows = int(cf.get('restapi', 'max_rows', fallback=10000))
+        # Folder with the models (as given to index_model)
+        self.models_dir = pathlib.Path(
+            cf.get('restapi', 'models_dir', fallback='/data/source'))
+        self._model_paths = {}
+
+        # Configure query instrumentation
+        if cf.has_section('instrumentation'):
+            self.instrumentation.configure(
+                enabled=cf.getboolean(
+                    'instrumentation', 'enabled', fallback=None),
+                slow_query_ms=cf.getfloat(
+                    'instrumentation', 'slow_query_ms', fallback=None),
+                slow_query_sample_rate=cf.getfloat(
+                    'instrumentation', 'slow_query_sample_rate', fallback=None))
+
+        # Configure the cache of query results
+        if cf.has_section('cache'):
+            self.cache.configure(
+                enabled=cf.getboolean('cache', 'enabled', fallback=None),
+                max_bytes=int(cf.getfloat('cache', 'max_mb', fallback=256) * 1024 ** 2),
+                ttl=cf.getfloat('cache', 'ttl', fallback=None),
+                backend_url=cf.get('cache', 'backend', fallback=''))
+
+        # Configure request tracing
+        if cf.has_section('tracing'):
+            tracer.configure(
+                enabled=cf.getboolean('tracing', 'enabled', fallback=None),
+                path=cf.get('tracing', 'file', fallback='/data/traces/restapi.jsonl'),
+                service=cf.get('tracing', 'service', fallback='restapi'),
+                max_bytes=int(cf.getfloat('tracing', 'max_mb', fallback=100) * 1024 ** 2))
+
+        # Route requests according to the SolrCloud cluster state
+        routing = cf.get('solrcloud', 'routing', fallback='none')
+        if routing != 'none':
+            extra_nodes = cf.get('solrcloud', 'nodes', fallback='')
+            self.enable_cloud_routing(
+                balancing=routing,
+                ttl=cf.getfloat('solrcloud', 'state_ttl', fallback=30),
+                extra_nodes=[node.strip() for node in extra_nodes.split(",")
+                             if node.strip()])
+
+            # Hedge slow reads on another replica
+            if cf.getboolean('hedging', 'enabled', fallback=False):
+                self.enable_hedging(HedgingPolicy(
+                    percentile=cf.getfloat(
+                        'hedging', 'percentile', fallback=95),
+                    default_delay_ms=cf.getfloat(
+                        'hedging', 'default_delay_ms', fallback=250),
+                    budget=cf.getfloat('hedging', 'budget', fallback=0.05)),
+                    max_workers=cf.getint('hedging', 'max_workers', fallback=16),
+                    timeout=cf.getfloat('hedging', 'timeout', fallback=30))
+
+        # Generations shared by all the processes of the API (kept in the job log), which tell the caches of this process when corpora or models were indexed or deleted by another one
+        self.generations = GenerationStore.shared(
+            cf.get('jobs', 'log', fallback='/data/jobs/jobs.db'),
+            interval=cf.getfloat('jobs', 'generation_interval', fallback=1),
+            logger=self.logger)
+        generation = functools.partial(self.generations.get, COLLECTIONS)
+        self.cache.configure(generations=self.generations)
+
+        # Registry of corpora and models, shared within the process
+        self.registry = CollectionRegistry.shared(
+            key='{}/{}'.format(self.solr_url, self.corpus_col),
+            loader=self._load_corpora_docs,
+            ttl=cf.getfloat('restapi', 'registry_ttl', fallback=300),
+            generation=generation,
+            logger=self.logger)
+        # Topic metadata of each model, shared within the process
+        self.topics = TopicRegistry.shared(
+            key=self.solr_url or '',
+            loader=self._load_model_topics,
+            ttl=cf.getfloat('restapi', 'topics_ttl', fallback=300),
+            generation=generation,
+            logger=self.logger)
+        # Load it at startup; if Solr is not available yet, it is loaded on first use
+        try:
+            self.registry.corpora()
+        except Exception as e:
+            self.logger.warning(
+                f"-- -- Collection registry could not be loaded at startup: {e}")
 
         # Create Queries object for managing queries
         self.querier = Queries()
@@ -41,17 +135,49 @@ class EWBSolrClient(SolrClient):
 
         return
 
+    @classmethod
+    def shared(cls,
+               logger: logging.Logger,
+               config_file: str = "/config/config.cf") -> 'EWBSolrClient':
+        """Returns the client of the process for the given configuration file, creating it on first use.
+
+        All the namespaces use this client, so that the configuration is read and the registries, queries and inferencer client are built once per process. If the app is preloaded by a multi-worker server (see gunicorn.conf.py), it is built before the workers are forked and each worker inherits a copy.
+        """
+        with cls._shared_lock:
+            if config_file not in cls._shared:
+                cls._shared[config_file] = cls(logger, config_file)
+            return cls._shared[config_file]
+
+    @classmethod
+    def after_fork(cls) -> None:
+        """Resets the state of the shared clients that a forked worker cannot inherit (see SolrClient.reset_after_fork)."""
+        for client in cls._shared.values():
+            client.reset_after_fork()
+
+        return
+
+    @classmethod
+    def close_shared(cls) -> None:
+        """Closes the shared clients of the process (see SolrClient.close)."""
+        for client in cls._shared.values():
+            client.close()
+
+        return
+
     # ======================================================
     # CORPUS-RELATED OPERATIONS
     # ======================================================
     def index_corpus(self,
-                     corpus_logical_path: str) -> None:
+                     corpus_logical_path: str,
+                     progress: Callable[[str, int, int], None] = None) -> None:
         """Given the string path of corpus file, it creates a Solr collection with such the stem name of the file (i.e., if we had '/data/source.Cordis.json' as corpus_logical_path, 'Cordis' would be the stem), reades the corpus file, extracts the raw information of each document, and sends a POST request to the Solr server to index the documents in batches.
 
         Parameters
         ----------
         corpus_logical_path : str
             The path of the logical corpus file to be indexed.
+        progress : Callable[[str, int, int], None], defaults to None
+            Function to which the progress of the indexing is reported (see SolrClient.index_documents).
         """
 
         # 1. Get full path and stem of the logical corpus
@@ -93,26 +219,123 @@ class EWBSolrClient(SolrClient):
             corpus_id = 1
 
         # 4. Create Corpus object and extract info from the corpus to index
+        from src.core.entities.corpus import Corpus
         corpus = Corpus(corpus_to_index)
-        json_docs = corpus.get_docs_raw_info()
+        # The documents are read and transformed as they are indexed; the fields of the corpus are known once the first batch is ready
+        doc_batches = corpus.iter_doc_batches(batch_size=self.batch_size)
+        first_batch = next(doc_batches, None)
         corpus_col_upt = corpus.get_corpora_update(id=corpus_id)
 
         # 5. Index corpus and its fiels in CORPUS_COL
         self.logger.info(
             f"-- -- Indexing of {corpus_logical_name} info in {self.corpus_col} starts.")
-        self.index_documents(corpus_col_upt, self.corpus_col, self.batch_size)
+        self.index_documents(corpus_col_upt, self.corpus_col, self.batch_size,
+                             progress=progress)
         self.logger.info(
             f"-- -- Indexing of {corpus_logical_name} info in {self.corpus_col} completed.")
 
         # 6. Index documents in corpus collection
         self.logger.info(
             f"-- -- Indexing of {corpus_logical_name} in {corpus_logical_name} starts.")
-        self.index_documents(json_docs, corpus_logical_name, self.batch_size)
+        self.index_batches(
+            itertools.chain([first_batch] if first_batch else [], doc_batches),
+            corpus_logical_name, to_index=corpus.num_docs, progress=progress)
         self.logger.info(
             f"-- -- Indexing of {corpus_logical_name} in {corpus_logical_name} completed.")
 
+        self.registry.invalidate()
+        self.generations.bump(COLLECTIONS)
+
         return
 
+    def iter_all_docs(self,
+                      col_name: str,
+                      q: str = '*:*',
+                      sort: str = None,
+                      **kwargs) -> Iterator[dict]:
+        """Yields all the documents matching a query, paging through them with a cursor, so that only one page is held in memory at a time.
+
+        Parameters
+        ----------
+        col_name : str
+            The name of the Solr collection to query.
+        q : str
+            The query to be executed.
+        sort : str
+            Sort order of the documents (the id is appended as tie-breaker). If None, documents are sorted by id.
+        **kwargs
+            Additional options to be passed through the Solr URL (e.g., 'fl' or 'fq').
+
+        Raises
+        ------
+        SolrStreamError
+            If a page could not be retrieved.
+        """
+
+        # Cursors require the unique key as tie-breaker
+        if not sort:
+            sort = 'id asc'
+        elif 'id' not in [clause.split()[0] for clause in sort.split(',') if clause.strip()]:
+            sort += ', id asc'
+
+        cursor = '*'
+        while True:
+            sc, results = self.execute_query(q=q,
+                                             col_name=col_name,
+                                             rows=str(self.max_rows),
+                                             sort=sort,
+                                             cursorMark=cursor,
+                                             **kwargs)
+            if sc != 200:
+                raise SolrStreamError(
+                    f"Page {cursor} of {col_name} could not be retrieved")
+            yield from results.docs
+            if results.nextCursorMark in (None, cursor) or not results.docs:
+                return
+            cursor = results.nextCursorMark
+
+    def fetch_all_docs(self,
+                       col_name: str,
+                       q: str = '*:*',
+                       **kwargs) -> Union[List[dict], None]:
+        """Retrieves all the documents matching a query, paging through them with a cursor.
+
+        Parameters
+        ----------
+        col_name : str
+            The name of the Solr collection to query.
+        q : str
+            The query to be executed.
+        **kwargs
+            Additional options to be passed through the Solr URL (e.g., 'fl' or 'fq').
+
+        Returns
+        -------
+        docs: List[dict]
+            Documents matching the query, or None if they could not be retrieved.
+        """
+
+        try:
+            return list(self.iter_all_docs(col_name=col_name, q=q, **kwargs))
+        except SolrStreamError:
+            return None
+
+    def _load_corpora_docs(self) -> Union[List[dict], None]:
+        """Retrieves all the documents of self.corpus_col (paging through them with a cursor, so that no corpus is left out), as required by the collection registry.
+
+        Returns
+        -------
+        docs: List[dict]
+            Documents of self.corpus_col with the fields 'id', 'corpus_name', 'fields' and 'models', or None if they could not be retrieved.
+        """
+
+        docs = self.fetch_all_docs(col_name=self.corpus_col,
+                                   fl="id,corpus_name,fields,models")
+        if docs is None:
+            self.logger.error(
+                f"-- -- Error getting corpus collections in {self.corpus_col}.")
+        return docs
+
     def list_corpus_collections(self) -> Union[List, int]:
         """Returns a list of the names of the corpus collections that have been created in the Solr server.
 
@@ -122,17 +345,13 @@ class EWBSolrClient(SolrClient):
             List of the names of the corpus collections that have been created in the Solr server.
         """
 
-        sc, results = self.execute_query(q='*:*',
-                                         col_name=self.corpus_col,
-                                         fl="corpus_name")
-        if sc != 200:
+        corpus_lst = self.registry.corpora()
+        if corpus_lst is None:
             self.logger.error(
                 f"-- -- Error getting corpus collections in {self.corpus_col}. Aborting operation...")
             return
 
-        corpus_lst = [doc["corpus_name"] for doc in results.docs]
-
-        return corpus_lst, sc
+        return corpus_lst, 200
 
     def get_corpus_coll_fields(self, corpus_col: str) -> Union[List, int]:
         """Returns a list of the fields of the corpus collection given by 'corpus_col' that have been defined in the Solr server.
@@ -149,16 +368,14 @@ class EWBSolrClient(SolrClient):
         sc: int
             Status code of the request
         """
-        sc, results = self.execute_query(q='corpus_name:"'+corpus_col+'"',
-                                         col_name=self.corpus_col,
-                                         fl="fields")
 
-        if sc != 200:
+        corpus = self.registry.corpus(corpus_col)
+        if corpus is None:
             self.logger.error(
                 f"-- -- Error getting fields of {corpus_col}. Aborting operation...")
             return
 
-        return results.docs[0]["fields"], sc
+        return corpus["fields"], 200
 
     def get_corpus_models(self, corpus_col: str) -> Union[List, int]:
         """Returns a list with the models associated with the corpus given by 'corpus_col'
@@ -176,16 +393,13 @@ class EWBSolrClient(SolrClient):
             Status code of the request
         """
 
-        sc, results = self.execute_query(q='corpus_name:"'+corpus_col+'"',
-                                         col_name=self.corpus_col,
-                                         fl="models")
-
-        if sc != 200:
+        corpus = self.registry.corpus(corpus_col)
+        if corpus is None:
             self.logger.error(
                 f"-- -- Error getting models of {corpus_col}. Aborting operation...")
             return
 
-        return results.docs[0]["models"], sc
+        return corpus["models"], 200
 
     def delete_corpus(self,
                       corpus_logical_path: str) -> None:
@@ -232,6 +446,10 @@ class EWBSolrClient(SolrClient):
         if sc != 200:
             self.logger.error(
                 f"-- -- Error deleting corpus from {self.corpus_col}")
+
+        self.registry.invalidate()
+        self.generations.bump(COLLECTIONS)
+
         return
 
     def check_is_corpus(self, corpus_col) -> bool:
@@ -248,8 +466,7 @@ class EWBSolrClient(SolrClient):
             True if the collection is a corpus collection, False otherwise.
         """
 
-        corpus_colls, sc = self.list_corpus_collections()
-        if corpus_col not in corpus_colls:
+        if not self.registry.is_corpus(corpus_col):
             self.logger.error(
                 f"-- -- {corpus_col} is not a corpus collection. Aborting operation...")
             return False
@@ -282,7 +499,9 @@ class EWBSolrClient(SolrClient):
     # ======================================================
     # MODEL-RELATED OPERATIONS
     # ======================================================
-    def index_model(self, model_path: str) -> None:
+    def index_model(self,
+                    model_path: str,
+                    progress: Callable[[str, int, int], None] = None) -> None:
         """
         Given the string path of a model created with the ITMT (i.e., the name of one of the folders representing a model within the TMmodels folder), it extracts the model information and that of the corpus used for its generation. It then adds a new field in the corpus collection of type 'VectorField' and name 'doctpc_{model_name}, and index the document-topic proportions in it. At last, it index the rest of the model information in the model collection.
 
@@ -290,11 +509,14 @@ class EWBSolrClient(SolrClient):
         ----------
         model_path : str
             Path to the folder of the model to be indexed.
+        progress : Callable[[str, int, int], None], defaults to None
+            Function to which the progress of the indexing is reported (see SolrClient.index_documents).
         """
 
         # 1. Get stem of the model folder
         model_to_index = pathlib.Path(model_path)
         model_name = pathlib.Path(model_to_index).stem.lower()
+        self._model_paths[model_name] = model_to_index
 
         # 2. Create collection
         _, err = self.create_collection(col_name=model_name)
@@ -307,6 +529,7 @@ class EWBSolrClient(SolrClient):
                 f"-- -- Collection {model_name} successfully created.")
 
         # 3. Create Model object and extract info from the corpus to index
+        from src.core.entities.model import Model
         model = Model(model_to_index)
         json_docs, corpus_name = model.get_model_info_update(action='set')
         sc, results = self.execute_query(q='corpus_name:'+corpus_name,
@@ -322,7 +545,8 @@ class EWBSolrClient(SolrClient):
         # 4. Add field for the doc-tpc distribution associated with the model being indexed in the document associated with the corpus
         self.logger.info(
             f"-- -- Indexing model information of {model_name} in {self.corpus_col} starts.")
-        self.index_documents(field_update, self.corpus_col, self.batch_size)
+        self.index_documents(field_update, self.corpus_col, self.batch_size,
+                             progress=progress)
         self.logger.info(
             f"-- -- Indexing of model information of {model_name} info in {self.corpus_col} completed.")
         
@@ -336,12 +560,27 @@ class EWBSolrClient(SolrClient):
         # 6. Index doc-tpc information in corpus collection
         self.logger.info(
             f"-- -- Indexing model information in {corpus_name} collection")
-        self.index_documents(json_docs, corpus_name, self.batch_size)
+        self.index_documents(json_docs, corpus_name, self.batch_size,
+                             progress=progress)
 
         self.logger.info(
             f"-- -- Indexing model information in {model_name} collection")
         json_tpcs = model.get_model_info()
-        self.index_documents(json_tpcs, model_name, self.batch_size)
+        self.index_documents(json_tpcs, model_name, self.batch_size,
+                             progress=progress)
+
+        self.registry.invalidate()
+        self.generations.bump(COLLECTIONS)
+        self.topics.load(model_name, topics=json_tpcs)
+
+        # 7. Persist the neighbor index used by the document similarity queries
+        try:
+            from src.core.entities.similarities import NeighborIndex
+            NeighborIndex.build(
+                model_to_index, pairs=self.max_rows, logger=self.logger)
+        except Exception as e:
+            self.logger.warning(
+                f"-- -- Neighbor index of {model_name} could not be built (it will be built on first use): {e}")
 
         return
 
@@ -355,19 +594,43 @@ class EWBSolrClient(SolrClient):
         sc: int
             Status code of the request.
         """
-        sc, results = self.execute_query(q='*:*',
-                                         col_name=self.corpus_col,
-                                         fl="models")
-        if sc != 200:
+
+        models_lst = self.registry.models()
+        if models_lst is None:
             self.logger.error(
                 f"-- -- Error getting corpus collections in {self.corpus_col}. Aborting operation...")
             return
 
-        models_lst = [model for doc in results.docs for model in doc["models"]]
+        return models_lst, 200
 
-        return models_lst, sc
+    def _load_model_topics(self, model_col: str) -> Union[List[dict], None]:
+        """Retrieves the metadata of all the topics of the model collection given by 'model_col', as required by the topic registry.
 
-    def delete_model(self, model_path: str) -> None:
+        Parameters
+        ----------
+        model_col : str
+            Name of the model collection.
+
+        Returns
+        -------
+        topics: List[dict]
+            Topic documents of the model collection, or None if they could not be retrieved.
+        """
+
+        sc, results = self.execute_query(q='*:*',
+                                         col_name=model_col,
+                                         fl=','.join(TopicRegistry.FIELDS),
+                                         rows=str(self.max_rows))
+        if sc != 200:
+            self.logger.error(
+                f"-- -- Error getting topics of {model_col}.")
+            return None
+
+        return results.docs
+
+    def delete_model(self,
+                     model_path: str,
+                     progress: Callable[[str, int, int], None] = None) -> None:
         """
         Given the string path of a model created with the ITMT (i.e., the name of one of the folders representing a model within the TMmodels folder), 
         it deletes the model collection associated with it. Additionally, it removes the document-topic proportions field in the corpus collection and removes the fields associated with the model and the model from the list of models in the corpus document from the self.corpus_col collection.
@@ -376,11 +639,15 @@ class EWBSolrClient(SolrClient):
         ----------
         model_path : str
             Path to the folder of the model to be indexed.
+        progress : Callable[[str, int, int], None], defaults to None
+            Function to which the progress of the indexing is reported (see SolrClient.index_documents).
         """
 
         # 1. Get stem of the model folder
         model_to_index = pathlib.Path(model_path)
         model_name = pathlib.Path(model_to_index).stem.lower()
+        from src.core.entities.similarities import NeighborIndex
+        NeighborIndex.unload(self._model_paths.pop(model_name, model_to_index))
 
         # 2. Delete model collection
         _, sc = self.delete_collection(col_name=model_name)
@@ -393,6 +660,7 @@ class EWBSolrClient(SolrClient):
                 f"-- -- Model collection {model_name} successfully deleted.")
 
         # 3. Create Model object and extract info from the corpus associated with the model
+        from src.core.entities.model import Model
         model = Model(model_to_index)
         json_docs, corpus_name = model.get_model_info_update(action='remove')
         sc, results = self.execute_query(q='corpus_name:'+corpus_name,
@@ -408,14 +676,16 @@ class EWBSolrClient(SolrClient):
         # 4. Remove field for the doc-tpc distribution associated with the model being deleted in the document associated with the corpus
         self.logger.info(
             f"-- -- Deleting model information of {model_name} in {self.corpus_col} starts.")
-        self.index_documents(field_update, self.corpus_col, self.batch_size)
+        self.index_documents(field_update, self.corpus_col, self.batch_size,
+                             progress=progress)
         self.logger.info(
             f"-- -- Deleting model information of {model_name} info in {self.corpus_col} completed.")
 
         # 5. Delete doc-tpc information from corpus collection
         self.logger.info(
             f"-- -- Deleting model information from {corpus_name} collection")
-        self.index_documents(json_docs, corpus_name, self.batch_size)
+        self.index_documents(json_docs, corpus_name, self.batch_size,
+                             progress=progress)
 
         # 6. Modify schema in corpus collection to delete field for the doc-tpc distribution and similarities associated with the model being indexed
         model_key = 'doctpc_' + model_name
@@ -429,6 +699,10 @@ class EWBSolrClient(SolrClient):
         _, err = self.delete_field_from_schema(
             col_name=corpus_name, field_name=sim_model_key)
 
+        self.registry.invalidate()
+        self.topics.invalidate(model_name)
+        self.generations.bump(COLLECTIONS)
+
         return
 
     def check_is_model(self, model_col) -> bool:
@@ -445,8 +719,7 @@ class EWBSolrClient(SolrClient):
             True if the model_col is a model collection, False otherwise.
         """
 
-        model_colls, sc = self.list_model_collections()
-        if model_col not in model_colls:
+        if not self.registry.is_model(model_col):
             self.logger.error(
                 f"-- -- {model_col} is not a model collection. Aborting operation...")
             return False
@@ -455,97 +728,210 @@ class EWBSolrClient(SolrClient):
     # ======================================================
     # AUXILIARY FUNCTIONS
     # ======================================================
-    def custom_start_and_rows(self, start, rows, col) -> Union[str, str]:
-        """Checks if start and rows are None. If so, it returns the number of documents in the collection as the value for rows and 0 as the value for start.
+    def plan_query(self,
+                   name: str,
+                   col: str,
+                   start: int = None,
+                   rows: int = None,
+                   cursor: str = None,
+                   **values) -> Union[tuple, None]:
+        """Prepares the execution of the EWB query with the given name (see Queries) on a collection: it checks the collection and builds the Solr request from the spec of the query.
 
         Parameters
         ----------
-        start : str
-            Start parameter of the query.
-        rows : str
-            Rows parameter of the query.
+        name : str
+            Name of the query (e.g., 'Q4').
         col : str
-            Name of the collection.
+            Name of the collection, which must be of the kind required by the query.
+        start, rows, cursor
+            Paging parameters (see paging_params). Ignored if the query is not paged.
+        **values
+            Values of the query (e.g., year=2020).
 
         Returns
         -------
-        start : str
-            Final start parameter of the query.
-        rows : str
-            Final rows parameter of the query.
+        plan : tuple
+            Tuple with the (lowercased) collection name, the parameters of the request and the paging parameters (None if the query is not paged), or None if the collection is not of the required kind.
         """
-        if start is None:
-            start = str(0)
-        if rows is None:
-            numFound_dict, sc = self.do_Q3(col)
-            rows = str(numFound_dict['ndocs'])
 
-            if sc != 200:
-                self.logger.error(
-                    f"-- -- Error executing query Q3. Aborting operation...")
-                return
+        spec = self.querier.get(name)
 
-        return start, rows
-    
-    def indexes_filter(self, row):
-        """Auxiliary function to filter the 'similarities' column by the 'indexes' column.
-        It is used inside an apply function in pandas, so it iterates over the rows of the DataFrame.
+        # 0. Convert collection name to lowercase
+        col = col.lower()
+
+        # 1. Check that col is a collection of the kind required by the query
+        if spec.collection == 'corpus' and not self.check_is_corpus(col):
+            return
+        if spec.collection == 'model' and not self.check_is_model(col):
+            return
+        if spec.collection == 'any' and not self.check_is_corpus(col) and not self.check_is_model(col):
+            return
+
+        # 2. Paging parameters (no need to count the documents in the collection)
+        page = None
+        if spec.paged:
+            page = self.paging_params(
+                start=start, rows=rows, cursor=cursor, sort=spec.sort_for(values))
+
+        return col, self.querier.customize(name, page=page, **values), page
+
+    def finish_query(self,
+                     name: str,
+                     sc: int,
+                     results,
+                     page: dict = None) -> Union[tuple, int]:
+        """Builds the response of an EWB query from the results returned by Solr (see plan_query)."""
+
+        if sc != 200:
+            self.logger.error(
+                f"-- -- Error executing query {name}. Aborting operation...")
+            return
+
+        if page is None:
+            return results, sc
+
+        return self.page_response(results, page), sc
+
+    def run_query(self,
+                  name: str,
+                  col: str,
+                  start: int = None,
+                  rows: int = None,
+                  cursor: str = None,
+                  **values) -> Union[tuple, int]:
+        """Executes the EWB query with the given name (see Queries) on a collection, building the Solr request from the spec of the query.
+
+        Parameters
+        ----------
+        name : str
+            Name of the query (e.g., 'Q4').
+        col : str
+            Name of the collection, which must be of the kind required by the query.
+        start, rows, cursor
+            Paging parameters (see paging_params). Ignored if the query is not paged.
+        **values
+            Values of the query (e.g., year=2020).
+
+        Returns
+        -------
+        json_object: Union[dict, SolrResults]
+            For paged queries, JSON object with the page of results (see page_response); otherwise, the results of the query.
+        sc : int
+            The status code of the response.
         """
-        indexes = str(row['score']).split('.')
-        lower_limit = int(indexes[0])
-        upper_limit = int(indexes[1]) + 1
-        similarities = row['similarities'].split(" ")
-        filtered_similarities = similarities[lower_limit:upper_limit]
 
-        return ' '.join(filtered_similarities)
+        plan = self.plan_query(name, col, start=start, rows=rows,
+                               cursor=cursor, **values)
+        if plan is None:
+            return
+        col, params, page = plan
+
+        # The statistics of the request are recorded under the name of the query
+        token = current_query.set(name)
+        try:
+            with tracer.span("query {}".format(name), **{"solr.collection": col}) as span:
+                sc, results = self.execute_query(col_name=col, **params)
+                if span is not None:
+                    span.set("solr.status_code", sc)
+        finally:
+            current_query.reset(token)
+
+        return self.finish_query(name, sc, results, page)
+
+    def paging_params(self,
+                      start: int = None,
+                      rows: int = None,
+                      cursor: str = None,
+                      sort: str = None) -> dict:
+        """Returns the Solr paging parameters of a document query. If 'start' is given (and 'cursor' is not), classic offset paging is used; otherwise, the query is paged with a cursor ('*' for the first page), sorting the documents by id (after 'sort', if given).
 
-    def pairs_sims_process(self, df: pd.DataFrame, model_name: str, num_records: int):
-        """Function to process the pairs of documents in descendent order by the similarities for a given year.
+        Parameters
+        ----------
+        start : int
+            Offset of the first document to retrieve.
+        rows : int
+            Number of documents to retrieve. It defaults to self.default_rows and is capped to self.max_rows.
+        cursor : str
+            Cursor mark returned by the previous page ('*' for the first page).
+        sort : str
+            Sort order of the query (e.g., 'citedby_count desc'). If None, documents are returned in index order (offset paging) or by id (cursor paging).
+
+        Returns
+        -------
+        page : dict
+            Paging parameters ('start', 'rows' and, if cursor paging is used, 'cursorMark' and 'sort').
+        """
+
+        rows = self.default_rows if rows is None or int(rows) < 0 \
+            else min(int(rows), self.max_rows)
+
+        if start is not None and cursor is None:
+            page = {'start': str(max(int(start), 0)), 'rows': str(rows)}
+            if sort:
+                page['sort'] = sort
+            return page
+
+        # Cursors require the unique key as tie-breaker
+        return {'start': '0',
+                'rows': str(rows),
+                'cursorMark': cursor or '*',
+                'sort': sort + ', id asc' if sort else 'id asc'}
+
+    def page_response(self, results, page: dict) -> dict:
+        """Builds the response of a paged document query.
 
         Parameters
         ----------
-        df : pd.DataFrame
-            DataFrame with documents id, similarities and score.
+        results : SolrResults
+            Results of the query.
+        page : dict
+            Paging parameters used in the query (see paging_params).
 
         Returns
         -------
-        df_sims: list
-            List like dictionary [{column -> value}, … , {column -> value}] with the pairs of documents in descendent order by the similarities for a given year
+        json_object : dict
+            JSON object with the total number of documents matching the query ('numFound'), the paging parameters ('start', 'rows'), the cursor to retrieve the next page ('nextCursorMark', None if this is the last page or offset paging is used), whether the page is partial because the deadline of the request was reached ('partial') and the documents ('docs').
         """
-        # 0. Rename the 'sim_{model_name}' column to 'similarities'
-        sim_model_key = 'sim_' + model_name
-        df.rename(columns={sim_model_key: 'similarities'}, inplace=True)
-        # 1. Remove rows with score = 0.00
-        df_filtered = df.loc[df['score'] != 0.00].copy()
-        # 2. Apply the score filter to the 'similarities' column
-        df_filtered['similarities'] = df_filtered.apply(self.indexes_filter, axis=1)
-        # 3. Remove the 'score' column
-        df_filtered.drop(['score'], axis=1, inplace=True)
-        # 4. Split the 'similarities' column and create multiple rows
-        df_sims = df_filtered.assign(similarities=df_filtered['similarities'].str.split(' ')).explode('similarities')
-        # 5. Divide the 'similarities' column into two columns: id_similarities and similarities
-        df_sims[['id_similarities', 'similarities']] = df_sims['similarities'].str.split('|', expand=True)
-        # 6. Convert the 'id_similarities' and 'similarities' columns to numeric types
-        df_sims['id'] = df_sims['id'].astype(int)
-        df_sims['id_similarities'] = df_sims['id_similarities'].astype(int)
-        df_sims['similarities'] = df_sims['similarities'].astype(float)
-        # 7. Remove rows where id_similarities is not in the 'id' column (not in the year specified by the user)
-        df_sims = df_sims[df_sims['id_similarities'].isin(df_sims['id'])]
-        # 8. Remove rows where the values of "id" and "id_similarities" match (same document)
-        df_sims = df_sims[df_sims['id'] != df_sims['id_similarities']]
-        # 9. Sort the DataFrame from highest to lowest based on the "similarities" field
-        df_sims = df_sims.sort_values(by='similarities', ascending=False)
-        # 10. Reset the DataFrame index
-        df_sims.reset_index(drop=True, inplace=True)
-        # 11. Keep only the first num_records rows
-        df_sims = df_sims.head(num_records)
-        # 12. Rename the columns
-        df_sims.rename(columns={'id': 'id_1', 'id_similarities': 'id_2', 'similarities': 'score'}, inplace=True)
-        # 13. Reorder the columns
-        columns_order = ['id_1', 'id_2', 'score']
-        df_sims = df_sims.reindex(columns=columns_order)
-        
-        return df_sims.to_dict('records')
+
+        next_cursor = None
+        if 'cursorMark' in page:
+            next_cursor = results.nextCursorMark
+            # Solr returns the same cursor when there are no more documents
+            if next_cursor == page['cursorMark'] or not results.docs:
+                next_cursor = None
+            # The documents after those of a partial page were not searched, so paging cannot go on
+            if results.partial:
+                next_cursor = None
+
+        return {'numFound': results.hits,
+                'start': int(page['start']),
+                'rows': int(page['rows']),
+                'nextCursorMark': next_cursor,
+                'partial': results.partial,
+                'docs': results.docs}
+
+    @staticmethod
+    def facet_counts(results, field: str) -> List[tuple]:
+        """Returns the (value, count) pairs of the facet on the given field of the results of a query."""
+        # Facet counts come as a flat list [value_1, count_1, value_2, count_2, ...]
+        counts = results.facets.get('facet_fields', {}).get(field, [])
+        return list(zip(counts[::2], counts[1::2]))
+
+    def get_model_path(self, model_name: str) -> Union[pathlib.Path, None]:
+        """Returns the folder of the given model (as indexed from self.models_dir), or None if it cannot be found.
+
+        Parameters
+        ----------
+        model_name : str
+            Name of the model collection.
+        """
+        if model_name not in self._model_paths and self.models_dir.is_dir():
+            # Collection names are the lowercased stems of the model folders
+            for path in self.models_dir.iterdir():
+                if path.is_dir() and path.stem.lower() == model_name:
+                    self._model_paths[model_name] = path
+                    break
+        return self._model_paths.get(model_name)
 
     # ======================================================
     # QUERIES
@@ -553,7 +939,10 @@ class EWBSolrClient(SolrClient):
 
     def do_Q1(self,
               corpus_col: str,
-              open_access: str) -> Union[dict, int]:
+              open_access: str,
+              start: int = None,
+              rows: int = None,
+              cursor: str = None) -> Union[dict, int]:
         """Executes query Q1.
 
         Parameters
@@ -562,6 +951,12 @@ class EWBSolrClient(SolrClient):
             Name of the corpus collection.
         open_access : str
             Filter the collection by open access documents if value equal to 1. Otherwise if 0.
+        start : int
+            Offset of the first document to retrieve (offset paging).
+        rows : int
+            Number of documents to retrieve (at most self.max_rows).
+        cursor : str
+            Cursor mark of the page to retrieve ('*' for the first one). Used when start is not given.
 
         Returns
         -------
@@ -571,30 +966,9 @@ class EWBSolrClient(SolrClient):
             The status code of the response.  
         """
 
-        # 0. Convert corpus name to lowercase
-        corpus_col = corpus_col.lower()
-
-        # 1. Check that corpus_col is indeed a corpus collection
-        if not self.check_is_corpus(corpus_col):
-            return
-        
-        # 2. Customize start and rows
-        start, rows = self.custom_start_and_rows(start=None, rows=None, col=corpus_col)
-
-        # 3. Execute query
-        q1 = self.querier.customize_Q1(open_access=open_access, start=start, rows=rows)
-        params = {k: v for k, v in q1.items() if k != 'q'}
-
-        sc, results = self.execute_query(
-            q=q1['q'], col_name=corpus_col, **params)
+        return self.run_query('Q1', corpus_col, start=start, rows=rows, cursor=cursor,
+                              open_access=open_access)
 
-        if sc != 200:
-            self.logger.error(
-                f"-- -- Error executing query Q1. Aborting operation...")
-            return
-
-        return results.docs, sc
-    
     def do_Q2(self, corpus_col: str) -> Union[dict, int]:
         """
         Executes query Q2.
@@ -619,22 +993,14 @@ class EWBSolrClient(SolrClient):
         if not self.check_is_corpus(corpus_col):
             return
 
-        # 2. Execute query (to self.corpus_col)
-        q2 = self.querier.customize_Q2(corpus_name=corpus_col)
-        params = {k: v for k, v in q2.items() if k != 'q'}
-        sc, results = self.execute_query(
-            q=q2['q'], col_name=self.corpus_col, **params)
-
-        if sc != 200:
-            self.logger.error(
-                f"-- -- Error executing query Q2. Aborting operation...")
-            return
+        # 2. Get fields from the registry (it mirrors self.corpus_col)
+        corpus_fields, sc = self.get_corpus_coll_fields(corpus_col)
 
         # Filter out metadata fields that we don't consider metadata
         #meta_fields = [field for field in results.docs[0]
                        #['fields'] if field not in self.no_meta_fields and not field.startswith("doctpc_")]
-        meta_fields = [field for field in results.docs[0]
-                       ['fields'] if field not in self.no_meta_fields]
+        meta_fields = [field for field in corpus_fields
+                       if field not in self.no_meta_fields]
         
         return {'metadata_fields': meta_fields}, sc
     
@@ -654,24 +1020,8 @@ class EWBSolrClient(SolrClient):
             The status code of the response
         """
 
-        # 0. Convert collection name to lowercase
-        col = col.lower()
-
-        # 1. Check that col is either a corpus or a model collection
-        if not self.check_is_corpus(col) and not self.check_is_model(col):
-            return
-
-        # 2. Execute query
-        q3 = self.querier.customize_Q3()
-        params = {k: v for k, v in q3.items() if k != 'q'}
-
-        sc, results = self.execute_query(
-            q=q3['q'], col_name=col, **params)
-
-        # 3. Filter results
-        if sc != 200:
-            self.logger.error(
-                f"-- -- Error executing query Q3. Aborting operation...")
+        results, sc = self.run_query('Q3', col) or (None, None)
+        if results is None:
             return
 
         return {'ndocs': int(results.hits)}, sc
@@ -679,7 +1029,9 @@ class EWBSolrClient(SolrClient):
     def do_Q4(self,
               corpus_col: str,
               year: str,
-              ) -> Union[dict, int]:
+              start: int = None,
+              rows: int = None,
+              cursor: str = None) -> Union[dict, int]:
         """Executes query Q4.
 
         Parameters
@@ -689,6 +1041,13 @@ class EWBSolrClient(SolrClient):
         year: str
             Publication year to filter by
         
+        start : int
+            Offset of the first document to retrieve (offset paging).
+        rows : int
+            Number of documents to retrieve (at most self.max_rows).
+        cursor : str
+            Cursor mark of the page to retrieve ('*' for the first one). Used when start is not given.
+
         Returns
         -------
         json_object: dict
@@ -697,34 +1056,15 @@ class EWBSolrClient(SolrClient):
             The status code of the response.  
         """
 
-        # 0. Convert corpus name to lowercase
-        corpus_col = corpus_col.lower()
-
-        # 1. Check that corpus_col is indeed a corpus collection
-        if not self.check_is_corpus(corpus_col):
-            return
-        
-        # 2. Customize start and rows
-        start, rows = self.custom_start_and_rows(start=None, rows=None, col=corpus_col)
-
-        # 4. Execute query
-        q4 = self.querier.customize_Q4(
-            year=year, start=start, rows=rows)
-        params = {k: v for k, v in q4.items() if k != 'q'}
-
-        sc, results = self.execute_query(
-            q=q4['q'], col_name=corpus_col, **params)
-
-        if sc != 200:
-            self.logger.error(
-                f"-- -- Error executing query Q4. Aborting operation...")
-            return
-
-        return results.docs, sc
+        return self.run_query('Q4', corpus_col, start=start, rows=rows, cursor=cursor,
+                              year=year)
 
     def do_Q5(self,
               corpus_col: str,
-              continent: str) -> Union[dict, int]:
+              continent: str,
+              start: int = None,
+              rows: int = None,
+              cursor: str = None) -> Union[dict, int]:
         """Executes query Q5.
 
         Parameters
@@ -733,6 +1073,12 @@ class EWBSolrClient(SolrClient):
             Name of the corpus collection
         continent: str
             Continent through which the document collection is to be filtered
+        start : int
+            Offset of the first document to retrieve (offset paging).
+        rows : int
+            Number of documents to retrieve (at most self.max_rows).
+        cursor : str
+            Cursor mark of the page to retrieve ('*' for the first one). Used when start is not given.
 
         Returns
         -------
@@ -742,33 +1088,16 @@ class EWBSolrClient(SolrClient):
             The status code of the response.  
         """
 
-        # 0. Convert corpus name to lowercase
-        corpus_col = corpus_col.lower()
-
-        # 1. Check that corpus_col is indeed a corpus collection
-        if not self.check_is_corpus(corpus_col):
-            return
-        
-        # 2. Customize start and rows
-        start, rows = self.custom_start_and_rows(start=None, rows=None, col=corpus_col)
-
-        # 3. Execute query
-        q5 = self.querier.customize_Q5(continent=continent, start=start, rows=rows)
-        params = {k: v for k, v in q5.items() if k != 'q'}
-
-        sc, results = self.execute_query(
-            q=q5['q'], col_name=corpus_col, **params)
-
-        if sc != 200:
-            self.logger.error(
-                f"-- -- Error executing query Q5. Aborting operation...")
-            return
-
-        return results.docs, sc
+        # The whole collection is returned for 'world'
+        return self.run_query('Q5', corpus_col, start=start, rows=rows, cursor=cursor,
+                              continent=None if continent == 'world' else continent.lower())
 
     def do_Q6(self,
               corpus_col: str,
-              city: str) -> Union[dict, int]:
+              city: str,
+              start: int = None,
+              rows: int = None,
+              cursor: str = None) -> Union[dict, int]:
         """Executes query Q6.
 
         Parameters
@@ -777,6 +1106,12 @@ class EWBSolrClient(SolrClient):
             Name of the corpus collection
         city: str
             City by which to filter the document collection
+        start : int
+            Offset of the first document to retrieve (offset paging).
+        rows : int
+            Number of documents to retrieve (at most self.max_rows).
+        cursor : str
+            Cursor mark of the page to retrieve ('*' for the first one). Used when start is not given.
 
         Returns
         -------
@@ -786,33 +1121,15 @@ class EWBSolrClient(SolrClient):
             The status code of the response.
         """
 
-        # 0. Convert corpus name to lowercase
-        corpus_col = corpus_col.lower()
-
-        # 1. Check that corpus_col is indeed a corpus collection
-        if not self.check_is_corpus(corpus_col):
-            return
-        
-        # 2. Customize start and rows
-        start, rows = self.custom_start_and_rows(start=None, rows=None, col=corpus_col)
-
-        # 3. Execute query
-        q6 = self.querier.customize_Q6(city=city, start=start, rows=rows)
-        params = {k: v for k, v in q6.items() if k != 'q'}
-
-        sc, results = self.execute_query(
-            q=q6['q'], col_name=corpus_col, **params)
-
-        if sc != 200:
-            self.logger.error(
-                f"-- -- Error executing query Q6. Aborting operation...")
-            return
-
-        return results.docs, sc
+        return self.run_query('Q6', corpus_col, start=start, rows=rows, cursor=cursor,
+                              city=city)
 
     def do_Q7(self,
               corpus_col: str,
-              institution: str) -> Union[dict, int]:
+              institution: str,
+              start: int = None,
+              rows: int = None,
+              cursor: str = None) -> Union[dict, int]:
         """Executes query Q7.
 
         Parameters
@@ -821,6 +1138,12 @@ class EWBSolrClient(SolrClient):
             Name of the corpus collection
         institution: str
             Institution by which to filter the document collection
+        start : int
+            Offset of the first document to retrieve (offset paging).
+        rows : int
+            Number of documents to retrieve (at most self.max_rows).
+        cursor : str
+            Cursor mark of the page to retrieve ('*' for the first one). Used when start is not given.
 
         Returns
         -------
@@ -830,29 +1153,8 @@ class EWBSolrClient(SolrClient):
             The status code of the response.
         """
 
-        # 0. Convert corpus name to lowercase
-        corpus_col = corpus_col.lower()
-
-        # 1. Check that corpus_col is indeed a corpus collection
-        if not self.check_is_corpus(corpus_col):
-            return
-        
-        # 2. Customize start and rows
-        start, rows = self.custom_start_and_rows(start=None, rows=None, col=corpus_col)
-
-        # 3. Execute query
-        q7 = self.querier.customize_Q7(institution=institution, start=start, rows=rows)
-        params = {k: v for k, v in q7.items() if k != 'q'}
-
-        sc, results = self.execute_query(
-            q=q7['q'], col_name=corpus_col, **params)
-
-        if sc != 200:
-            self.logger.error(
-                f"-- -- Error executing query Q7. Aborting operation...")
-            return
-
-        return results.docs, sc
+        return self.run_query('Q7', corpus_col, start=start, rows=rows, cursor=cursor,
+                              institution=institution)
 
     def do_Q9(self,
               model_col: str,
@@ -881,25 +1183,29 @@ class EWBSolrClient(SolrClient):
         if not self.check_is_model(model_col):
             return
 
-        # 5. Execute query
-        q9 = self.querier.customize_Q9(topic_label=topic_label)
-        
-        params = {k: v for k, v in q9.items() if k != 'q'}
-
-        sc, results = self.execute_query(
-            q=q9['q'], col_name=model_col, **params)
-
-        if sc != 200:
-            self.logger.error(
-                f"-- -- Error executing query Q9. Aborting operation...")
+        # 2. Look up the label in the topic metadata of the model
+        table = self.topics.get(model_col)
+        if table is not None:
+            topic_id = table.id_of_label(topic_label)
+            if topic_id is not None:
+                return [{'id': topic_id}], 200
+
+        # 3. Execute query (labels that do not match exactly are resolved by Solr)
+        results, sc = self.run_query(
+            'Q9', model_col, topic_label=topic_label) or (None, None)
+        if results is None:
             return
-        
+
         return results.docs, sc
 
     def do_Q10(self,
                corpus_col: str,
                model_col: str,
-               topic_label: str) -> Union[dict, int]:
+               topic_label: str,
+               min_weight: int = None,
+               start: int = None,
+               rows: int = None,
+               cursor: str = None) -> Union[dict, int]:
         """Executes query Q10.
 
         Parameters
@@ -910,6 +1216,14 @@ class EWBSolrClient(SolrClient):
             Name of the model collection whose information is being retrieved
         topic_label: str
             Label of the topic whose id will be retrieved
+        min_weight: int
+            Minimum weight (in [0, 1000]) of the topic in the documents retrieved
+        start : int
+            Offset of the first document to retrieve (offset paging).
+        rows : int
+            Number of documents to retrieve (at most self.max_rows).
+        cursor : str
+            Cursor mark of the page to retrieve ('*' for the first one). Used when start is not given.
 
         Returns
         -------
@@ -923,40 +1237,32 @@ class EWBSolrClient(SolrClient):
         corpus_col = corpus_col.lower()
         model_col = model_col.lower()
 
-        # 1. Check that col is either a corpus or a model collection
-        if not self.check_is_corpus(corpus_col) and not self.check_is_model(model_col):
+        # 1. Check that corpus_col is a corpus collection and model_col a model collection
+        if not self.check_is_corpus(corpus_col) or not self.check_is_model(model_col):
             return
 
-        # 3. Customize start and rows
-        start, rows = self.custom_start_and_rows(start=None, rows=None, col=corpus_col)
-
-        results_docs, sc = self.do_Q9(model_col=model_col, topic_label=topic_label)
+        # 2. Get topic id (from the topic metadata of the model, without querying Solr)
+        results_docs, sc = self.do_Q9(
+            model_col=model_col, topic_label=topic_label) or (None, None)
 
-        if sc != 200:
+        if sc != 200 or not results_docs:
             self.logger.error(
                 f"-- -- Error executing query Q10. Aborting operation...")
             return
         
         topic_id = results_docs[0]["id"]
 
-        # 4. Execute query
-        q10 = self.querier.customize_Q10(model_col=model_col, topic_id=topic_id, start=start, rows=rows)
-        params = {k: v for k, v in q10.items() if k != 'q'}
-
-        sc, results = self.execute_query(
-            q=q10['q'], col_name=corpus_col, **params)
-
-        if sc != 200:
-            self.logger.error(
-                f"-- -- Error executing query Q10. Aborting operation...")
-            return
-              
-        return results.docs, sc
+        # 3. Execute query (documents are sorted by the weight of the topic)
+        return self.run_query('Q10', corpus_col, start=start, rows=rows, cursor=cursor,
+                              model_col=model_col, topic_id=topic_id, min_weight=min_weight)
 
     def do_Q12(self,
                corpus_col: str,
                lower_limit: str,
-               upper_limit: str) -> Union[dict, int]:
+               upper_limit: str,
+               start: int = None,
+               rows: int = None,
+               cursor: str = None) -> Union[dict, int]:
         """Executes query Q12.
 
         Parameters
@@ -967,116 +1273,404 @@ class EWBSolrClient(SolrClient):
             Lower limit to filter by number of citations
         upper_limit: str
             Upper limit to filter by number of citations
+        start : int
+            Offset of the first document to retrieve (offset paging).
+        rows : int
+            Number of documents to retrieve (at most self.max_rows).
+        cursor : str
+            Cursor mark of the page to retrieve ('*' for the first one). Used when start is not given.
+
+        Returns
+        -------
+        json_object: dict
+            JSON object with the results of the query.
+        sc : int
+            The status code of the response.
+        """
+
+        return self.run_query('Q12', corpus_col, start=start, rows=rows, cursor=cursor,
+                              lower_limit=lower_limit, upper_limit=upper_limit)
 
+    def do_Q13(self,
+               corpus_col: str,
+               fund_sponsor: str,
+               start: int = None,
+               rows: int = None,
+               cursor: str = None) -> Union[dict, int]:
+        
+        """Executes query Q13.
+
+        Parameters
+        ----------
+        corpus_col : str
+            Name of the corpus collection.
+        fund_sponsor: str
+            Funding Sponsor by which to filter the document collection.
+        start : int
+            Offset of the first document to retrieve (offset paging).
+        rows : int
+            Number of documents to retrieve (at most self.max_rows).
+        cursor : str
+            Cursor mark of the page to retrieve ('*' for the first one). Used when start is not given.
+
+        Returns
+        -------
+        json_object: dict
+            JSON object with the results of the query.
+        sc : int
+            The status code of the response.  
+        """
+
+        return self.run_query('Q13', corpus_col, start=start, rows=rows, cursor=cursor,
+                              fund_sponsor=fund_sponsor)
+
+    def do_Q14(self,
+               model_col: str) -> Union[dict, int]:
+        
+        """Executes query Q14.
+
+        Parameters
+        ----------
+        model_col : str
+            Name of the model collection.
+
+        Returns
+        -------
+        json_object: dict
+            JSON object with the results of the query.
+        sc : int
+            The status code of the response.  
         """
 
         # 0. Convert corpus name to lowercase
-        corpus_col = corpus_col.lower()
+        model_col = model_col.lower()
 
-        # 1. Check that corpus_col is indeed a corpus collection
-        if not self.check_is_corpus(corpus_col):
+        # 1. Check that model_col is indeed a corpus collection
+        if not self.check_is_model(model_col):
             return
         
-        # 2. Customize start and rows
-        start, rows = self.custom_start_and_rows(start=None, rows=None, col=corpus_col)
+        # 2. Serve the topic map from the topic metadata of the model
+        table = self.topics.get(model_col)
+        if table is None:
+            self.logger.error(
+                f"-- -- Error executing query Q14. Aborting operation...")
+            return
 
-        # 3. Execute query
-        q12 = self.querier.customize_Q12(lower_limit=lower_limit, upper_limit=upper_limit, start=start, rows=rows)
-        params = {k: v for k, v in q12.items() if k != 'q'}
+        fields = self.querier.Q14.fl.split(',')
+        topic_map = [{field: topic[field] for field in fields if field in topic}
+                     for topic in table.topics]
 
-        sc, results = self.execute_query(
-            q=q12['q'], col_name=corpus_col, **params)
+        return topic_map, 200
 
-        if sc != 200:
-            self.logger.error(
-                f"-- -- Error executing query Q12. Aborting operation...")
+    def do_Q15(self, corpus_col: str) -> Union[dict, int]:
+        """Executes query Q15.
+
+        Parameters
+        ----------
+        corpus_col : str
+            Name of the corpus collection.
+
+        Returns
+        -------
+        json_object: dict
+            JSON object with the number of documents published each year.
+        sc : int
+            The status code of the response.  
+        """
+
+        results, sc = self.run_query('Q15', corpus_col) or (None, None)
+        if results is None:
             return
 
-        return results.docs, sc
+        years = [{'year': int(year), 'ndocs': ndocs}
+                 for year, ndocs in self.facet_counts(results, 'year')]
 
-    def do_Q13(self,
+        return years, sc
+
+    def do_Q16(self,
                corpus_col: str,
-               fund_sponsor: str) -> Union[dict, int]:
-        
-        """Executes query Q13.
+               model_col: str,
+               year: str = None,
+               num_records: int = 100) -> Union[dict, int]:
+        """Executes query Q16.
 
         Parameters
         ----------
         corpus_col : str
             Name of the corpus collection.
-        fund_sponsor: str
-            Funding Sponsor by which to filter the document collection.
+        model_col : str
+            Name of the model collection whose document similarities are used.
+        year : str
+            Publication year of the documents among which the pairs are searched. If None, all the documents are considered.
+        num_records : int
+            Number of pairs to retrieve.
 
         Returns
         -------
         json_object: dict
-            JSON object with the results of the query.
+            JSON object with the pairs of documents ('id_1', 'id_2' and 'score') in descending order of similarity.
         sc : int
             The status code of the response.  
         """
 
-        # 0. Convert corpus name to lowercase
+        # 0. Convert corpus and model name to lowercase
         corpus_col = corpus_col.lower()
+        model_col = model_col.lower()
 
-        # 1. Check that corpus_col is indeed a corpus collection
-        if not self.check_is_corpus(corpus_col):
+        # 1. Check that corpus_col is a corpus collection and model_col a model collection
+        if not self.check_is_corpus(corpus_col) or not self.check_is_model(model_col):
             return
-        
-        # 2. Customize start and rows
-        start, rows = self.custom_start_and_rows(start=None, rows=None, col=corpus_col)
 
-        # 3. Execute query
-        q13 = self.querier.customize_Q13(fund_sponsor=fund_sponsor, start=start, rows=rows)
-        params = {k: v for k, v in q13.items() if k != 'q'}
+        model_path = self.get_model_path(model_col)
+        if model_path is None:
+            self.logger.error(
+                f"-- -- Folder of model {model_col} not found in {self.models_dir}. Aborting operation...")
+            return
 
-        sc, results = self.execute_query(
-            q=q13['q'], col_name=corpus_col, **params)
+        # 2. Get the ids of the documents in the filter (only the ids are retrieved from Solr)
+        ids = None
+        if year is not None:
+            params = self.querier.customize('Q16', year=year)
+            # All the matching documents are read, paging by id
+            params.pop('sort', None)
+            docs = self.fetch_all_docs(col_name=corpus_col, **params)
+            if docs is None:
+                self.logger.error(
+                    f"-- -- Error executing query Q16. Aborting operation...")
+                return
+            ids = [doc['id'] for doc in docs]
 
-        if sc != 200:
+        # 3. Get the most similar pairs from the similarity matrix of the model
+        from src.core.entities.similarities import NeighborIndex
+        try:
+            sims = NeighborIndex.load(model_path, logger=self.logger)
+        except (OSError, ValueError) as e:
             self.logger.error(
-                f"-- -- Error executing query Q13. Aborting operation...")
+                f"-- -- Neighbor index of {model_col} could not be built: {e}. Aborting operation...")
             return
 
-        return results.docs, sc
-    
-    def do_Q14(self,
-               model_col: str) -> Union[dict, int]:
-        
-        """Executes query Q14.
+        return sims.top_pairs(ids=ids, k=min(int(num_records), self.max_rows)), 200
+
+    def do_Q17(self,
+               model_col: str,
+               doc_id: str,
+               k: int = 10) -> Union[dict, int]:
+        """Executes query Q17.
 
         Parameters
         ----------
         model_col : str
-            Name of the model collection.
+            Name of the model collection whose document similarities are used.
+        doc_id : str
+            ID of the document whose most similar documents are retrieved.
+        k : int
+            Number of documents to retrieve.
 
         Returns
         -------
         json_object: dict
-            JSON object with the results of the query.
+            JSON object with the documents ('id' and 'score') most similar to the given one, in descending order of similarity.
         sc : int
             The status code of the response.  
         """
 
-        # 0. Convert corpus name to lowercase
+        # 0. Convert model name to lowercase
         model_col = model_col.lower()
 
-        # 1. Check that model_col is indeed a corpus collection
+        # 1. Check that model_col is indeed a model collection
         if not self.check_is_model(model_col):
             return
-        
-        # 2. Customize start and rows
-        start, rows = self.custom_start_and_rows(start=None, rows=None, col=model_col)
 
-        # 3. Execute query
-        q14 = self.querier.customize_Q14(start=start, rows=rows)
-        params = {k: v for k, v in q14.items() if k != 'q'}
+        model_path = self.get_model_path(model_col)
+        if model_path is None:
+            self.logger.error(
+                f"-- -- Folder of model {model_col} not found in {self.models_dir}. Aborting operation...")
+            return
 
-        sc, results = self.execute_query(
-            q=q14['q'], col_name=model_col, **params)
+        # 2. Get the neighbors of the document from the (memory-mapped) neighbor index of the model, without querying Solr
+        from src.core.entities.similarities import NeighborIndex
+        try:
+            sims = NeighborIndex.load(model_path, logger=self.logger)
+        except (OSError, ValueError) as e:
+            self.logger.error(
+                f"-- -- Neighbor index of {model_col} could not be built: {e}. Aborting operation...")
+            return
+        neighbors = sims.neighbors(doc_id, k=min(int(k), self.max_rows))
+        if neighbors is None:
+            self.logger.error(
+                f"-- -- Document {doc_id} not found in the training corpus of {model_col}. Aborting operation...")
+            return
+
+        return neighbors, 200
 
+    def do_Q18(self,
+               corpus_col: str,
+               model_col: str = None,
+               topic_label: str = None,
+               open_access: str = None,
+               year: str = None,
+               continent: str = None,
+               city: str = None,
+               institution: str = None,
+               lower_limit: str = None,
+               upper_limit: str = None,
+               fund_sponsor: str = None) -> Union[dict, int]:
+        """Executes query Q18.
+
+        Parameters
+        ----------
+        corpus_col : str
+            Name of the corpus collection.
+        model_col : str
+            Name of the model collection of the topic label (required if topic_label is given).
+        topic_label, open_access, year, continent, city, institution, lower_limit, upper_limit, fund_sponsor : str
+            Filters of the documents counted, as in Q1-Q13. Filters that are not given are not applied.
+
+        Returns
+        -------
+        json_object: dict
+            JSON object with the counts of the documents (see doc_counts).
+        sc : int
+            The status code of the response.
+        """
+
+        # 1. Get topic id (from the topic metadata of the model)
+        topic_id = None
+        if topic_label is not None:
+            if model_col is None:
+                self.logger.error(
+                    f"-- -- A model collection is required to filter by topic. Aborting operation...")
+                return
+            model_col = model_col.lower()
+            results_docs, sc = self.do_Q9(
+                model_col=model_col, topic_label=topic_label) or (None, None)
+            if sc != 200 or not results_docs:
+                self.logger.error(
+                    f"-- -- Error executing query Q18. Aborting operation...")
+                return
+            topic_id = results_docs[0]["id"]
+
+        # 2. Execute query (only the counts are retrieved)
+        results, sc = self.run_query(
+            'Q18', corpus_col, model_col=model_col, topic_id=topic_id,
+            open_access=open_access, year=year,
+            continent=None if continent in (None, 'world') else continent.lower(),
+            city=city, institution=institution,
+            lower_limit=lower_limit, upper_limit=upper_limit,
+            fund_sponsor=fund_sponsor) or (None, None)
+        if results is None:
+            return
+
+        return self.doc_counts(results), sc
+
+    def doc_counts(self, results) -> dict:
+        """Builds the response of query Q18.
+
+        Parameters
+        ----------
+        results : SolrResults
+            Results of the query.
+
+        Returns
+        -------
+        json_object : dict
+            JSON object with the number of documents that match the filters ('numFound'), whether the counts are partial because the deadline of the request was reached ('partial'), the counts of the values of each faceted field ('facets', as lists of {'value', 'count'}) and the counts of the ranges of the number of citations ('queries').
+        """
+
+        facets = {field: [{'value': int(value) if field in ('year', 'openaccess') else value,
+                           'count': count}
+                          for value, count in self.facet_counts(results, field)]
+                  for field in self.querier.Q18.facets}
+
+        return {'numFound': results.hits,
+                'partial': results.partial,
+                'facets': facets,
+                'queries': results.facets.get('facet_queries', {})}
+
+    # ======================================================
+    # EXPORT
+    # ======================================================
+    def export_docs(self,
+                    col: str,
+                    q: str = '*:*',
+                    fq: List[str] = None,
+                    fl: str = None,
+                    sort: str = None) -> Union[tuple, int]:
+        """Prepares the export of all the documents of a collection that match a query, without any limit on their number.
+
+        If all the requested fields (and the sort fields) have docValues, the documents are read through the /export handler with a streaming expression; otherwise, they are paged with a cursor. Either way, documents are yielded as they are read from Solr, so memory does not grow with the size of the result set.
+
+        Parameters
+        ----------
+        col : str
+            Name of the collection.
+        q : str
+            The query to be executed.
+        fq : List[str]
+            Filter queries (e.g., ['fund_sponsor:"European Commission"']).
+        fl : str
+            Comma-separated fields to export. If None, all the stored fields but those in self.no_meta_fields and the document-topic distributions are exported.
+        sort : str
+            Sort order of the documents. It defaults to 'id asc'.
+
+        Returns
+        -------
+        export: tuple
+            Tuple with the exported columns (List[Column]) and an iterator over the documents.
+        sc : int
+            The status code of the response.
+        """
+
+        # 0. Convert collection name to lowercase
+        col = col.lower()
+
+        # 1. Get the fields of the collection
+        fields, sc = self.get_schema_fields(col)
         if sc != 200:
             self.logger.error(
-                f"-- -- Error executing query Q14. Aborting operation...")
+                f"-- -- Error getting the schema of {col}. Aborting operation...")
+            return
+        schema = {field['name']: field for field in fields}
+
+        if fl:
+            names = [name.strip() for name in fl.split(',') if name.strip()]
+        else:
+            names = [field['name'] for field in fields
+                     if field.get('stored', True) and field['name'] not in self.no_meta_fields
+                     and field.get('type') != 'VectorField']
+        sort = sort or 'id asc'
+        sort_names = [clause.split()[0]
+                      for clause in sort.split(',') if clause.strip()]
+        unknown = [name for name in names + sort_names if name not in schema]
+        if unknown:
+            self.logger.error(
+                f"-- -- Fields {unknown} not found in {col}. Aborting operation...")
             return
 
-        return results.docs, sc
\ No newline at end of file
+        # 2. Read the documents through /export if possible
+        exportable = all(schema[name].get('docValues') for name in names + sort_names) and \
+            not any(schema[name].get('multiValued') for name in sort_names)
+        if exportable:
+            docs = self.stream_documents(
+                col, search_expression(col, q, names, sort, fq=fq))
+        else:
+            self.logger.info(
+                f"-- -- Not all the fields exported from {col} have docValues: paging with a cursor instead of using /export")
+            params = {'fl': ','.join(names)}
+            if fq:
+                params['fq'] = fq
+            docs = self.iter_all_docs(col_name=col, q=q, sort=sort, **params)
+
+        # 3. Read the first document, so that errors in the query are reported before the export starts
+        try:
+            first = next(docs, None)
+        except SolrStreamError:
+            self.logger.error(
+                f"-- -- Error exporting documents from {col}. Aborting operation...")
+            return
+        if first is not None:
+            docs = itertools.chain([first], docs)
+
+        columns = [Column.from_schema_field(schema[name]) for name in names]
+
+        return (columns, docs), 200
@@ -0,0 +1,408 @@
+"""
+This module provides the engine that runs the ingestion operations of the EWB (indexing and deletion of corpora and models) as background jobs, so that they do not hold the thread of an HTTP request.
+
+Jobs are run by a pool of worker processes, each of which creates its own EWBSolrClient. Their state and progress (documents indexed, throughput, ETA) are kept in a persistent job log (an SQLite database), which is shared by all the processes of the API: a job can be followed or cancelled from any of them, and jobs survive restarts of the API in the log.
+
+Every process of the API has its own pool, so the number of jobs running at the same time is bounded through the log: a job only starts once it claims a slot, which it does atomically when fewer jobs than the limit are running in all the processes. Until then, it waits in its worker process (and can still be cancelled).
+
+Author: Lorena Calvo-Bartolomé
+Date: 03/07/2023
+"""
+
+import configparser
+import logging
+import multiprocessing
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Union
+
+from src.core.clients.base.generations import COLLECTIONS
+
+# Time (s) between the attempts of a queued job to claim a slot
+CLAIM_INTERVAL = 1
+
+# Status of the jobs
+QUEUED = "queued"
+RUNNING = "running"
+FINISHED = "finished"
+FAILED = "failed"
+CANCELLED = "cancelled"
+ACTIVE = (QUEUED, RUNNING)
+
+# Operations that can be run as jobs (methods of EWBSolrClient), and whether they report progress
+KINDS = {"index_corpus": True,
+         "delete_corpus": False,
+         "index_model": True,
+         "delete_model": True}
+
+
+class JobCancelled(Exception):
+    """Raised in a running job when its cancellation has been requested."""
+
+
+class JobLog(object):
+    """
+    A class to persist the state and progress of the jobs in an SQLite database.
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            path TEXT NOT NULL,
+            status TEXT NOT NULL,
+            pid INTEGER,
+            submitted_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            updated_at REAL,
+            stage TEXT,
+            stage_started_at REAL,
+            docs_indexed INTEGER NOT NULL DEFAULT 0,
+            docs_total INTEGER,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            error TEXT
+        )"""
+
+    def __init__(self, path: str) -> None:
+        """
+        Parameters
+        ----------
+        path : str
+            Path of the database. It is created if it does not exist.
+        """
+        self.path = str(path)
+        pathlib.Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(self._SCHEMA)
+
+        return
+
+    def _connect(self) -> sqlite3.Connection:
+        # Short-lived connections, so that the log can be used from any thread or process
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create(self, kind: str, path: str) -> str:
+        """Records a new queued job and returns its id."""
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, path, status, pid, submitted_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, path, QUEUED, os.getpid(), time.time()))
+        return job_id
+
+    def claim(self, job_id: str, max_running: int) -> str:
+        """Marks a queued job as running in the current process if fewer than max_running jobs are running in all the processes.
+
+        Returns
+        -------
+        status : str
+            RUNNING if the job was started, QUEUED if it must wait for a running job to end, or CANCELLED if it was cancelled before it started.
+        """
+        # Jobs whose process is gone do not hold their slot
+        self.running()
+
+        with self._connect() as conn:
+            # The check and the update are a single statement, so that two processes cannot take the same slot
+            cur = conn.execute(
+                "UPDATE jobs SET status = ?, pid = ?, started_at = ?, updated_at = ? "
+                "WHERE id = ? AND status = ? AND cancel_requested = 0 "
+                "AND (SELECT COUNT(*) FROM jobs WHERE status = ?) < ?",
+                (RUNNING, os.getpid(), time.time(), time.time(), job_id, QUEUED,
+                 RUNNING, max_running))
+            if cur.rowcount == 1:
+                return RUNNING
+            row = conn.execute(
+                "SELECT status, cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is not None and row["status"] == QUEUED and not row["cancel_requested"]:
+            return QUEUED
+
+        self.finish(job_id, CANCELLED)
+        return CANCELLED
+
+    def progress(self, job_id: str, stage: str, indexed: int, total: int) -> bool:
+        """Records the progress of a running job. Returns True if its cancellation has been requested."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                # A new stage starts when the previous one ended (its last update)
+                "UPDATE jobs SET stage_started_at = CASE WHEN stage IS ? "
+                "THEN stage_started_at ELSE updated_at END, "
+                "stage = ?, docs_indexed = ?, docs_total = ?, updated_at = ? WHERE id = ?",
+                (stage, stage, indexed, total, now, job_id))
+            row = conn.execute(
+                "SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def finish(self, job_id: str, status: str, error: str = None) -> None:
+        """Records the end of a job, unless it had already ended."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ?, updated_at = ? "
+                "WHERE id = ? AND status IN (?, ?)",
+                (status, error, time.time(), time.time(), job_id, *ACTIVE))
+        return
+
+    def request_cancel(self, job_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+        return
+
+    def get(self, job_id: str) -> Union[dict, None]:
+        """Returns the state of the job with the given id, or None if there is no such job."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._describe(row) if row is not None else None
+
+    def list(self, limit: int = 50) -> List[dict]:
+        """Returns the state of the latest jobs, most recent first."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs ORDER BY submitted_at DESC LIMIT ?", (limit,)).fetchall()
+        return [self._describe(row) for row in rows]
+
+    def running(self) -> List[dict]:
+        """Returns the state of the running jobs."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE status = ?", (RUNNING,)).fetchall()
+        return [job for job in map(self._describe, rows) if job["status"] == RUNNING]
+
+    def counts(self) -> Dict[str, int]:
+        """Returns the number of jobs in each status."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def _describe(self, row: sqlite3.Row) -> dict:
+        job = dict(row)
+        job["cancel_requested"] = bool(job["cancel_requested"])
+
+        # Jobs whose process is gone (e.g., after a restart) will never finish
+        if job["status"] in ACTIVE and not _is_alive(job["pid"]):
+            error = "The process running the job exited before it finished"
+            self.finish(job["id"], FAILED, error)
+            job.update(status=FAILED, error=error)
+
+        # Throughput and ETA of the current stage
+        job["docs_per_sec"] = job["eta_sec"] = None
+        if job["status"] == RUNNING and job["stage_started_at"] and job["docs_indexed"]:
+            elapsed = job["updated_at"] - job["stage_started_at"]
+            if elapsed > 0:
+                job["docs_per_sec"] = round(job["docs_indexed"] / elapsed, 1)
+                remaining = (job["docs_total"] or 0) - job["docs_indexed"]
+                job["eta_sec"] = round(remaining / job["docs_per_sec"], 1)
+        return job
+
+
+def _is_alive(pid: int) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# ======================================================
+# WORKER PROCESSES
+# ======================================================
+# Client of the worker process, created by its first job
+_client = None
+
+
+def _run_job(job_id: str, kind: str, path: str, config_file: str, log_path: str,
+             max_running: int) -> None:
+    """Runs a job in a worker process once it claims one of the max_running slots shared by all the processes, recording its progress and result in the job log."""
+    global _client
+
+    log = JobLog(log_path)
+    status = log.claim(job_id, max_running)
+    while status == QUEUED:
+        time.sleep(CLAIM_INTERVAL)
+        status = log.claim(job_id, max_running)
+    if status != RUNNING:
+        return
+
+    logger = logging.getLogger('Jobs')
+
+    def progress(stage: str, indexed: int, total: int) -> None:
+        if log.progress(job_id, stage, indexed, total):
+            raise JobCancelled(job_id)
+
+    try:
+        if _client is None:
+            # Imported here, so that the worker processes do not import the API
+            from src.core.clients.ewb_solr_client import EWBSolrClient
+            _client = EWBSolrClient(logger, config_file)
+        operation = getattr(_client, kind)
+        if KINDS[kind]:
+            operation(path, progress=progress)
+        else:
+            operation(path)
+    except JobCancelled:
+        logger.info(f"-- -- Job {job_id} ({kind} {path}) cancelled")
+        log.finish(job_id, CANCELLED)
+        return
+    except Exception as e:
+        logger.exception(f"-- -- Job {job_id} ({kind} {path}) failed")
+        log.finish(job_id, FAILED, error="{}: {}".format(type(e).__name__, e))
+        return
+
+    log.finish(job_id, FINISHED)
+
+    return
+
+
+# ======================================================
+# ENGINE
+# ======================================================
+class JobEngine(object):
+    """
+    A class to submit, follow and cancel the ingestion jobs of the EWB.
+    """
+
+    # Engines shared within the process, by configuration file
+    _shared: Dict[str, 'JobEngine'] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self,
+                 client,
+                 config_file: str = "/config/config.cf") -> None:
+        """
+        Parameters
+        ----------
+        client : EWBSolrClient
+            Client of the API process, through which the end of the jobs is published to the caches of all the processes.
+        config_file : str
+            Path to the configuration file, from which the number of jobs run at the same time (by all the processes, and thus the size of the pool) and the path of the job log are read ([jobs] section).
+        """
+        cf = configparser.ConfigParser()
+        cf.read(config_file)
+
+        self.client = client
+        self.logger = client.logger
+        self.config_file = config_file
+        self.max_workers = cf.getint('jobs', 'workers', fallback=2)
+        self.log = JobLog(cf.get('jobs', 'log', fallback='/data/jobs/jobs.db'))
+
+        # The pool is started by the first job, in the process that serves it
+        self._pool = None
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+        return
+
+    @classmethod
+    def shared(cls,
+               client,
+               config_file: str = "/config/config.cf") -> 'JobEngine':
+        """Returns the engine of the process for the given configuration file, creating it on first use."""
+        with cls._shared_lock:
+            if config_file not in cls._shared:
+                cls._shared[config_file] = cls(client, config_file)
+            return cls._shared[config_file]
+
+    @classmethod
+    def close_shared(cls) -> None:
+        """Stops the pools of the shared engines: queued jobs are cancelled and running ones are left to finish in their processes."""
+        for engine in cls._shared.values():
+            if engine._pool is not None:
+                engine._pool.shutdown(wait=False, cancel_futures=True)
+
+        return
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # Worker processes are spawned, not forked from a multi-threaded server
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def submit(self, kind: str, path: str) -> dict:
+        """Queues a job.
+
+        Parameters
+        ----------
+        kind : str
+            Operation to run: 'index_corpus', 'delete_corpus', 'index_model' or 'delete_model'.
+        path : str
+            Path of the corpus or model on which the operation is run.
+
+        Returns
+        -------
+        job : dict
+            State of the job, including its id.
+        """
+        if kind not in KINDS:
+            raise ValueError(f"Unknown job kind {kind}")
+
+        job_id = self.log.create(kind, path)
+        future = self._executor().submit(
+            _run_job, job_id, kind, path, self.config_file, self.log.path,
+            self.max_workers)
+        with self._lock:
+            self._futures[job_id] = future
+        future.add_done_callback(lambda f: self._on_done(job_id, kind, path, f))
+
+        self.logger.info(f"-- -- Job {job_id} ({kind} {path}) submitted")
+
+        return self.log.get(job_id)
+
+    def _on_done(self, job_id: str, kind: str, path: str, future: Future) -> None:
+        with self._lock:
+            self._futures.pop(job_id, None)
+
+        if future.cancelled():
+            self.log.finish(job_id, CANCELLED)
+        elif future.exception() is not None:
+            # The worker process died (the job could not record its failure)
+            self.log.finish(job_id, FAILED, error=str(future.exception()))
+
+        # The job may have changed collections behind the caches of every process of the API (even if it failed), so they are told through the shared generation
+        self.client.generations.bump(COLLECTIONS)
+
+        return
+
+    def get(self, job_id: str) -> Union[dict, None]:
+        return self.log.get(job_id)
+
+    def list(self, limit: int = 50) -> List[dict]:
+        return self.log.list(limit)
+
+    def cancel(self, job_id: str) -> Union[dict, None]:
+        """Requests the cancellation of a job. Queued jobs do not start and running ones stop after the batch of documents they are indexing.
+
+        Returns
+        -------
+        job : dict
+            State of the job, or None if there is no such job.
+        """
+        job = self.log.get(job_id)
+        if job is None or job["status"] not in ACTIVE:
+            return job
+
+        self.log.request_cancel(job_id)
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None:
+            future.cancel()
+
+        return self.log.get(job_id)
@@ -0,0 +1,174 @@
+"""
+This module provides an in-process table with the topic metadata (id, label, coordinates, active documents, descriptions, etc.) of each model indexed in the EWB, so that topic label / id lookups and the topic map do not require requests to Solr.
+
+The table of a model is filled when the model is indexed or, otherwise, the first time the model is touched, cached for a configurable time, and discarded when the model is deleted. Models indexed or deleted by other processes (e.g., by a job) are noticed through a shared generation (see generations.py), whose changes discard all the tables. Tables are shared by all the clients in the process that point to the same Solr server.
+
+Author: Lorena Calvo-Bartolomé
+Date: 20/06/2023
+"""
+
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Union
+
+
+class ModelTopics(object):
+    """
+    A class to hold the topic metadata of a model, indexed by topic id and by topic label.
+    """
+
+    def __init__(self, topics: List[dict]) -> None:
+        """
+        Parameters
+        ----------
+        topics : List[dict]
+            Topic documents of the model collection.
+        """
+        self.topics = topics
+        self.by_id = {topic["id"]: topic for topic in topics}
+        self.by_label = {}
+        self._by_label_lower = {}
+        for topic in topics:
+            label = topic.get("tpc_labels")
+            if label is None:
+                continue
+            self.by_label.setdefault(label, topic["id"])
+            self._by_label_lower.setdefault(label.strip().lower(), topic["id"])
+
+        return
+
+    def id_of_label(self, label: str) -> Union[str, None]:
+        """Returns the id of the topic with the given label (case-insensitively if there is no exact match), or None if there is no such topic."""
+        topic_id = self.by_label.get(label)
+        if topic_id is None:
+            topic_id = self._by_label_lower.get(label.strip().lower())
+        return topic_id
+
+
+class TopicRegistry(object):
+    """
+    A class to cache the topic metadata of the models indexed in the EWB.
+    """
+
+    # Topic fields kept in memory (betas and vocab are left out on purpose)
+    FIELDS = ["id", "tpc_labels", "coords", "ndocs_active", "alphas",
+              "topic_entropy", "topic_coherence", "tpc_descriptions"]
+
+    # Registries shared within the process, by key
+    _shared: Dict[str, 'TopicRegistry'] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self,
+                 loader: Callable[[str], Union[List[dict], None]],
+                 ttl: float = 300,
+                 generation: Callable[[], int] = None,
+                 logger: logging.Logger = None) -> None:
+        """
+        Parameters
+        ----------
+        loader : Callable[[str], Union[List[dict], None]]
+            Function returning the topic documents (with the fields in FIELDS) of the given model collection, or None if they could not be retrieved.
+        ttl : float, defaults to 300
+            Time in seconds for which the table of a model is cached.
+        generation : Callable[[], int], defaults to None
+            Function returning the shared generation of the collections. The tables are discarded when it changes.
+        logger : logging.Logger
+            The logger object to log messages and errors.
+        """
+        self.loader = loader
+        self.ttl = ttl
+        self.generation = generation
+        self.logger = logger or logging.getLogger('Registry')
+
+        self._models: Dict[str, ModelTopics] = {}
+        self._loaded_at: Dict[str, float] = {}
+        self._generation = None
+        self._lock = threading.Lock()
+
+        return
+
+    @classmethod
+    def shared(cls,
+               key: str,
+               loader: Callable[[str], Union[List[dict], None]],
+               ttl: float = 300,
+               generation: Callable[[], int] = None,
+               logger: logging.Logger = None) -> 'TopicRegistry':
+        """Returns the registry of the process for the given key, creating it if it does not exist yet.
+
+        Parameters
+        ----------
+        key : str
+            Key identifying the Solr server.
+        loader, ttl, generation, logger
+            See __init__. Only used if the registry is created.
+        """
+        with cls._shared_lock:
+            if key not in cls._shared:
+                cls._shared[key] = cls(loader, ttl=ttl, generation=generation,
+                                       logger=logger)
+            return cls._shared[key]
+
+    def load(self,
+             model_name: str,
+             topics: List[dict] = None) -> Union[ModelTopics, None]:
+        """Fills the table of the given model, either with the given topics (e.g., when the model is being indexed) or with those retrieved by the loader.
+
+        Parameters
+        ----------
+        model_name : str
+            Name of the model collection.
+        topics : List[dict], defaults to None
+            Topic documents of the model. If None, they are retrieved with the loader.
+
+        Returns
+        -------
+        ModelTopics
+            The table of the model, or None if the topics could not be retrieved.
+        """
+        if topics is None:
+            topics = self.loader(model_name)
+            if topics is None:
+                self.logger.error(
+                    f"-- -- Topics of model {model_name} could not be loaded")
+                return None
+
+        table = ModelTopics([{field: topic[field] for field in self.FIELDS if field in topic}
+                             for topic in topics])
+        self._sync()
+        with self._lock:
+            self._models[model_name] = table
+            self._loaded_at[model_name] = time.monotonic()
+
+        return table
+
+    def _sync(self) -> None:
+        """Discards all the tables if the shared generation changed since they were loaded."""
+        if self.generation is None:
+            return
+        generation = self.generation()
+        if generation != self._generation:
+            with self._lock:
+                self._models.clear()
+                self._loaded_at.clear()
+                self._generation = generation
+        return
+
+    def invalidate(self, model_name: str) -> None:
+        """Discards the table of the given model."""
+        with self._lock:
+            self._models.pop(model_name, None)
+            self._loaded_at.pop(model_name, None)
+        return
+
+    def get(self, model_name: str) -> Union[ModelTopics, None]:
+        """Returns the table of the given model, loading it if needed (or if it has expired), or None if it could not be loaded."""
+        self._sync()
+        table = self._models.get(model_name)
+        if table is None:
+            table = self.load(model_name)
+        elif time.monotonic() - self._loaded_at.get(model_name, 0) >= self.ttl:
+            # The expired table is kept if the model cannot be reloaded
+            table = self.load(model_name) or table
+        return table
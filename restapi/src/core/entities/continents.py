@@ -0,0 +1,160 @@
+"""
+This module provides the country -> continent table used to derive, at indexing time, the continents of the affiliations of each document (field 'affiliation_continent'), so that filtering a collection by continent is a single-term query.
+
+Country names are resolved to ISO 3166-1 codes with pycountry (plus the aliases below for the names used by Scopus that pycountry does not know), and codes are mapped to continents. Any country can be (re)assigned in the [continents] section of the configuration file, e.g.:
+
+    [continents]
+    cyprus = europe,asia
+
+Author: Lorena Calvo-Bartolomé
+Date: 21/06/2023
+"""
+
+import configparser
+import logging
+from typing import Dict, List
+
+import pycountry
+
+# ISO 3166-1 alpha-2 codes of the countries of each continent. Countries
+# spanning two continents (e.g., Cyprus) are listed in both.
+CONTINENT_CODES = {
+    "europe": "AD AL AT AX BA BE BG BY CH CY CZ DE DK EE ES FI FO FR GB GG GI "
+              "GR HR HU IE IM IS IT JE LI LT LU LV MC MD ME MK MT NL NO PL PT "
+              "RO RS RU SE SI SJ SK SM UA VA XK",
+    "asia": "AE AF AM AZ BD BH BN BT CN CY GE HK ID IL IN IQ IR JO JP KG KH KP "
+            "KR KW KZ LA LB LK MM MN MO MV MY NP OM PH PK PS QA SA SG SY TH TJ "
+            "TL TM TR TW UZ VN YE",
+    "africa": "AO BF BI BJ BW CD CF CG CI CM CV DJ DZ EG EH ER ET GA GH GM GN "
+              "GQ GW KE KM LR LS LY MA MG ML MR MU MW MZ NA NE NG RE RW SC SD "
+              "SH SL SN SO SS ST SZ TD TG TN TZ UG YT ZA ZM ZW",
+    "north america": "AG AI AW BB BL BM BQ BS BZ CA CR CU CW DM DO GD GL GP "
+                     "GT HN HT JM KN KY LC MF MQ MS MX NI PA PM PR SV SX TC TT "
+                     "US VC VG VI",
+    "south america": "AR BO BR CL CO EC FK GF GY PE PY SR UY VE",
+    "oceania": "AS AU CK FJ FM GU KI MH MP NC NF NR NU NZ PF PG PN PW SB TK TO "
+               "TV VU WF WS",
+}
+
+# Country names (lowercase) used in the corpora that pycountry does not resolve
+COUNTRY_ALIASES = {
+    "bolivia": "BO",
+    "brunei": "BN",
+    "cape verde": "CV",
+    "cote d'ivoire": "CI",
+    "czech republic": "CZ",
+    "democratic republic congo": "CD",
+    "falkland islands (malvinas)": "FK",
+    "iran": "IR",
+    "kosovo": "XK",
+    "laos": "LA",
+    "libyan arab jamahiriya": "LY",
+    "macau": "MO",
+    "macedonia": "MK",
+    "moldova": "MD",
+    "north korea": "KP",
+    "palestine": "PS",
+    "russia": "RU",
+    "south korea": "KR",
+    "swaziland": "SZ",
+    "syria": "SY",
+    "taiwan": "TW",
+    "tanzania": "TZ",
+    "turkey": "TR",
+    "venezuela": "VE",
+    "vietnam": "VN",
+}
+
+
+class ContinentTable(object):
+    """
+    A class to map country names to the continents they belong to.
+    """
+
+    def __init__(self,
+                 overrides: Dict[str, List[str]] = None,
+                 logger: logging.Logger = None) -> None:
+        """
+        Parameters
+        ----------
+        overrides : Dict[str, List[str]]
+            Continents of the given countries (by name, case insensitive), taking precedence over the default table.
+        logger : logging.Logger
+            The logger object to log messages and errors.
+        """
+        self.logger = logger or logging.getLogger('Continents')
+
+        self._by_code: Dict[str, List[str]] = {}
+        for continent, codes in CONTINENT_CODES.items():
+            for code in codes.split():
+                self._by_code.setdefault(code, []).append(continent)
+
+        # Resolved names (lowercase) -> continents
+        self._cache: Dict[str, List[str]] = {
+            name.strip().lower(): list(continents)
+            for name, continents in (overrides or {}).items()}
+
+        return
+
+    @classmethod
+    def from_config(cls,
+                    config_file: str = "/config/config.cf",
+                    logger: logging.Logger = None) -> 'ContinentTable':
+        """Creates the table with the overrides in the [continents] section of the configuration file, if any."""
+        cf = configparser.ConfigParser()
+        cf.read(config_file)
+        overrides = {}
+        if "continents" in cf.sections():
+            overrides = {country: [continent.strip().lower() for continent in value.split(",") if continent.strip()]
+                         for country, value in cf.items("continents")}
+
+        return cls(overrides=overrides, logger=logger)
+
+    def _resolve_code(self, name: str) -> str:
+        code = COUNTRY_ALIASES.get(name)
+        if code is not None:
+            return code
+        try:
+            return pycountry.countries.lookup(name).alpha_2
+        except LookupError:
+            return None
+
+    def continents_of(self, country: str) -> List[str]:
+        """Returns the continents of the given country, or an empty list if the country is unknown.
+
+        Parameters
+        ----------
+        country : str
+            Name of the country (e.g., 'Spain', 'Viet Nam') or its ISO 3166-1 code.
+        """
+        name = country.strip().lower()
+        continents = self._cache.get(name)
+        if continents is None:
+            code = self._resolve_code(name) if name else None
+            continents = self._by_code.get(code, []) if code else []
+            if name and not continents:
+                self.logger.warning(
+                    f"-- -- Continent of country '{country}' not found")
+            self._cache[name] = continents
+
+        return continents
+
+    def continents_of_countries(self, countries: str, sep: str = ";") -> List[str]:
+        """Returns the (unique) continents of the countries in a delimited string, as stored in 'affiliation_country'.
+
+        Parameters
+        ----------
+        countries : str
+            Country names separated by sep.
+        sep : str, defaults to ';'
+            Delimiter of the country names.
+        """
+        if not isinstance(countries, str) or not countries:
+            return []
+        continents = []
+        for country in countries.split(sep):
+            for continent in self.continents_of(country):
+                if continent not in continents:
+                    continents.append(continent)
+
+        return continents
@@ -1,18 +1,97 @@
 """
 This module is a class implementation to manage and hold all the information associated with a logical corpus.
 
+The documents of the corpus are read and transformed one parquet row group at a time (see Corpus.iter_doc_batches), in a pool of processes that keeps a bounded number of row groups in flight, so that corpora larger than the available memory can be indexed with flat memory usage.
+
 Author: Lorena Calvo-Bartolomé
 Date: 27/03/2023
 """
 
 import configparser
 import json
-from typing import List
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Tuple
+
+import pandas as pd
+import pyarrow.dataset as pads
+import pyarrow.parquet as pq
+from src.core.entities.continents import ContinentTable
+from src.core.entities.utils import (clean_xml_strings,
+                                     convert_datetime_to_instant)
+
+# Settings of the transformation of the row groups, in the worker processes
+_settings = None
+
+
+def _init_worker(settings: dict) -> None:
+    global _settings
+    _settings = settings
+
 
-import dask.dataframe as dd
-from dask.diagnostics import ProgressBar
-from src.core.entities.utils import (convert_datetime_to_strftime,
-                                     parseTimeINSTANT)
+def _process_row_group(unit: Tuple[str, int]) -> Tuple[List[str], List[Tuple[int, bytes]]]:
+    """Reads a row group of a parquet file and transforms its documents into the format in which they are indexed (see Corpus.iter_doc_batches).
+
+    Parameters
+    ----------
+    unit : Tuple[str, int]
+        Path of the parquet file and index of the row group.
+
+    Returns
+    -------
+    fields : List[str]
+        Fields of the documents.
+    batches : List[Tuple[int, bytes]]
+        Batches of documents, as the number of documents and the documents serialized as a JSON array.
+    """
+    path, row_group = unit
+    df = pq.ParquetFile(path).read_row_group(row_group).to_pandas().fillna("")
+
+    # Remove the characters that are not allowed in XML from the text fields
+    for col in df.select_dtypes(include=["object", "string"]).columns:
+        df[col] = clean_xml_strings(df[col])
+
+    # Concatenate text fields
+    for idx2, col in enumerate(_settings["lemmasfld"]):
+        if idx2 == 0:
+            df["all_lemmas"] = df[col]
+        else:
+            df["all_lemmas"] += " " + df[col]
+
+    # Rename id-field to id, title-field to title and date-field to date
+    df = df.rename(
+        columns={_settings["idfld"]: "id",
+                 _settings["title_field"]: "title",
+                 _settings["date_field"]: "date"})
+
+    df["nwords_per_doc"] = df["all_lemmas"].str.split().str.len()
+
+    # Derive the continents of the affiliations (multi-valued), so that filtering by continent is a single-term query. Each distinct value of the country field is only resolved once.
+    country_field = _settings["country_field"]
+    if country_field in df.columns:
+        continents = {countries: _settings["continents"].continents_of_countries(countries)
+                      for countries in df[country_field].unique()}
+        df["affiliation_continent"] = df[country_field].map(continents)
+
+    # Publication year and month as integers (docValues in Solr), so that filtering and aggregating by year do not require parsing dates
+    if "date" in df.columns:
+        dates = df["date"] if df["date"].dtype == "datetime64[ns]" \
+            else pd.to_datetime(df["date"], errors="coerce", utc=True)
+        df["year"] = dates.dt.year.astype("Int64")
+        df["month"] = dates.dt.month.astype("Int64")
+
+    fields = df.columns.tolist()
+    # Convert dates information to the format required by Solr ( ISO_INSTANT, The ISO instant formatter that formats or parses an instant in UTC, such as '2011-12-03T10:15:30Z')
+    df, _ = convert_datetime_to_instant(df)
+
+    batch_size = _settings["batch_size"]
+    batches = [(len(batch), batch.to_json(orient='records').encode("utf-8"))
+               for batch in (df.iloc[i:i + batch_size]
+                             for i in range(0, len(df), batch_size))]
+
+    return fields, batches
 
 
 class Corpus(object):
@@ -48,6 +127,8 @@ class Corpus(object):
 
         self.name = path_to_logical.stem.lower()
         self.fields = None
+        # Number of documents of the corpus (known once its files are listed)
+        self.num_docs = None
 
         # Read configuration from config file
         cf = configparser.ConfigParser()
@@ -62,57 +143,107 @@ class Corpus(object):
                 f"Logical corpus configuration {self.name} not found in config file.")
         self.title_field = cf.get(section, "title_field")
         self.date_field = cf.get(section, "date_field")
-        
+        # Field with the ';'-separated countries of the affiliations, from which the continents are derived
+        self.country_field = cf.get(
+            section, "country_field", fallback="affiliation_country")
+        self._continents = ContinentTable.from_config(
+            config_file, logger=self._logger)
+
+        # Processes transforming the row groups (0 = the cores shared among the jobs that may run at the same time) and row groups in flight
+        self.ingest_workers = cf.getint(
+            'restapi', 'ingest_workers', fallback=0) or \
+            max((os.cpu_count() or 1) // max(cf.getint('jobs', 'workers', fallback=2), 1), 1)
+        self.ingest_window = max(cf.getint(
+            'restapi', 'ingest_window', fallback=2 * self.ingest_workers), 1)
+
         return
 
-    def get_docs_raw_info(self) -> List[dict]:
-        """Extracts the information contained in the parquet file associated to the logical corpus and transforms into a list of dictionaries.
+    def _row_groups(self, path: str) -> List[Tuple[str, int]]:
+        """Lists the row groups of the parquet files of a dataset (a file or a folder of files), setting the number of documents of the corpus."""
+        units = []
+        self.num_docs = 0
+        for file in pads.dataset(path, format="parquet").files:
+            metadata = pq.ParquetFile(file).metadata
+            units += [(file, i) for i in range(metadata.num_row_groups)]
+            self.num_docs += metadata.num_rows
+        return units
 
-        Returns:
-        --------
-        json_lst: list[dict]
-            A list of dictionaries containing information about the corpus.
+    def iter_doc_batches(self, batch_size: int = 100) -> Iterator[Tuple[int, bytes]]:
+        """Yields the documents of the parquet files associated to the logical corpus in batches ready to be indexed in Solr, reading and transforming them one row group at a time.
+
+        Row groups are transformed in parallel by self.ingest_workers processes, with at most self.ingest_window row groups in flight, and yielded in order. The fields of the documents are available in self.fields once the first batch has been yielded.
+
+        Parameters
+        ----------
+        batch_size : int, defaults to 100
+            Maximum number of documents of each batch.
+
+        Yields
+        ------
+        batch : Tuple[int, bytes]
+            Number of documents of the batch and the documents serialized as a JSON array.
         """
         if len(self._logical_corpus['Dtsets']) > 1:
             self._logger.error(
                 f"Only models coming from a logical corpus associated with one raw dataset can be processed.")
             return
-        else:
-            DtSet = self._logical_corpus['Dtsets'][0]
-            ddf = dd.read_parquet(DtSet['parquet']).fillna("")
-            idfld = DtSet["idfld"]
-
-            # Concatenate text fields
-            for idx2, col in enumerate(DtSet['lemmasfld']):
-                if idx2 == 0:
-                    ddf["all_lemmas"] = ddf[col]
-                else:
-                    ddf["all_lemmas"] += " " + ddf[col]
-
-            # Rename id-field to id, title-field to title and date-field to date
-            ddf = ddf.rename(
-                columns={idfld: "id",
-                         self.title_field: "title",
-                         self.date_field: "date"})
-
-        with ProgressBar():
-            df = ddf.compute(scheduler='processes')
-
-        df["nwords_per_doc"] = df["all_lemmas"].apply(lambda x: len(x.split()))
-
-        # Save corpus fields
-        self.fields = df.columns.tolist()
-        # Convert dates information to the format required by Solr ( ISO_INSTANT, The ISO instant formatter that formats or parses an instant in UTC, such as '2011-12-03T10:15:30Z')
-        df, cols = convert_datetime_to_strftime(df)
-        df[cols] = df[cols].applymap(parseTimeINSTANT)
 
+        DtSet = self._logical_corpus['Dtsets'][0]
+        units = self._row_groups(DtSet['parquet'])
+        settings = {"lemmasfld": DtSet['lemmasfld'],
+                    "idfld": DtSet["idfld"],
+                    "title_field": self.title_field,
+                    "date_field": self.date_field,
+                    "country_field": self.country_field,
+                    "continents": self._continents,
+                    "batch_size": batch_size}
         self._logger.info(
-                f"df columns: {df.columns}")
-        
-        json_str = df.to_json(orient='records')
-        json_lst = json.loads(json_str)
+            f"-- -- Processing {self.num_docs} documents in {len(units)} row groups")
+
+        for fields, batches in self._map_row_groups(units, settings):
+            if self.fields is None:
+                self.fields = fields
+                self._logger.info(f"df columns: {fields}")
+            yield from batches
 
-        return json_lst
+    def _map_row_groups(self, units: List[Tuple[str, int]], settings: dict):
+        """Transforms the row groups in order, keeping at most self.ingest_window of them in flight."""
+        workers = min(self.ingest_workers, len(units))
+        if workers <= 1:
+            _init_worker(settings)
+            for unit in units:
+                yield _process_row_group(unit)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker,
+                                 initargs=(settings,)) as executor:
+            pending = deque()
+            try:
+                for unit in units:
+                    pending.append(executor.submit(_process_row_group, unit))
+                    if len(pending) >= self.ingest_window:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                # If the consumer stops early (e.g., the job is cancelled), the row groups not started are dropped
+                for future in pending:
+                    future.cancel()
+
+    def get_docs_raw_info(self) -> List[dict]:
+        """Extracts the information contained in the parquet file associated to the logical corpus and transforms into a list of dictionaries.
+
+        Note that the whole corpus is held in memory; use iter_doc_batches to index large corpora.
+
+        Returns:
+        --------
+        json_lst: list[dict]
+            A list of dictionaries containing information about the corpus.
+        """
+        return [doc for _, batch in self.iter_doc_batches(batch_size=10000)
+                for doc in json.loads(batch)]
 
     def get_corpora_update(self, id: int) -> List[dict]:
 
@@ -0,0 +1,171 @@
+"""
+This module provides the encoders used to write streams of Solr documents as CSV, NDJSON or Parquet files.
+
+Each encoder consumes an iterator of documents and yields the encoded file in chunks of roughly the same size, so that a result set can be written to a (chunked) HTTP response as it is read from Solr, without holding it in memory.
+
+Author: Lorena Calvo-Bartolomé
+Date: 26/06/2023
+"""
+
+import csv
+import io
+from typing import Iterable, Iterator, List
+
+try:
+    from orjson import dumps as json_dumps
+except ImportError:
+    import json
+
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+# Export format -> (MIME type, file extension)
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+# Solr field type -> Arrow type name (other types, e.g. dates, are exported as strings)
+_ARROW_TYPES = {
+    "pint": "int32", "pints": "int32",
+    "plong": "int64", "plongs": "int64",
+    "pfloat": "float32", "pfloats": "float32",
+    "pdouble": "float64", "pdoubles": "float64",
+    "boolean": "bool_", "booleans": "bool_",
+}
+
+
+class Column(object):
+    """
+    A class to describe an exported field, as defined in the schema of the collection.
+    """
+
+    def __init__(self, name: str, type: str = "string", multi_valued: bool = False) -> None:
+        """
+        Parameters
+        ----------
+        name : str
+            Name of the field.
+        type : str
+            Name of the Solr field type (e.g., 'pint').
+        multi_valued : bool
+            Whether the field is multi-valued.
+        """
+        self.name = name
+        self.type = type
+        self.multi_valued = multi_valued
+
+        return
+
+    @classmethod
+    def from_schema_field(cls, field: dict) -> 'Column':
+        return cls(field["name"], field.get("type", "string"),
+                   bool(field.get("multiValued", False)))
+
+
+def _batched(docs: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def encode_ndjson(docs: Iterable[dict],
+                  columns: List[Column],
+                  chunk_bytes: int = 1 << 16) -> Iterator[bytes]:
+    """Encodes the documents as newline-delimited JSON, one document per line."""
+    names = [column.name for column in columns]
+    buffer = bytearray()
+    for doc in docs:
+        buffer += json_dumps({name: doc[name]
+                             for name in names if name in doc})
+        buffer += b"\n"
+        if len(buffer) >= chunk_bytes:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def encode_csv(docs: Iterable[dict],
+               columns: List[Column],
+               chunk_bytes: int = 1 << 16,
+               sep: str = ";") -> Iterator[bytes]:
+    """Encodes the documents as CSV, with a header row. Values of multi-valued fields are joined with 'sep'."""
+    names = [column.name for column in columns]
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(names)
+    for doc in docs:
+        row = []
+        for name in names:
+            value = doc.get(name)
+            if isinstance(value, list):
+                value = sep.join(str(item) for item in value)
+            row.append(value)
+        writer.writerow(row)
+        if out.tell() >= chunk_bytes:
+            yield out.getvalue().encode("utf-8")
+            out.seek(0)
+            out.truncate()
+    if out.tell():
+        yield out.getvalue().encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """A write-only file whose content is handed over (and released) chunk by chunk."""
+
+    def __init__(self) -> None:
+        self._chunks = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def encode_parquet(docs: Iterable[dict],
+                   columns: List[Column],
+                   row_group_size: int = 10000) -> Iterator[bytes]:
+    """Encodes the documents as a Parquet file, written one row group at a time. The schema of the file is derived from the Solr field types."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    fields = []
+    for column in columns:
+        arrow_type = getattr(pa, _ARROW_TYPES.get(column.type, "string"))()
+        if column.multi_valued:
+            arrow_type = pa.list_(arrow_type)
+        fields.append(pa.field(column.name, arrow_type))
+    schema = pa.schema(fields)
+
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for batch in _batched(docs, row_group_size):
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            yield sink.take()
+    yield sink.take()
+
+
+ENCODERS = {
+    "csv": encode_csv,
+    "ndjson": encode_ndjson,
+    "parquet": encode_parquet,
+}
@@ -24,6 +24,45 @@ from src.core.entities.tm_model import TMmodel
 from src.core.entities.utils import sum_up_to
 
 
+def read_corpus_ids(path_to_model: pathlib.Path, logger=None) -> List:
+    """Reads the ids of the documents of the training corpus of a model, in the order of the rows of its document-topic (and similarity) matrices.
+
+    Parameters
+    ----------
+    path_to_model: pathlib.Path
+        Path to the model folder.
+    logger : logging.Logger
+        The logger object to log messages and errors.
+
+    Returns
+    -------
+    ids_corpus: List
+        Ids of the documents of the training corpus, or None if the trainer of the model is not supported.
+    """
+
+    with path_to_model.joinpath("trainconfig.json").open('r', encoding='utf8') as fin:
+        trainer = json.load(fin)["trainer"].lower()
+
+    if trainer == "mallet":
+        def process_line(line):
+            id_ = line.rsplit(' 0 ')[0].strip()
+            id_ = int(id_.strip('"').split('-')[-1])
+            return id_
+        with open(path_to_model.joinpath("corpus.txt"), encoding="utf-8") as file:
+            ids_corpus = [process_line(line) for line in file]
+    elif trainer == "prodlda" or trainer == "ctm":
+        ddf = dd.read_parquet(path_to_model.joinpath("corpus.parquet"))
+        with ProgressBar():
+            ids_corpus = ddf["id"].compute(scheduler='processes')
+    else:
+        ids_corpus = None
+        if logger:
+            logger.error(
+                '-- -- The trainer used to train the model is not supported.')
+
+    return ids_corpus
+
+
 class Model(object):
     """
     A class to manage and hold all the information associated with a TMmodel so it can be indexed in Solr.
@@ -201,22 +240,7 @@ class Model(object):
         model_key = 'doctpc_' + self.name
 
         # Get ids of documents kept in the tr corpus
-        if tr_config["trainer"].lower() == "mallet":
-            def process_line(line):
-                id_ = line.rsplit(' 0 ')[0].strip()
-                id_ = int(id_.strip('"').split('-')[-1])
-                return id_
-            with open(self.path_to_model.joinpath("corpus.txt"), encoding="utf-8") as file:
-                ids_corpus = [process_line(line) for line in file]
-        elif tr_config["trainer"].lower() == "prodlda" or \
-                tr_config["trainer"].lower() == "ctm":
-            ddf = dd.read_parquet(
-                self.path_to_model.joinpath("corpus.parquet"))
-            with ProgressBar():
-                ids_corpus = ddf["id"].compute(scheduler='processes')
-        else:
-            self._logger.error(
-                '-- -- The trainer used to train the model is not supported.')
+        ids_corpus = read_corpus_ids(self.path_to_model, logger=self._logger)
 
         # Actual topic model's information only needs to be retrieved if action is "set"
         if action == "set":
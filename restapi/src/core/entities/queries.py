@@ -1,11 +1,15 @@
 """
 This module defines a class with the EWB-specific queries used to interact with Solr.
 
+Queries are described declaratively (see query_planner.QuerySpec): the values given by the user end up in constant-score filter queries, and the planner builds the Solr requests from the specs.
 
 Author: Lorena Calvo-Bartolomé
 Date: 19/04/2023
 """
 
+from src.core.entities.query_planner import (FRANGE, PHRASE, RANGE, Filter,
+                                             QueryPlanner, QuerySpec)
+
 
 class Queries(object):
 
@@ -16,11 +20,8 @@ class Queries(object):
         # ##################################################################
         # # Get collection filter by Open Access or Subscription
         # ================================================================
-        self.Q1 = {
-            'q': 'openaccess:{}',
-            'start': '{}',
-            'rows': '{}'
-        }
+        self.Q1 = QuerySpec(
+            'Q1', filters=[Filter('openaccess', 'open_access')])
 
         # ================================================================
         # # Q2: getCorpusMetadataFields  
@@ -30,10 +31,10 @@ class Queries(object):
         # the same metadata available)
         # http://localhost:8983/solr/#/Corpora/query?q=corpus_name:Cordis&q.op=OR&indent=true&fl=fields&useParams=
         # ================================================================
-        self.Q2 = {
-            'q': 'corpus_name:{}',
-            'fl': 'fields',
-        }
+        self.Q2 = QuerySpec(
+            'Q2', collection='any',
+            filters=[Filter('corpus_name', 'corpus_name', kind=PHRASE)],
+            fl='fields', rows=1)
 
         # ================================================================
         # # Q3: getNrDocsColl 
@@ -41,62 +42,49 @@ class Queries(object):
         # # Get number of documents in a collection
         # http://localhost:8983/solr/{col}/select?q=*:*&wt=json&rows=0
         # ================================================================
-        self.Q3 = {
-            'q': '*:*',
-            'rows': '0',
-        }
+        self.Q3 = QuerySpec('Q3', collection='any', rows=0)
 
         # ================================================================
         # # Q4: getDocsByYear 
         # ##################################################################
         # # Get collection filter by year
         # ================================================================
-        self.Q4 = {
-            'q': "date:[{}-01-01T00:00:00Z TO {}-12-31T23:59:59Z]",
-            'start': '{}',
-            'rows': '{}'
-        }
+        self.Q4 = QuerySpec('Q4', filters=[Filter('year', 'year')])
 
         # ================================================================
         # # Q5: getDocsByContinent
         # ################################################################
-        # # Get collection filter by continent.
-        # # They are customize below.
+        # # Get collection filter by continent ('affiliation_continent' is
+        # # derived from the affiliation countries at indexing time)
         # ================================================================
+        self.Q5 = QuerySpec(
+            'Q5', filters=[Filter('affiliation_continent', 'continent')])
 
         # ================================================================
         # # Q6: getDocsByCity
         # ################################################################
         # # Get collection filter by affiliation city
         # ================================================================
-        self.Q6 = {
-            'q': 'affiliation_city:\"{}\"',
-            'start': '{}',
-            'rows': '{}'
-        }
+        self.Q6 = QuerySpec(
+            'Q6', filters=[Filter('affiliation_city', 'city', kind=PHRASE, cache=False)])
 
         # ================================================================
         # # Q7: getDocsByInstitution
         # ################################################################
         # # Get collection filter by affiliation name
         # ================================================================
-        self.Q7 = {
-            'q': 'affilname:\"{}\"',
-            'start': '{}',
-            'rows': '{}'
-        }
+        self.Q7 = QuerySpec(
+            'Q7', filters=[Filter('affilname', 'institution', kind=PHRASE, cache=False)])
 
         # ================================================================
         # # Q9: getIdOfTopicLabel
         # ################################################################
         # # Get the Id of a given topic label
         # ================================================================
-        self.Q9 = {
-            'q': 'tpc_labels:\"{}\"',
-            'fl': 'id',
-            'start': '0',
-            'rows': '1'
-        }
+        self.Q9 = QuerySpec(
+            'Q9', collection='model',
+            filters=[Filter('tpc_labels', 'topic_label', kind=PHRASE, cache=False)],
+            fl='id', rows=1)
 
         # ================================================================
         # # Q10: getModelInfo
@@ -104,397 +92,124 @@ class Queries(object):
         # # Get the information (chemical description, label, statistics,
         # top docs, etc.) associated to each topic in a model collection
         # ================================================================
-        self.Q10 = {
-            'q': 'doctpc_{}:*{}*',
-            'start': '{}',
-            'rows': '{}'
-        }
+        # The topic is matched as an exact term of the doc-topic field (a
+        # wildcard would scan the term dictionary and match 't1' against
+        # 't10'-'t19'), and the documents are ranked by the topic weight
+        # stored in the term payload (field and term are quoted because
+        # model names may contain '-'). The minimum weight is checked as
+        # a post-filter, only on the documents that contain the topic
+        self.Q10 = QuerySpec(
+            'Q10',
+            filters=[Filter('doctpc_{model_col}', 'topic_id'),
+                     Filter('payload("doctpc_{model_col}","{topic_id}")', 'min_weight',
+                            kind=FRANGE, cache=False, cost=200)],
+            fl='*,topic_weight:payload("doctpc_{model_col}","{topic_id}")',
+            sort='payload("doctpc_{model_col}","{topic_id}") desc')
 
         # ================================================================
         # # Q12: getDocsByCitedCount
         # ################################################################
         # # Get collection filter by number of cited count
         # ================================================================
-        self.Q12 = {
-            'q': "citedby_count:[{} TO {}]",
-            'start': '{}',
-            'rows': '{}'
-        }
+        self.Q12 = QuerySpec(
+            'Q12', filters=[Filter('citedby_count', ('lower_limit', 'upper_limit'),
+                                   kind=RANGE, cache=False)])
 
         # ================================================================
         # # Q13: getDocsByFundSponsor
         # ################################################################
         # # Get collection filter by funding sponsor
         # ================================================================
-        self.Q13 = {
-            'q': 'fund_sponsor:\"{}\"',
-            'start': '{}',
-            'rows': '{}'
-        }
+        self.Q13 = QuerySpec(
+            'Q13', filters=[Filter('fund_sponsor', 'fund_sponsor', kind=PHRASE, cache=False)])
 
         # ================================================================
         # # Q14: getTopicMap
         # ################################################################
         # # Get data to create the Topic Map
         # ================================================================
-        self.Q14 = {
-            'q': '*:*',
-            'fl': 'ndocs_active, coords, tpc_labels',
-            'start': '{}',
-            'rows': '{}'
-        }
-
-
-
-    def customize_Q1(self,
-                     open_access: str,
-                     start: str,
-                     rows: str) -> dict:
-        """Customizes query Q1 'getOpenAccess'.
-
-        Parameters
-        ----------
-        open_access: str
-            Number to filter the collection by open access or subscription.
-        start: str
-            Start value.
-        rows: str
-            Number of rows to retrieve.
-
-        Returns
-        -------
-        custom_q1: dict
-            Customized query Q1.
-        """
-
-        custom_q1 = {
-            'q': self.Q1['q'].format(open_access),
-            'start': self.Q1['start'].format(start),
-            'rows': self.Q1['rows'].format(rows),
-        }
-        return custom_q1
-
-    def customize_Q2(self,
-                     corpus_name: str) -> dict:
-        """Customizes query Q2 'getCorpusMetadataFields'
-
-        Parameters
-        ----------
-        corpus_name: str
-            Name of the corpus collection whose metadata fields are to be retrieved.
-
-        Returns
-        -------
-        custom_q2: dict
-            Customized query Q2.
-        """
-
-        custom_q2 = {
-            'q': self.Q2['q'].format(corpus_name),
-            'fl': self.Q2['fl'],
-        }
-
-        return custom_q2
-
-    def customize_Q3(self) -> dict:
-        """Customizes query Q3 'getNrDocsColl'
-
-        Returns
-        -------
-        self.Q3: dict
-            The query Q3 (no customization is needed).
-        """
+        self.Q14 = QuerySpec(
+            'Q14', collection='model', fl='ndocs_active,coords,tpc_labels')
 
-        return self.Q3
-
-    def customize_Q4(self,
-                     year: str,
-                     start: str,
-                     rows: str) -> dict:
-        """Customizes query Q4 'getDocsByYear'
-
-        Parameters
-        ----------
-        year: str
-            Publication year to filter by
-        start: str
-            Start value.
-        rows: str
-            Number of rows to retrieve.
-
-        Returns
-        -------
-        custom_q4: dict
-            Customized query Q4.
-        """
-
-        custom_q4 = {
-            'q': self.Q4['q'].format(year,year),
-            'start': self.Q4['start'].format(start),
-            'rows': self.Q4['rows'].format(rows),
-        }
-        return custom_q4
-
-    def customize_Q5(self,
-                     continent: str,
-                     start: str,
-                     rows: str) -> dict:
-        """Customizes query Q5 'getDocsByContinent'
-
-        Parameters
-        ----------
-        continent: str
-            Continent by which to filter the document collection
-        start: str
-            Start value.
-        rows: str
-            Number of rows to retrieve.
-
-        Returns
-        -------
-        custom_q5: dict
-            Customized query Q5.
-        """
-        if continent == "europe":
-            Q5_europe = {
-                'q': 'affiliation_country:(Italy OR \"United Kingdom\" OR Germany OR France OR Netherlands OR Portugal OR Switzerland OR Belgium OR Sweden OR Denmark OR Poland OR \"Russian Federation\" OR Austria OR Greece OR Norway OR Finland OR \"Czech Republic\" OR Ireland OR Slovenia OR Croatia OR Serbia OR Estonia OR Lithuania OR Cyprus OR Hungary OR Slovakia OR Bulgaria OR Latvia OR Romania OR Malta OR Luxembourg OR Iceland OR Belarus OR Ukraine OR \"Bosnia and Herzegovina\" OR Moldova OR Albania OR \"North Macedonia\")',
-                'start': start,
-                'rows': rows,
-            }
-            return Q5_europe
-        elif continent == "asia":
-            Q5_asia = {
-                'q': 'affiliation_country:(China OR Japan OR India OR \"South Korea\" OR Israel OR Iran OR Turkey OR \"Saudi Arabia\" OR \"United Arab Emirates\" OR Taiwan OR Pakistan OR Singapore OR \"Hong Kong\" OR Thailand OR Malaysia OR \"Viet Nam\" OR Lebanon OR Qatar OR Bangladesh OR Armenia OR Jordan OR Georgia OR Philippines OR Kazakhstan OR Iraq OR Afghanistan OR Kyrgyzstan OR Tajikistan OR \"Brunei Darussalam\" OR Myanmar OR Laos OR Indonesia OR Cambodia OR Singapore OR Yemen OR Oman OR \"Syrian Arab Republic\" OR Azerbaijan OR Turkmenistan OR Uzbekistan OR \"Sri Lanka\" OR Mongolia OR Nepal OR Bhutan OR Kuwait OR Cyprus)',
-                'start': start,
-                'rows': rows,
-            }
-            return Q5_asia
-        elif continent == "africa":
-            Q5_africa = {
-                'q': 'affiliation_country:(\"South Africa\" OR Morocco OR Egypt OR Nigeria OR Algeria OR Tunisia OR Ethiopia OR Kenya OR Ghana OR Namibia OR Sudan OR \"Libyan Arab Jamahiriya\" OR Mauritania OR Mozambique OR Zimbabwe OR Mali OR Angola OR Gambia OR Togo OR Senegal OR Cameroon OR Mauritius OR Congo OR Zambia OR Uganda OR Botswana OR Gabon OR Rwanda OR Madagascar OR Niger OR Malawi OR \"Burkina Faso\" OR \"Cape Verde\" OR Guinea OR \"Cote d\'Ivoire\" OR Benin OR Chad OR \"Guinea-Bissau\" OR \"Sierra Leone\" OR Zimbabwe OR Burundi OR Liberia OR \"Central African Republic\" OR Djibouti OR \"Equatorial Guinea\" OR \"Democratic Republic Congo\" OR Tanzania)',
-                'start': start,
-                'rows': rows,
-            }
-            return Q5_africa
-        elif continent == "north america":
-            Q5_north_america = {
-                'q': 'affiliation_country:(\"United States\" OR Canada OR Mexico OR Guatemala OR Haiti OR Honduras OR \"El Salvador\" OR Nicaragua OR \"Costa Rica\" OR Panama OR Cuba OR \"Dominican Republic\" OR Jamaica OR \"Puerto Rico\" OR Bahamas OR Greenland OR \"Trinidad and Tobago\")',
-                'start': start,
-                'rows': rows,
-            }
-            return Q5_north_america
-        elif continent == "south america":
-            Q5_south_america = {
-                'q': 'affilcountry:(Brazil OR Chile OR Argentina OR Colombia OR Ecuador OR Peru OR Venezuela OR Uruguay OR Paraguay OR Bolivia OR Guyana OR Suriname OR \"Falkland Islands (Malvinas)\")',
-                'start': start,
-                'rows': rows,
-            }            
-            return Q5_south_america
-        elif continent == 'world':
-            Q5_world = {
-                'q': "*:*",
-                'start': start,
-                'rows': rows,
-            }
-            return Q5_world
-        else:
-            return
-        
-
-    def customize_Q6(self,
-                     city: str,
-                     start: str,
-                     rows: str) -> dict:
-        """Customizes query Q6 'getDocsByCity'
-
-
-        Parameters
-        ----------
-        city: str
-            City by which to filter the document collection.
-        start: str
-            Start value.
-        rows: str
-            Number of rows to retrieve.
-
-
-        Returns
-        -------
-        custom_q6: dict
-            Customized query Q6.
-        """
-
-        custom_q6 = {
-            'q': self.Q6['q'].format(city),
-            'start': self.Q6['start'].format(start),
-            'rows': self.Q6['rows'].format(rows),
-        }
-        return custom_q6
-
-    def customize_Q7(self,
-                     institution: str,
-                     start: str,
-                     rows: str) -> dict:
-        """Customizes query Q7 'getDocsByInstitution'
-
-        Parameters
-        ----------
-        institution: str
-            Institution by which to filter the document collection.
-        start: str
-            Start value.
-        rows: str
-            Number of rows to retrieve.
-
-        Returns
-        -------
-        custom_q7: dict
-            Customized query Q7.
-        """
-
-        custom_q7 = {
-            'q': self.Q7['q'].format(institution),
-            'start': self.Q7['start'].format(start),
-            'rows': self.Q7['rows'].format(rows),
-        }
-        return custom_q7
-
-    def customize_Q9(self,
-                     topic_label: str) -> dict:
-        """Customizes query Q9 'getIdOfTopicLabel'
-
-        Parameters
-        ----------
-        topic_label: str
-            Topic label.
-
-        Returns
-        -------
-        custom_q9: dict
-            Customized query Q9.
-        """
-
-        custom_q9 = {
-            'q': self.Q9['q'].format(topic_label),
-            'fl': self.Q9['fl'],
-            'start': self.Q9['start'],
-            'rows': self.Q9['rows'],
-        }
-        
-        return custom_q9
-
-    def customize_Q10(self,
-                      model_col: str,
-                      topic_id: str,
-                      start: str,
-                      rows: str) -> dict:
-        """Customizes query Q10 'getDocsByTopicLabel'
-
-        Parameters
-        ----------
-        start: str
-            Start value.
-        rows: str
-
-        Returns
-        -------
-        custom_q10: dict
-            Customized query Q10.
-        """
-
-        custom_q10 = {
-            'q': self.Q10['q'].format(model_col,topic_id),
-            'start': self.Q10['start'].format(start),
-            'rows': self.Q10['rows'].format(rows),
-        }
-
-        return custom_q10
-
-    def customize_Q12(self,
-                      lower_limit: str,
-                      upper_limit: str,
-                      start: str,
-                      rows: str) -> dict:
-        """Customizes query Q12 'getMostCorrelatedTopics'
-
-        Parameters
-        ----------
-        lower_limit: str
-            Lower limit to filter by number of citations
-        upper_limit: str
-            Upper limit to filter by number of citations
-        start: str
-            Start value.
-        rows: str
-            Number of rows to retrieve.
-
-        Returns
-        -------
-        custom_q12: dict
-            Customized query q12.
-        """
-
-        custom_q12 = {
-            'q': self.Q12['q'].format(lower_limit, upper_limit),
-            'start': self.Q12['start'].format(start),
-            'rows': self.Q12['rows'].format(rows),
-        }
-        return custom_q12
-
-    def customize_Q13(self,
-                      fund_sponsor: str,
-                      start: str,
-                      rows: str) -> dict:
-        
-        """Customizes query Q13 'getDocsByFundSponsor'
-
-        Parameters
-        ----------
-        fund_sponsor: str
-            Funding Sponsor by which to filter the document collection
-        start: str
-            Start value.
-        rows: str
-            Number of rows to retrieve.
+        # ================================================================
+        # # Q15: getNrDocsByYear
+        # ################################################################
+        # # Get the number of documents per publication year (facet on
+        # # the docValues of 'year')
+        # ================================================================
+        self.Q15 = QuerySpec(
+            'Q15', rows=0,
+            facets={'year': {'limit': -1, 'mincount': 1, 'sort': 'index'}})
 
-        Returns
-        -------
-        custom_q13: dict
-            Customized query Q13.
-        """
+        # ================================================================
+        # # Q16: getMostSimilarPairs
+        # ################################################################
+        # # Get the ids of the documents among which the most similar
+        # # pairs are searched (the pairs come from the similarity matrix
+        # # of the model, not from Solr)
+        # ================================================================
+        self.Q16 = QuerySpec(
+            'Q16', filters=[Filter('year', 'year')], fl='id')
 
-        custom_q13 = {
-            'q': self.Q13['q'].format(fund_sponsor),
-            'start': self.Q13['start'].format(start),
-            'rows': self.Q13['rows'].format(rows),
-        }
-        
-        return custom_q13
-    
-    def customize_Q14(self,
-                      start: str,
-                      rows: str) -> dict:
-        
-        """Customizes query Q14 'getTopicMap'
+        # ================================================================
+        # # Q18: getDocCounts
+        # ################################################################
+        # # Get the number of documents that match the filters of Q1-Q13
+        # # (any combination of them) per city, institution, funding
+        # # sponsor, country, year and open access, and per range of
+        # # the number of citations, without retrieving the documents
+        # ================================================================
+        # The affiliation fields are split on ';' when indexed, so that
+        # their facets count each value once per document. The ranges of
+        # 'citedby_count' are counted with facet queries because they do
+        # not have a fixed width (as facet.range requires)
+        self.Q18 = QuerySpec(
+            'Q18', rows=0,
+            filters=[Filter('openaccess', 'open_access'),
+                     Filter('year', 'year'),
+                     Filter('affiliation_continent', 'continent'),
+                     Filter('affiliation_city', 'city', kind=PHRASE, cache=False),
+                     Filter('affilname', 'institution', kind=PHRASE, cache=False),
+                     Filter('doctpc_{model_col}', 'topic_id'),
+                     Filter('citedby_count', ('lower_limit', 'upper_limit'),
+                            kind=RANGE, cache=False),
+                     Filter('fund_sponsor', 'fund_sponsor', kind=PHRASE, cache=False)],
+            facets={'affiliation_city': {'limit': 25, 'mincount': 1},
+                    'affilname': {'limit': 25, 'mincount': 1},
+                    'fund_sponsor': {'limit': 25, 'mincount': 1},
+                    'affiliation_country': {'limit': -1, 'mincount': 1},
+                    'openaccess': {'limit': -1, 'mincount': 1},
+                    'year': {'limit': -1, 'mincount': 1, 'sort': 'index'}},
+            facet_queries={'citedby_0_4': 'citedby_count:[0 TO 4]',
+                           'citedby_5_9': 'citedby_count:[5 TO 9]',
+                           'citedby_10_24': 'citedby_count:[10 TO 24]',
+                           'citedby_25': 'citedby_count:[25 TO *]'})
+
+        self.planner = QueryPlanner()
+
+    def get(self, name: str) -> QuerySpec:
+        """Returns the spec of the query with the given name (e.g., 'Q4')."""
+        return getattr(self, name)
+
+    def customize(self,
+                  name: str,
+                  page: dict = None,
+                  **values) -> dict:
+        """Customizes the query with the given name, i.e., builds the parameters (including 'q') of the Solr request that executes it.
 
         Parameters
         ----------
-        start: str
-            Start value.
-        rows: str
-            Number of rows to retrieve.
+        name: str
+            Name of the query (e.g., 'Q4').
+        page: dict
+            Paging parameters (see EWBSolrClient.paging_params), for paged queries.
+        **values
+            Values of the query (e.g., year=2020). Filters whose value is None are not applied.
 
         Returns
         -------
-        custom_q14: dict
-            Customized query Q14.
+        custom_q: dict
+            Customized query.
         """
 
-        custom_q14 = {
-            'q': self.Q14['q'],
-            'fl': self.Q14['fl'],
-            'start': self.Q14['start'].format(start),
-            'rows': self.Q14['rows'].format(rows),
-        }
-        
-        return custom_q14
\ No newline at end of file
+        return self.planner.plan(self.get(name), values, page=page)
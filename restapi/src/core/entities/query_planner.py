@@ -0,0 +1,210 @@
+"""
+This module provides the classes to describe the EWB queries declaratively (QuerySpec, Filter) and to plan the Solr requests that execute them (QueryPlanner).
+
+Planned requests follow Solr's cheapest execution path by default:
+
+    * Restrictive clauses go to 'fq' (constant score, intersected as bitsets) instead of the scored 'q', which stays '*:*' unless the query needs relevance.
+    * Values are passed through the 'term' / 'field' query parsers, so they need no escaping.
+    * Filters whose values are rarely repeated (e.g., a city or a funding sponsor) are sent with cache=false, so that they do not evict the reusable entries (e.g., a year or a continent) of the filter cache. Function range filters are also given a cost so that Solr runs them as post-filters.
+    * When no sort order is needed, documents are returned in index order ('_docid_ asc'), so that no scores are computed.
+
+Author: Lorena Calvo-Bartolomé
+Date: 27/06/2023
+"""
+
+from typing import Dict, List, Tuple, Union
+
+# Sort order of the queries that need neither relevance nor a specific order
+INDEX_ORDER = "_docid_ asc"
+
+# Kinds of filters
+TERM = "term"
+PHRASE = "phrase"
+RANGE = "range"
+FRANGE = "frange"
+
+
+class Filter(object):
+    """
+    A class to describe a filter of a query, whose value is given when the query is executed.
+    """
+
+    def __init__(self,
+                 field: str,
+                 param: Union[str, Tuple[str, str]],
+                 kind: str = TERM,
+                 cache: bool = True,
+                 cost: int = None) -> None:
+        """
+        Parameters
+        ----------
+        field : str
+            Field (or, for 'frange' filters, function) on which the filter is applied. It may contain placeholders for the values of the query (e.g., 'doctpc_{model_col}').
+        param : Union[str, Tuple[str, str]]
+            Name of the value of the query used by the filter or, for 'range' filters, names of the lower and upper limits. If the value is None, the filter is not applied.
+        kind : str, defaults to 'term'
+            Kind of filter: 'term' (exact match of an indexed term), 'phrase' (match of the analyzed value, as field:"value"), 'range' (field:[lower TO upper]) or 'frange' (lower limit on a function).
+        cache : bool, defaults to True
+            Whether the filter is kept in Solr's filter cache. It should be False for filters whose values are rarely repeated.
+        cost : int
+            Cost of the filter. Non-cached filters with cost >= 100 that support it (e.g., 'frange') are run as post-filters, only on the documents that match the rest of the query.
+        """
+        if kind not in (TERM, PHRASE, RANGE, FRANGE):
+            raise ValueError(f"Unknown filter kind {kind}")
+
+        self.field = field
+        self.param = param
+        self.kind = kind
+        self.cache = cache
+        self.cost = cost
+
+        return
+
+    def _local_params(self, parser: str = None, **extra) -> str:
+        params = [parser] if parser else []
+        params += ["{}={}".format(key, value) for key, value in extra.items()]
+        if not self.cache:
+            params.append("cache=false")
+        if self.cost is not None:
+            params.append("cost={}".format(self.cost))
+        return "{!" + " ".join(params) + "}" if params else ""
+
+    def to_fq(self, values: dict) -> Union[str, None]:
+        """Returns the filter query for the given values of the query, or None if the filter is not applied."""
+        field = self.field.format(**values)
+
+        if self.kind == RANGE:
+            lower, upper = (values.get(param) for param in self.param)
+            if lower is None and upper is None:
+                return None
+            return "{}{}:[{} TO {}]".format(
+                self._local_params(), field,
+                "*" if lower is None else lower,
+                "*" if upper is None else upper)
+
+        value = values.get(self.param)
+        if value is None:
+            return None
+        if self.kind == TERM:
+            return self._local_params("term", f=field) + str(value)
+        if self.kind == PHRASE:
+            return self._local_params("field", f=field) + str(value)
+        return self._local_params("frange", l=value) + field
+
+
+class QuerySpec(object):
+    """
+    A class to describe an EWB query: the collection it runs on, its filters, the fields it returns, its sort order and its facets.
+    """
+
+    def __init__(self,
+                 name: str,
+                 collection: str = "corpus",
+                 filters: List[Filter] = (),
+                 q: str = "*:*",
+                 fl: str = None,
+                 sort: str = None,
+                 facets: Dict[str, dict] = None,
+                 facet_queries: Dict[str, str] = None,
+                 rows: int = None) -> None:
+        """
+        Parameters
+        ----------
+        name : str
+            Name of the query (e.g., 'Q4'), used in the logs.
+        collection : str, defaults to 'corpus'
+            Kind of collection the query runs on: 'corpus', 'model' or 'any'.
+        filters : List[Filter]
+            Filters of the query.
+        q : str, defaults to '*:*'
+            Scored query. It should only differ from '*:*' if documents are ranked by relevance.
+        fl : str
+            Fields to return (it may contain placeholders for the values of the query). If None, all the stored fields are returned.
+        sort : str
+            Sort order of the documents (it may contain placeholders). If None, documents are returned in index order.
+        facets : Dict[str, dict]
+            Fields on which the documents are counted, with the options of each facet (e.g., {'year': {'limit': -1}}).
+        facet_queries : Dict[str, str]
+            Queries whose matching documents are counted, by the key under which their count is returned (e.g., {'open_access': 'openaccess:1'}). They count values of fields that cannot be faceted (e.g., point fields without docValues) or ranges.
+        rows : int
+            Fixed number of documents to return. If None, the query is paged.
+        """
+        if collection not in ("corpus", "model", "any"):
+            raise ValueError(f"Unknown collection kind {collection}")
+
+        self.name = name
+        self.collection = collection
+        self.filters = list(filters)
+        self.q = q
+        self.fl = fl
+        self.sort = sort
+        self.facets = facets or {}
+        self.facet_queries = facet_queries or {}
+        self.rows = rows
+
+        return
+
+    @property
+    def paged(self) -> bool:
+        return self.rows is None
+
+    def sort_for(self, values: dict) -> Union[str, None]:
+        """Returns the sort order of the query for the given values, or None if documents can be returned in any order."""
+        return self.sort.format(**values) if self.sort else None
+
+
+class QueryPlanner(object):
+    """
+    A class to build the parameters of the Solr requests that execute EWB queries.
+    """
+
+    def plan(self,
+             spec: QuerySpec,
+             values: dict = None,
+             page: dict = None) -> dict:
+        """Returns the parameters (including 'q') of the Solr request that executes the given query.
+
+        Parameters
+        ----------
+        spec : QuerySpec
+            The query.
+        values : dict
+            Values of the query (e.g., {'year': 2020}).
+        page : dict
+            Paging parameters ('start', 'rows' and, if cursor paging is used, 'cursorMark' and 'sort'), for paged queries.
+
+        Returns
+        -------
+        params : dict
+            Parameters of the request.
+        """
+        values = values or {}
+
+        params = {"q": spec.q.format(**values)}
+        fqs = [fq for fq in (flt.to_fq(values) for flt in spec.filters)
+               if fq is not None]
+        if fqs:
+            params["fq"] = fqs if len(fqs) > 1 else fqs[0]
+        if spec.fl:
+            params["fl"] = spec.fl.format(**values)
+
+        if spec.paged:
+            params.update(page or {})
+            params.setdefault("sort", spec.sort_for(values) or INDEX_ORDER)
+        else:
+            params["rows"] = str(spec.rows)
+            if spec.rows and spec.sort:
+                params["sort"] = spec.sort_for(values)
+
+        if spec.facets or spec.facet_queries:
+            params["facet"] = "true"
+        if spec.facets:
+            params["facet.field"] = list(spec.facets)
+            for field, options in spec.facets.items():
+                for option, value in options.items():
+                    params["f.{}.facet.{}".format(field, option)] = str(value)
+        if spec.facet_queries:
+            params["facet.query"] = ["{!key=" + key + "}" + query
+                                     for key, query in spec.facet_queries.items()]
+
+        return params
@@ -0,0 +1,311 @@
+"""
+This module provides a class to answer document-document similarity queries from the sparse similarity matrix of a topic model (TMmodel/distances.npz, i.e., the top-k cosine similarities among the square roots of the document-topic proportions), whose rows are in the order of the documents of the training corpus.
+
+When a model is indexed, its similarity matrix is persisted as a neighbor index: the CSR arrays of the matrix (with the neighbors of each document sorted by descending similarity), the ids of the documents, sorted so that they can be binary searched, and the most similar pairs of the whole corpus, so that unfiltered pair queries do not scan the matrix. The arrays are memory-mapped when the index is opened, so lookups read only the pages they touch and the index is shared (through the page cache) by all the workers, instead of being loaded into the heap of each of them.
+
+Author: Lorena Calvo-Bartolomé
+Date: 23/06/2023
+"""
+
+import contextlib
+import fcntl
+import os
+import pathlib
+import shutil
+import threading
+import uuid
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+from src.core.entities.model import read_corpus_ids
+
+# Arrays of a neighbor index, each one stored as '<name>.npy'
+_ARRAYS = ("indptr", "indices", "data", "ids", "sorted_ids", "sorted_rows",
+           "pair_rows_1", "pair_rows_2", "pair_scores")
+
+
+def _to_python(value):
+    """Converts numpy scalars (e.g., document ids) to Python objects, so that they can be serialized to JSON."""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def top_pairs(sims: sparse.csr_matrix,
+              rows: np.ndarray,
+              k: int) -> List[tuple]:
+    """Returns the k most similar pairs of documents among the given rows of a similarity matrix.
+
+    The matrix is restricted to the given rows and columns by sparse slicing (unless all the rows are considered) and symmetrized (a pair may only be among the top neighbours of one of its documents), and the k largest entries above the diagonal are selected with a partial sort.
+
+    Parameters
+    ----------
+    sims : sparse.csr_matrix
+        Square similarity matrix.
+    rows : np.ndarray
+        Positions of the documents to consider. If None, all the documents are considered.
+    k : int
+        Number of pairs to return.
+
+    Returns
+    -------
+    pairs : List[tuple]
+        Tuples (row_1, row_2, score), with row_1 < row_2, sorted by descending score.
+    """
+    if rows is None:
+        rows = np.arange(sims.shape[0])
+        sub = sims
+    else:
+        rows = np.unique(rows)
+        sub = sims[rows][:, rows]
+    sub = sparse.triu(sub.maximum(sub.T), k=1).tocoo()
+    if sub.nnz == 0 or k <= 0:
+        return []
+
+    top = np.argpartition(-sub.data, k - 1)[:k] if sub.nnz > k \
+        else np.arange(sub.nnz)
+    top = top[np.argsort(-sub.data[top], kind="stable")]
+
+    return list(zip(rows[sub.row[top]], rows[sub.col[top]], sub.data[top]))
+
+
+@contextlib.contextmanager
+def _build_lock(folder: pathlib.Path):
+    """Holds an exclusive lock on the neighbor index in the given folder, shared by all the processes that may build it."""
+    folder.parent.mkdir(parents=True, exist_ok=True)
+    with open(folder.with_name(folder.name + ".lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class NeighborIndex(object):
+    """
+    A class to hold the (memory-mapped) document similarity matrix of a model together with the ids of its documents.
+    """
+
+    # Indexes opened in the process, by folder
+    _opened: Dict[str, 'NeighborIndex'] = {}
+    _opened_lock = threading.Lock()
+
+    def __init__(self, folder: pathlib.Path) -> None:
+        """
+        Parameters
+        ----------
+        folder: pathlib.Path
+            Folder of the neighbor index (see build).
+        """
+        arrays = {name: np.load(folder.joinpath(name + ".npy"), mmap_mode="r")
+                  for name in _ARRAYS}
+        self.indptr = arrays["indptr"]
+        self.indices = arrays["indices"]
+        self.data = arrays["data"]
+        self.ids = arrays["ids"]
+        self._sorted_ids = arrays["sorted_ids"]
+        self._sorted_rows = arrays["sorted_rows"]
+        self._pairs = (arrays["pair_rows_1"], arrays["pair_rows_2"],
+                       arrays["pair_scores"])
+        self.folder = folder
+
+        return
+
+    @staticmethod
+    def folder_of(path_to_model: pathlib.Path) -> pathlib.Path:
+        """Returns the folder of the neighbor index of the given model."""
+        return path_to_model.joinpath("TMmodel").joinpath("neighbors")
+
+    @staticmethod
+    def is_built(folder: pathlib.Path) -> bool:
+        """Checks whether all the arrays of the neighbor index in the given folder have been persisted."""
+        return all(folder.joinpath(name + ".npy").is_file() for name in _ARRAYS)
+
+    @classmethod
+    def build(cls,
+              path_to_model: pathlib.Path,
+              pairs: int = 10000,
+              logger=None) -> pathlib.Path:
+        """Persists the neighbor index of the given model from its similarity matrix.
+
+        Parameters
+        ----------
+        path_to_model: pathlib.Path
+            Path to the model folder.
+        pairs : int, defaults to 10000
+            Number of most similar pairs of the whole corpus that are precomputed.
+        logger : logging.Logger
+            The logger object to log messages and errors.
+
+        Returns
+        -------
+        folder: pathlib.Path
+            Folder of the neighbor index.
+        """
+        folder = cls.folder_of(path_to_model)
+        with _build_lock(folder):
+            cls._build(path_to_model, folder, pairs=pairs, logger=logger)
+        return folder
+
+    @classmethod
+    def _build(cls,
+               path_to_model: pathlib.Path,
+               folder: pathlib.Path,
+               pairs: int = 10000,
+               logger=None) -> None:
+        """Persists the neighbor index of the given model in the given folder. The caller must hold the build lock of the folder (see build)."""
+        sims = sparse.load_npz(
+            path_to_model.joinpath("TMmodel").joinpath("distances.npz")).tocsr()
+        ids = np.asarray(read_corpus_ids(path_to_model, logger=logger))
+        if len(ids) != sims.shape[0]:
+            raise ValueError(
+                f"the similarity matrix has {sims.shape[0]} rows but the training corpus has {len(ids)} documents")
+        if ids.dtype == object:
+            # Fixed-width strings can be memory-mapped, Python objects cannot
+            ids = ids.astype(str)
+
+        # A document is not a neighbor of itself
+        sims.setdiag(0)
+        sims.eliminate_zeros()
+
+        # Sort the neighbors of each document by descending similarity
+        row_of = np.repeat(np.arange(sims.shape[0]), np.diff(sims.indptr))
+        order = np.lexsort((-sims.data, row_of))
+        sorted_rows = np.argsort(ids, kind="stable")
+        rows_1, rows_2, scores = zip(*top_pairs(sims, None, pairs)) \
+            if sims.nnz else ((), (), ())
+        arrays = {"indptr": sims.indptr.astype(np.int64),
+                  "indices": sims.indices[order].astype(np.int32),
+                  "data": sims.data[order].astype(np.float32),
+                  "ids": ids,
+                  "sorted_ids": ids[sorted_rows],
+                  "sorted_rows": sorted_rows.astype(np.int32),
+                  "pair_rows_1": np.asarray(rows_1, dtype=np.int32),
+                  "pair_rows_2": np.asarray(rows_2, dtype=np.int32),
+                  "pair_scores": np.asarray(scores, dtype=np.float32)}
+
+        # Write into a temporary folder of this process and swap it, so that readers never see a partial index
+        tmp_folder = folder.with_name(
+            "{}.tmp-{}-{}".format(folder.name, os.getpid(), uuid.uuid4().hex))
+        old_folder = tmp_folder.with_name(tmp_folder.name + ".old")
+        tmp_folder.mkdir(parents=True)
+        try:
+            for name, array in arrays.items():
+                np.save(tmp_folder.joinpath(name + ".npy"), array)
+            cls.unload(path_to_model)
+            if folder.exists():
+                # Indexes opened by other processes keep their (unlinked) files mapped
+                folder.rename(old_folder)
+            tmp_folder.rename(folder)
+        finally:
+            shutil.rmtree(tmp_folder, ignore_errors=True)
+            shutil.rmtree(old_folder, ignore_errors=True)
+
+        if logger:
+            logger.info(
+                f"-- -- Neighbor index of {path_to_model.stem} saved in {folder} ({len(ids)} documents, {sims.nnz} neighbors)")
+
+        return
+
+    @classmethod
+    def load(cls,
+             path_to_model: pathlib.Path,
+             logger=None) -> 'NeighborIndex':
+        """Returns the neighbor index of the given model (building it if it has not been persisted yet, e.g., for models indexed before the index existed), opening it only the first time it is requested in the process."""
+        folder = cls.folder_of(path_to_model)
+        key = folder.as_posix()
+        with cls._opened_lock:
+            index = cls._opened.get(key)
+        if index is None:
+            if not cls.is_built(folder):
+                # Only one process builds it; the others wait for it and open the result
+                with _build_lock(folder):
+                    if not cls.is_built(folder):
+                        cls._build(path_to_model, folder, logger=logger)
+            with cls._opened_lock:
+                index = cls._opened.setdefault(key, cls(folder))
+        return index
+
+    @classmethod
+    def unload(cls, path_to_model: pathlib.Path) -> None:
+        """Closes the neighbor index of the given model, if it was opened."""
+        with cls._opened_lock:
+            cls._opened.pop(cls.folder_of(path_to_model).as_posix(), None)
+        return
+
+    def matrix(self) -> sparse.csr_matrix:
+        """Returns the similarity matrix, backed by the memory-mapped arrays."""
+        n = len(self.ids)
+        return sparse.csr_matrix((self.data, self.indices, self.indptr),
+                                 shape=(n, n), copy=False)
+
+    def positions(self, ids: List) -> np.ndarray:
+        """Returns the rows of the similarity matrix of the documents with the given ids, skipping those not in the training corpus."""
+        ids = np.asarray(ids)
+        if self.ids.dtype.kind in "iu":
+            # Ids of integer type come from Solr as strings
+            ids = pd.to_numeric(ids, errors="coerce")
+        else:
+            ids = ids.astype(str)
+        if len(self._sorted_ids) == 0:
+            return np.array([], dtype=np.int32)
+        found = np.searchsorted(self._sorted_ids, ids)
+        found = np.minimum(found, len(self._sorted_ids) - 1)
+        match = self._sorted_ids[found] == ids
+        return np.asarray(self._sorted_rows[found[match]])
+
+    def neighbors(self,
+                  doc_id,
+                  k: int = 10) -> List[dict]:
+        """Returns the k documents most similar to the given one.
+
+        Parameters
+        ----------
+        doc_id
+            Id of the document.
+        k : int, defaults to 10
+            Number of documents to return.
+
+        Returns
+        -------
+        neighbors : List[dict]
+            Documents as dictionaries with keys 'id' and 'score', sorted by descending score, or None if the document is not in the training corpus.
+        """
+        rows = self.positions([doc_id])
+        if len(rows) == 0:
+            return None
+        start = self.indptr[rows[0]]
+        end = min(self.indptr[rows[0] + 1], start + max(int(k), 0))
+
+        return [{"id": _to_python(self.ids[col]), "score": float(score)}
+                for col, score in zip(self.indices[start:end], self.data[start:end])]
+
+    def top_pairs(self,
+                  ids: List = None,
+                  k: int = 100) -> List[dict]:
+        """Returns the k most similar pairs of documents among those with the given ids.
+
+        Parameters
+        ----------
+        ids : List
+            Ids of the documents to consider. If None, all the documents of the training corpus are considered.
+        k : int, defaults to 100
+            Number of pairs to return.
+
+        Returns
+        -------
+        pairs : List[dict]
+            Pairs as dictionaries with keys 'id_1', 'id_2' and 'score', sorted by descending score.
+        """
+        if ids is None and k <= len(self._pairs[0]):
+            # The most similar pairs of the whole corpus were computed when the index was built
+            pairs = zip(*(array[:max(int(k), 0)] for array in self._pairs))
+        elif ids is None:
+            pairs = top_pairs(self.matrix(), None, k)
+        else:
+            pairs = top_pairs(self.matrix(), self.positions(ids), k)
+
+        return [{"id_1": _to_python(self.ids[row_1]),
+                 "id_2": _to_python(self.ids[row_2]),
+                 "score": float(score)}
+                for row_1, row_2, score in pairs]
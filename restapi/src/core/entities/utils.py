@@ -6,12 +6,20 @@ Date: 12/04/2023
 """
 
 
-import math
 import random
-from datetime import datetime
+import re
+import time
 
 import numpy as np
-import pytz
+import pandas as pd
+from dateutil import tz
+
+# Characters that are not allowed in an XML document (see is_valid_xml_char_ordinal)
+_INVALID_XML_CHARS = re.compile(
+    "[^\u0009\u000A\u000D\u0020-\uD7FF\uE000-\uFFFD\U00010000-\U0010FFFF]")
+# Invalid characters in UTF-8: control characters (one byte) and U+FFFE, U+FFFF (surrogates cannot be encoded)
+_INVALID_XML_BYTES = bytes(c for c in range(0x20) if c not in (0x9, 0xA, 0xD))
+_INVALID_XML_UTF8 = (b"\xef\xbf\xbe", b"\xef\xbf\xbf")
 
 
 def is_valid_xml_char_ordinal(i):
@@ -32,40 +40,85 @@ def is_valid_xml_char_ordinal(i):
 def clean_xml_string(s):
     """
     Cleans string from invalid xml chars
-    Solution was found there::
-    http://stackoverflow.com/questions/8733233/filtering-out-certain-bytes-in-python
     """
-    return "".join(c for c in s if is_valid_xml_char_ordinal(ord(c)))
+    return _INVALID_XML_CHARS.sub("", s)
 
 
-def convert_datetime_to_strftime(df):
+def clean_xml_strings(values: pd.Series, chunk_size: int = 10000) -> pd.Series:
     """
-    Converts all columns of type datetime64[ns] in a dataframe to strftime format.
+    Cleans the strings of a column from invalid xml chars. The column is checked in chunks of joined strings at the byte level, and only the strings of the chunks with invalid chars are searched and rewritten; values that are not strings are kept as they are.
     """
-    columns = []
-    for column in df.columns:
-        if column == "date":
-            if df[column].dtype == "datetime64[ns]":
-                columns.append(column)
-                df[column] = df[column].dt.strftime("%Y-%m-%d %H:%M:%S")
-    return df, columns
+    array = values.to_numpy(dtype=object)
+    invalid = np.zeros(len(array), dtype=bool)
+    for start in range(0, len(array), chunk_size):
+        chunk = array[start:start + chunk_size]
+        try:
+            text = "".join(chunk)
+            data = text.encode("utf-8")
+            if len(data.translate(None, _INVALID_XML_BYTES)) == len(data) and \
+                    (text.isascii() or not any(c in data for c in _INVALID_XML_UTF8)):
+                continue
+        except (TypeError, UnicodeEncodeError):
+            # Chunk with values that are not strings (e.g., NaN) or with surrogates
+            pass
+        invalid[start:start + chunk_size] = pd.Series(chunk, dtype=object).str.contains(
+            _INVALID_XML_CHARS, na=False).to_numpy(dtype=bool)
+    if not invalid.any():
+        return values
+    values = values.copy()
+    values[invalid] = values[invalid].str.replace(
+        _INVALID_XML_CHARS, "", regex=True)
+    return values
 
 
-def parseTimeINSTANT(time):
+def _to_utc(dates: pd.Series) -> pd.Series:
     """
-    Parses a string representing an instant in time and returns it as an Instant object.
+    Converts a datetime column to UTC. Naive datetimes are taken in the local time of the machine, as datetime.astimezone does.
     """
-    format_string = '%Y-%m-%d %H:%M:%S'
-    if isinstance(time, str) and time != "foo":
-        dt = datetime.strptime(time, format_string)
-        dt_utc = dt.astimezone(pytz.UTC)
-        return clean_xml_string(dt_utc.strftime('%Y-%m-%dT%H:%M:%S.%fZ'))
-    elif time == "foo":
-        return clean_xml_string("")
+    if dates.dt.tz is not None:
+        return dates.dt.tz_convert("UTC")
+    # Local time is UTC in the containers of the API
+    if time.timezone == 0 and not time.daylight:
+        return dates.dt.tz_localize("UTC")
+    return dates.dt.tz_localize(tz.tzlocal(), ambiguous="NaT",
+                                nonexistent="shift_forward").dt.tz_convert("UTC")
+
+
+def to_solr_instants(values: pd.Series) -> pd.Series:
+    """
+    Converts a column of datetimes (or of strings in the '%Y-%m-%d %H:%M:%S' format) to the format required by Solr (ISO_INSTANT in UTC, e.g., '2011-12-03T10:15:30.000000Z'). Missing values (NaT, NaN) and "foo" are converted to "".
+
+    Raises
+    ------
+    ValueError
+        If a string is not in the expected format.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        dates = values
     else:
-        if math.isnan(time):
-            return clean_xml_string("")
-        
+        missing = values.isna() | (values == "foo")
+        dates = pd.to_datetime(values.where(~missing),
+                               format="%Y-%m-%d %H:%M:%S")
+
+    # Sub-second precision is dropped, as in the '%Y-%m-%d %H:%M:%S' format
+    instants = _to_utc(dates).dt.floor("s").dt.tz_localize(None) \
+        .to_numpy(dtype="datetime64[us]")
+    strings = np.datetime_as_string(instants, unit="us", timezone="UTC")
+    return pd.Series(np.where(np.isnat(instants), "", strings).astype(object),
+                     index=values.index, name=values.name)
+
+
+def convert_datetime_to_instant(df):
+    """
+    Converts the date column of a dataframe (if it is of a datetime type) to the format required by Solr (see to_solr_instants), in a single vectorized pass.
+    """
+    columns = []
+    if "date" in df.columns and pd.api.types.is_datetime64_any_dtype(df["date"]):
+        columns.append("date")
+        df["date"] = to_solr_instants(df["date"])
+    return df, columns
+
+
 def sum_up_to(vector: np.ndarray, max_sum: int) -> np.ndarray:
     """It takes in a vector and a max_sum value and returns a NumPy array with the same shape as vector but with the values adjusted such that their sum is equal to max_sum.
 